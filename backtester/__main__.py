@@ -0,0 +1,41 @@
+"""The command line to run backtests from config files, see runner.py for the format of the configs.
+
+    python -m backtester ibs.toml
+    python -m backtester sweep.toml other.json --processes 4 --output output/summary.csv
+
+Run it from the folder from which the data paths ('../data/') resolve, like the notebooks.
+"""
+
+import argparse
+import sys
+import time
+
+from backtester.runner import load_configs, run_configs
+
+
+def main(argv=None):
+    start = time.perf_counter()
+    parser = argparse.ArgumentParser(prog="python -m backtester", description="Runs backtests from config files.")
+    parser.add_argument("configs", nargs="+", help="the .toml or .json config files")
+    parser.add_argument(
+        "--processes", type=int, default=1, help="the amount of worker processes. 0 uses all CPUs. Defaults to 1."
+    )
+    parser.add_argument("--output", default=None, help="a CSV file for the statistics of all runs")
+    args = parser.parse_args(argv)
+
+    configs = [config for path in args.configs for config in load_configs(path)]
+    print(f"Loaded {len(configs)} run(s) in {time.perf_counter() - start:.3f}s")
+
+    results = run_configs(configs, processes=args.processes or None)
+
+    import pandas as pd
+
+    summary = pd.DataFrame(results).set_index("name")
+    print(summary.to_string())
+    if args.output is not None:
+        summary.to_csv(args.output)
+    print(f"Finished in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,5 +1,8 @@
+import asyncio
 import queue
+import time
 import backtester.performance as performance
+from backtester.memory import MB, MemoryMonitor
 from backtester.event import (
     MarketEvent,
     MarketCloseEvent,
@@ -22,6 +25,16 @@ class Backtest:
         data_handler,
         broker,
         portfolio,
+        keep_logs=True,
+        max_drawdown=None,
+        strategy_params=None,
+        data_handler_params=None,
+        results_store=None,
+        skip_existing=True,
+        plot=True,
+        trace=None,
+        memory_budget=None,
+        track_memory=False,
     ):
         """Initializes the backtest.
 
@@ -36,6 +49,16 @@ class Backtest:
             data_handler (DataHandler): the data handler
             broker (Broker): the broker
             portfolio (Portfolio): the portfolio object
+            keep_logs (bool, optional): whether to keep the portfolio log. If False, only the running statistics are reported. Defaults to True.
+            max_drawdown (float, optional): stop the backtest early if the drawdown exceeds this percentage (base 100). Defaults to None (never stop).
+            strategy_params (dict, optional): the keyword arguments for the strategy. Defaults to None.
+            data_handler_params (dict, optional): the extra keyword arguments for the data handler, e.g. the bars and calendar of the InMemoryDataHandler. Defaults to None.
+            results_store (ResultsStore, optional): store the results in this store instead of CSV files. Defaults to None.
+            skip_existing (bool, optional): skip the backtest if the same configuration is already in the results store. Defaults to True.
+            plot (bool, optional): whether to show the plot after the run. This blocks, so turn it off for batch jobs and use render_report(). Defaults to True.
+            trace (str, optional): record all events and bars in a binary trace at this path, see backtester/trace.py. Defaults to None.
+            memory_budget (float, optional): the memory budget of the components in MB. If it is exceeded at a market close, the logs are spilled to disk and then the bars of the least recently read symbols without a position are evicted (and reloaded when they are read again). Defaults to None (no budget).
+            track_memory (bool/str, optional): report the peak memory of every component, see backtester/memory.py. 'tracemalloc' also traces the allocations, which is slower. Defaults to False (only with a budget).
         """
         self.name = name
 
@@ -45,72 +68,328 @@ class Backtest:
         self.end_date = end_date
         self.timeframe = timeframe
         self.extended_hours = extended_hours
+        self.keep_logs = keep_logs
+        self.max_drawdown = max_drawdown
+        self.stopped_early = False
+        self.strategy_params = strategy_params if strategy_params is not None else {}
+        self.data_handler_params = data_handler_params if data_handler_params is not None else {}
+        self.plot = plot
+
+        # The results, available after the run
+        self.portfolio_log = None
+        self.fills_log = None
+        self.trade_log = None
+        self.statistics = None
+
+        # The results store and the ID of this configuration
+        self.results_store = results_store
+        self.skipped = False
+        if self.results_store is not None:
+            from backtester.results import get_code_fingerprint, get_run_id  # pyarrow is only needed with a store
+
+            self.parameters = {
+                "initial_capital": initial_capital,
+                "start_date": start_date,
+                "end_date": end_date,
+                "timeframe": timeframe,
+                "extended_hours": extended_hours,
+                "max_drawdown": max_drawdown,
+                "strategy": f"{strategy.__module__}.{strategy.__qualname__}",
+                **self.strategy_params,
+                "code_fingerprint": get_code_fingerprint(strategy),
+                "data_fingerprint": data_handler.get_data_fingerprint(timeframe, **self.data_handler_params),
+            }
+            self.run_id = get_run_id(self.parameters)
+            if skip_existing and self.results_store.has_run(self.run_id):
+                # Do not even create the components, because the strategy may already load data.
+                print(f"Skipping {self.name}: the configuration is already in the results store ({self.run_id}).")
+                self.skipped = True
+                return
+
+        # The memory accounting. It starts before the components, so tracemalloc also sees the loading of the data.
+        self.memory_monitor = None
+        self.memory_summary = None
+        self._last_memory_check = None  # The symbols that were read since the last check are in use
+        self._warned_memory_budget = False
+        if memory_budget is not None or track_memory:
+            self.memory_monitor = MemoryMonitor(
+                memory_budget, "tracemalloc" if track_memory == "tracemalloc" else "arrays"
+            )
 
         # The components of the backtester
         self.events = queue.Queue()  # List of events to handle
-        self.data_handler = data_handler(self.events, self.start_date, self.end_date, self.timeframe, extended_hours)
-        self.portfolio = portfolio(self.events, self.data_handler, self.start_date)
-        self.strategy = strategy(self.events, self.data_handler, self.portfolio)
+        self.data_handler = data_handler(
+            self.events, self.start_date, self.end_date, self.timeframe, extended_hours, **self.data_handler_params
+        )
+        self.portfolio = portfolio(
+            self.events,
+            self.data_handler,
+            self.start_date,
+            initial_capital=self.initial_capital,
+            keep_portfolio_log=self.keep_logs,
+        )
+        # The data handler only loads the columns that the strategy reads, unless they are set in the data_handler_params
+        if getattr(strategy, "columns", None) is not None and getattr(self.data_handler, "columns", False) is None:
+            self.data_handler.columns = strategy.columns
+        self.strategy = strategy(self.events, self.data_handler, self.portfolio, **self.strategy_params)
         self.broker = broker(self.events, self.data_handler)
 
+        # The event trace
+        self.trace_writer = None
+        if trace is not None:
+            from backtester.trace import TraceWriter
+
+            self.trace_writer = TraceWriter(
+                trace,
+                {
+                    "name": name,
+                    "initial_capital": initial_capital,
+                    "start_date": start_date,
+                    "end_date": end_date,
+                    "timeframe": timeframe,
+                    "extended_hours": extended_hours,
+                    "strategy": f"{strategy.__module__}.{strategy.__qualname__}",
+                    "strategy_params": self.strategy_params,
+                },
+            )
+
+    def _step(self):
+        self.data_handler.next()  # Step one bar
+        if self.trace_writer is not None:
+            self.trace_writer.record_tick(self.data_handler)
+        self._process_events()
+
     def _run_backtest(self):
         while True:
-            self.data_handler.next()  # Step one bar
-
-            while True:
-                try:
-                    event = self.events.get(False)
-                except queue.Empty:
-                    break
-                else:
-                    if isinstance(event, MarketEvent):
-                        self.strategy.calculate_signals()
-                    elif isinstance(event, BacktestEndEvent):
-                        self.strategy.on_backtest_end()
-                    elif isinstance(event, OrderEvent):
-                        self.broker.execute_order(event)
-                    elif isinstance(event, FillEvent):
-                        self.portfolio.update_from_fill(event)
-                    elif isinstance(event, MarketCloseEvent):
-                        self.strategy.on_market_close()
-                        self.portfolio.append_portfolio_log()
-                        # print(self.data_handler.current_time.isoformat())
-                        # print(self.portfolio._current_equity)
-
-            if not self.data_handler.continue_backtest:
+            self._step()
+
+            if not self.data_handler.continue_backtest or self.stopped_early:
+                break
+
+    def _process_events(self):
+        """Handles all events in the queue until it is empty."""
+        while True:
+            try:
+                event = self.events.get(False)
+            except queue.Empty:
                 break
+            else:
+                self._handle_event(event)
+
+    def _handle_event(self, event):
+        if self.trace_writer is not None:
+            self.trace_writer.record_event(event)
+
+        if isinstance(event, MarketEvent):
+            self.strategy.calculate_signals()
+        elif isinstance(event, BacktestEndEvent):
+            self.strategy.on_backtest_end()
+        elif isinstance(event, OrderEvent):
+            self.broker.execute_order(event)
+        elif isinstance(event, FillEvent):
+            self.portfolio.update_from_fill(event)
+        elif isinstance(event, MarketCloseEvent):
+            self.strategy.on_market_close()
+            self.portfolio.append_portfolio_log()
+            # print(self.data_handler.current_time.isoformat())
+            # print(self.portfolio._current_equity)
+            self._check_early_stop()
+            if self.memory_monitor is not None:
+                self._check_memory()
+
+    def _check_early_stop(self):
+        # Hopeless parameter sets do not have to run until the end.
+        if self.max_drawdown is not None and self.portfolio.metrics.current_drawdown > self.max_drawdown:
+            self.stopped_early = True
+
+    def memory_usage(self):
+        """Estimates the memory of the components, see backtester/memory.py.
+
+        Returns:
+            dict: the bytes of every part of every component, e.g. {'data_handler': {'all_bars': 1000, 'latest_bars': 500}, ...}
+        """
+        usage = {}
+        for name, component in [
+            ("data_handler", self.data_handler),
+            ("portfolio", self.portfolio),
+            ("strategy", self.strategy),
+        ]:
+            if hasattr(component, "memory_usage"):
+                usage[name] = component.memory_usage()
+        return usage
+
+    def _check_memory(self):
+        since, self._last_memory_check = self._last_memory_check, self.data_handler.current_time
+        total = self.memory_monitor.update(self.memory_usage())
+        if not self.memory_monitor.is_over_budget(total):
+            return
+
+        # Spilling the logs does not change the backtest, so that goes first
+        if hasattr(self.portfolio, "spill_logs"):
+            self.portfolio.spill_logs()
+            total = sum(size for parts in self.memory_usage().values() for size in parts.values())
+        if not self.memory_monitor.is_over_budget(total) or since is None:
+            return  # Before the first bar, the strategy has not read any symbols yet
+
+        # The symbols with a position are needed for the holdings, the symbols that were read since the last check are in use
+        positions = [symbol for symbol, position in self.portfolio.current_positions.items() if position != 0]
+        nbytes = total - self.memory_monitor.budget * MB
+        evicted = self.data_handler.evict_least_recently_used(nbytes, positions, since)
+        if len(evicted) > 0:
+            print(
+                f"Evicted the bars of {len(evicted)} symbols at {self.data_handler.current_time} to stay within the memory budget of {self.memory_monitor.budget} MB. They are reloaded when they are read again."
+            )
+        elif not self._warned_memory_budget:
+            # The symbols in use are never evicted, so the budget is too small for the strategy
+            print(
+                f"Warning: the backtest uses more than the memory budget of {self.memory_monitor.budget} MB at {self.data_handler.current_time}, but all loaded symbols are in use."
+            )
+            self._warned_memory_budget = True
+
+    def _add_memory_summary(self):
+        # The peak memory is also a statistic, so it ends up in the results store
+        if self.memory_monitor is not None:
+            self.memory_monitor.update(self.memory_usage())
+            self.memory_summary = self.memory_monitor.get_summary()
+            self.statistics["Peak memory MB"] = self.memory_summary["Peak memory MB"]
 
     def run(self):
+        if self.skipped:
+            return
+
         # Run backtest
         self._run_backtest()
         self._process_results()
 
     def _process_results(self):
+        if self.trace_writer is not None:
+            self.trace_writer.close()
+
+        if self.stopped_early:
+            print(
+                f"The backtest stopped early at {self.data_handler.current_time} because the drawdown exceeded {self.max_drawdown}%."
+            )
+
+        if not self.keep_logs:
+            # Only the running statistics are available
+            self.statistics = self.portfolio.metrics.get_statistics()
+            self._add_memory_summary()
+            print(self.statistics)
+            if self.results_store is not None:
+                self.results_store.save(self.run_id, self.name, self.parameters, self.statistics)
+            return
+
         # Retrieve portfolio log and trade log
-        portfolio_log = self.portfolio.create_df_from_holdings_log()
-        portfolio_log.to_csv(f"output/{self.name}_portfolio_log.csv")
-        fills_log = self.portfolio.create_df_from_fills_log()
-        fills_log.to_csv(f"output/{self.name}_fills_log.csv")
+        self.portfolio_log = self.portfolio.create_df_from_holdings_log()
+        self.fills_log = self.portfolio.create_df_from_fills_log()
 
-        # Create trade log from fill log
-        trade_log = performance.fills_to_trades(fills_log)
-        trade_log.to_csv(f"output/{self.name}_trade_log.csv")
+        # The trades are already matched during the backtest
+        self.trade_log = self.portfolio.create_df_from_trade_log()
 
         # Create statistics from portfolio, fills and trade log.
-        statistics = {
-            "Annual return %": performance.calculate_annual_return(portfolio_log),
-            "Sharpe": performance.calculate_sharpe(portfolio_log),
-            "Sortina": performance.calculate_sortina(portfolio_log),
-            "Winning months %": performance.calculate_winning_months(portfolio_log),
-            "Time in market %": performance.calculate_time_in_market(portfolio_log),
-            "Average profit %": performance.calculate_average_profit(trade_log),
-            "Average duration per trade": f"{performance.calculate_average_trade_duration(trade_log)[0]}d{performance.calculate_average_trade_duration(trade_log)[1]}h{performance.calculate_average_trade_duration(trade_log)[2]}m",
-            "Profit factor": performance.calculate_profit_factor(trade_log),
-            "Trades/month": performance.calculate_trades_per_month(portfolio_log, trade_log),
-            "Annual fees %": performance.calculate_fees_drag(portfolio_log, fills_log),
-        }
-
-        print(statistics)
+        report = performance.PerformanceReport(self.portfolio_log, self.fills_log, self.trade_log)
+        self.statistics = report.get_statistics()
+        self._add_memory_summary()
+
+        print(self.statistics)
+
+        if self.results_store is not None:
+            self.results_store.save(
+                self.run_id,
+                self.name,
+                self.parameters,
+                self.statistics,
+                self.portfolio_log,
+                self.fills_log,
+                self.trade_log,
+            )
+        else:
+            self.portfolio_log.to_csv(f"output/{self.name}_portfolio_log.csv")
+            self.fills_log.to_csv(f"output/{self.name}_fills_log.csv")
+            self.trade_log.to_csv(f"output/{self.name}_trade_log.csv")
 
         # Plot
-        performance.plot_fig(portfolio_log)
+        if self.plot:
+            performance.plot_fig(self.portfolio_log, title=self.name)
+
+    def render_report(self, path, max_points=2000):
+        """Renders the report of the run to a static file (e.g. .png or .svg) without a window.
+
+        Args:
+            path (str): the file path
+            max_points (int, optional): the maximum amount of points per line. Defaults to 2000.
+        """
+        from backtester.report import render_report
+
+        render_report(self.portfolio_log, path, title=self.name, max_points=max_points)
+
+
+class AsyncBacktest(Backtest):
+    """Runs the backtest in an asyncio event loop with an AsyncReplayPolygonDataHandler.
+
+    The data handler releases the bars at the replay speed, while the strategy, broker and portfolio await them. If the strategy is slower than the feed, the bars pile up and the latency grows, just like in live trading.
+    For every bar we record the delay between its arrival and the moment we start processing it. For every order we record the latency between the arrival of the bar and the moment the order reaches the broker.
+    """
+
+    def __init__(self, *args, speed=None, **kwargs):
+        """Initializes the backtest. See Backtest for the other arguments.
+
+        Args:
+            speed (float, optional): the replay speed. 1 is real time, 60 means one 1-minute bar per second. Defaults to None (as fast as possible).
+        """
+        super().__init__(*args, **kwargs)
+        if self.skipped:
+            return
+        self.data_handler.speed = speed
+
+        self._bar_arrival = None
+        self.bar_delays = []  # Seconds between bar arrival and the start of processing
+        self.order_latencies = []  # Seconds between bar arrival and the order reaching the broker
+
+    async def _run_backtest_async(self):
+        arrivals = asyncio.Queue()
+        feed = asyncio.create_task(self.data_handler.replay(arrivals))
+
+        while True:
+            self._bar_arrival = await arrivals.get()
+            self.bar_delays.append(time.perf_counter() - self._bar_arrival)
+
+            self._step()
+
+            if not self.data_handler.continue_backtest or self.stopped_early:
+                break
+
+            # Give the feed the chance to release the next bar if it is due.
+            await asyncio.sleep(0)
+
+        feed.cancel()  # The feed is still running if we stopped early
+
+    def _handle_event(self, event):
+        if isinstance(event, OrderEvent):
+            self.order_latencies.append(time.perf_counter() - self._bar_arrival)
+        super()._handle_event(event)
+
+    async def run_async(self):
+        # Use this one if an event loop is already running, e.g. in a notebook.
+        if self.skipped:
+            return
+        await self._run_backtest_async()
+        self._process_results()
+        self._print_latencies()
+
+    def run(self):
+        if self.skipped:
+            return
+        asyncio.run(self._run_backtest_async())
+        self._process_results()
+        self._print_latencies()
+
+    def _print_latencies(self):
+        bar_interval = self.data_handler._get_bar_interval()
+        print(
+            {
+                "Bar delay (ms)": performance.calculate_latency_statistics(self.bar_delays),
+                "Order latency (ms)": performance.calculate_latency_statistics(self.order_latencies),
+                "Late bars %": performance.calculate_late_bars(self.bar_delays, bar_interval),
+            }
+        )
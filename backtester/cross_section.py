@@ -0,0 +1,66 @@
+"""Vectorized helpers for cross-sectional strategies, e.g. to rank the universe every period.
+
+They work on the matrices of DataHandler.get_cross_section(): the symbols are the last axis, so a helper works on one cross-section (a row) or on all rows at once. NaN (no data) is ignored.
+
+    symbols, closes = self.data_handler.get_cross_section("close", N=21)
+    momentum = closes[-1] / closes[0] - 1
+    winners = [symbols[i] for i in top_k(momentum, 10)]
+"""
+
+import warnings
+
+import numpy as np
+import pandas as pd
+
+
+def rank(values, ascending=True, pct=False):
+    """Ranks the symbols. Ties get the average rank, like pandas.
+
+    Args:
+        values (ndarray): a cross-section or a matrix with a cross-section per row
+        ascending (bool, optional): whether the smallest value gets rank 1. Defaults to True.
+        pct (bool, optional): whether to return the ranks as a fraction of the amount of values. Defaults to False.
+
+    Returns:
+        ndarray: the ranks, NaN where the value is NaN
+    """
+    values = np.asarray(values, dtype=np.float64)
+    ranks = pd.DataFrame(np.atleast_2d(values)).rank(axis=1, ascending=ascending, pct=pct).to_numpy()
+    return ranks.reshape(values.shape)
+
+
+def zscore(values, ddof=0):
+    """Standardizes the symbols: subtracts the mean of the cross-section and divides by its standard deviation.
+
+    Args:
+        values (ndarray): a cross-section or a matrix with a cross-section per row
+        ddof (int, optional): the delta degrees of freedom of the standard deviation. Defaults to 0.
+
+    Returns:
+        ndarray: the z-scores, NaN where the value is NaN or the standard deviation is 0
+    """
+    values = np.asarray(values, dtype=np.float64)
+    with warnings.catch_warnings(), np.errstate(divide="ignore", invalid="ignore"):
+        warnings.simplefilter("ignore", RuntimeWarning)  # A cross-section with only NaN
+        mean = np.nanmean(values, axis=-1, keepdims=True)
+        std = np.nanstd(values, axis=-1, ddof=ddof, keepdims=True)
+        return np.where(std > 0, (values - mean) / std, np.nan)
+
+
+def top_k(values, k, largest=True):
+    """Selects the k symbols with the largest (or smallest) values of a cross-section.
+
+    Args:
+        values (ndarray): a cross-section
+        k (int): the amount of symbols. Less if there are less values that are not NaN.
+        largest (bool, optional): whether to select the largest values. Defaults to True.
+
+    Returns:
+        ndarray: the indices of the symbols, best first
+    """
+    values = np.asarray(values, dtype=np.float64)
+    indices = np.flatnonzero(~np.isnan(values))
+    scores = -values[indices] if largest else values[indices]
+
+    # A stable sort keeps ties in the order of the symbols, so the selection is deterministic
+    return indices[np.argsort(scores, kind="stable")[:k]]
@@ -1,10 +1,25 @@
+import asyncio
+import collections
+import hashlib
+import heapq
+import itertools
+import time as timer
 import pandas as pd
 import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
 
 from datetime import date, time
 from backtester.event import MarketEvent, MarketCloseEvent, BacktestEndEvent
-from polygon.data import get_data
-from polygon.times import get_market_minutes, get_market_calendar, get_market_dates
+from backtester.memory import get_size
+from polygon.data import get_data, get_data_fingerprint
+from polygon.times import (
+    format_market_calendar,
+    get_calendar_minutes,
+    get_market_calendar,
+    get_market_dates,
+    get_market_minutes,
+)
 
 
 class DataHandler:
@@ -38,13 +53,27 @@ class DataHandler:
         raise NotImplementedError("This is just an interface! Use the implementation.")
 
 
-class HistoricalPolygonDataHandler(DataHandler):
-    def __init__(self, events, start_date, end_date, timeframe, extended_hours=True):
+class HistoricalDataHandler(DataHandler):
+    """The clock, the scheduled events and the latest bars of a backtest.
+    The subclasses decide where the market minutes, the calendar and the bars come from.
+    """
+
+    def __init__(self, events, start_date, end_date, timeframe, extended_hours=True, anchor="midnight"):
         self.events = events
 
         self.timeframe = timeframe
+        self.extended_hours = extended_hours
+        self.anchor = anchor  # Where the intraday bars start, see polygon.times.get_bar_labels()
         self._latest_bars = {}  # A FIFO queue with N length may be better
         self._all_bars = {}
+        self._indicators = {}  # {'sma200': (function, column)}, see register_indicator()
+        # {'AAPL': the time of the last get_latest_bars/get_latest_values}, see evict_least_recently_used()
+        self._last_access = {}
+        self._load_arguments = {}  # {'AAPL': the arguments of load_data()}, to reload evicted symbols
+        self._evicted = {}  # {'AAPL': what is needed to restore the latest bars}, see _evict()
+        self.gap_reports = {}  # {'AAPL': the report of load_data()}, see get_gap_report()
+        # {'AAPL': its column in get_cross_section()}, only grows until compact_cross_section()
+        self._cross_section_columns = {}
 
         self.current_time = None
         self._time_to_stop = None
@@ -52,12 +81,41 @@ class HistoricalPolygonDataHandler(DataHandler):
 
         # On the intraday timeframes, we need the market calendar and scheduled events.
         if isinstance(self.timeframe, int):
-            self.calendar = get_market_calendar("datetime", self.timeframe)
+            self.calendar = self._get_calendar()
             # The potential times to check of scheduled events like market close. The reason we check times first is because for some reason this is much faster than checking the datetimes...
-            self._potential_scheduled_times = list(np.unique(get_market_calendar("time", self.timeframe)))
+            self._potential_scheduled_times = list(np.unique(pd.DatetimeIndex(self.calendar.values.ravel()).time))
+
+        # The listings that drive load_data/unload_data. See set_universe().
+        self._universe = None
+        self._universe_date = None
 
         self.continue_backtest = True
 
+    @classmethod
+    def get_data_fingerprint(cls, timeframe, **kwargs):
+        """Gets a fingerprint of the data, for the run ID in the results store. None if unknown.
+
+        Args:
+            timeframe (int/str): the timeframe in minutes or 'daily'
+            **kwargs: the extra arguments of the data handler
+
+        Returns:
+            str: the fingerprint
+        """
+        return None
+
+    def _get_market_minutes(self, start_date, end_date, extended_hours):
+        """Gets the datetimes of the clock on the intraday timeframes."""
+        raise NotImplementedError("This is just an interface! Use the implementation.")
+
+    def _get_market_dates(self, start_date, end_date):
+        """Gets the dates of the clock on the daily timeframe."""
+        raise NotImplementedError("This is just an interface! Use the implementation.")
+
+    def _get_calendar(self):
+        """Gets the market calendar in the 'datetime' format, see polygon.times.get_market_calendar()."""
+        raise NotImplementedError("This is just an interface! Use the implementation.")
+
     def _initiate_clock(self, start_date, end_date, extended_hours):
         # This is obviously not necessary for live trading.
         """Sets the start and end time and initiates the clock
@@ -72,13 +130,14 @@ class HistoricalPolygonDataHandler(DataHandler):
         """
         # if self.timeframe is int, that means intraday
         if isinstance(self.timeframe, int):
-            market_minutes = get_market_minutes(start_date, end_date, extended_hours, self.timeframe)
+            market_minutes = self._get_market_minutes(start_date, end_date, extended_hours)
         elif self.timeframe == "daily":
-            market_minutes = get_market_dates(start_date, end_date)
+            market_minutes = self._get_market_dates(start_date, end_date)
             market_minutes = pd.to_datetime(market_minutes)
 
         self.current_time = market_minutes[0]
         self._time_to_stop = market_minutes[-1]
+        self._market_minutes = market_minutes
 
         return self._create_clock(market_minutes)
 
@@ -127,6 +186,249 @@ class HistoricalPolygonDataHandler(DataHandler):
         """
         return self.calendar.loc[self.current_time.date(), "regular_close"]
 
+    def get_loaded_symbols(self):
+        """Get the loaded symbols
+
+        Returns:
+            list: list of symbols
+        """
+        if len(self._all_bars) == 0:
+            return list()
+        else:
+            return list(self._all_bars.keys())
+
+    def get_gap_report(self):
+        """Gets the gap reports of the loaded symbols, see align_bars(). The handlers that do not fill the gaps count the missing bars as filled.
+
+        Returns:
+            DataFrame: a row per symbol
+        """
+        return pd.DataFrame.from_dict(
+            {symbol: self.gap_reports[symbol] for symbol in self.get_loaded_symbols()},
+            orient="index",
+            columns=["bars", "filled", "longest_gap", "off_clock"],
+        )
+
+    def unload_data(self, symbol):
+        """Unloads the data of a symbol."""
+        raise NotImplementedError("This is just an interface! Use the implementation.")
+
+    def memory_usage(self):
+        """Estimates the memory of the bars, see backtester/memory.py.
+
+        Returns:
+            dict: the bytes of all bars and of the latest bars
+        """
+        return {"all_bars": get_size(self._all_bars), "latest_bars": get_size(self._latest_bars)}
+
+    def evict_least_recently_used(self, nbytes, keep=(), since=None):
+        """Evicts the bars of the symbols that were not read for the longest time (with get_latest_bars or get_latest_values) until about nbytes is freed.
+        The symbols that were never read go first, in the order in which they were loaded. An evicted symbol stays loaded: its bars are loaded again when it is read, with the arguments of load_data(), and the latest bars are the same as without eviction.
+        Data handlers that cannot reload the bars (the EventTimeDataHandler) do not evict anything.
+
+        Args:
+            nbytes (int): the bytes to free
+            keep (iterable, optional): the symbols that may not be evicted, e.g. the open positions. Defaults to none.
+            since (datetime, optional): the symbols that were read at or after this time are in use and are not evicted. Defaults to None (all may be evicted).
+
+        Returns:
+            list: the evicted symbols
+        """
+        keep = set(keep)
+        # Only the symbols that were loaded with load_data() can be loaded again
+        symbols = [
+            symbol
+            for symbol in self.get_loaded_symbols()
+            if symbol not in keep and symbol not in self._evicted and symbol in self._load_arguments
+        ]
+        if since is not None:
+            symbols = [symbol for symbol in symbols if self._last_access.get(symbol, pd.Timestamp.min) < since]
+        symbols.sort(key=lambda symbol: self._last_access.get(symbol, pd.Timestamp.min))
+
+        evicted = []
+        for symbol in symbols:
+            if nbytes <= 0:
+                break
+            nbytes -= get_size(self._all_bars[symbol]) + get_size(self._latest_bars.get(symbol, []))
+            self._evict(symbol)
+            evicted.append(symbol)
+        return evicted
+
+    def _evict(self, symbol):
+        """Drops the bars of a symbol but keeps what is needed to restore them, see _reload()."""
+        raise NotImplementedError("This is just an interface! Use the implementation.")
+
+    def _reload(self, symbol):
+        """Loads the bars of an evicted symbol again, see evict_least_recently_used()."""
+        raise NotImplementedError("This is just an interface! Use the implementation.")
+
+    def _read(self, symbol):
+        """Marks a symbol as read by the strategy and reloads it if it was evicted."""
+        self._last_access[symbol] = self.current_time
+        if symbol in self._evicted:
+            self._reload(symbol)
+
+    def get_latest_values(self, symbol, column, N=1):
+        """Get the most recent values of a column without creating a DataFrame
+
+        Args:
+            symbol (str): the ticker or ID
+            column (str): the column, e.g. 'close'
+            N (int, optional): the amount of values. Defaults to 1.
+
+        Returns:
+            ndarray: the values
+        """
+        raise NotImplementedError("This is just an interface! Use the implementation.")
+
+    def get_cross_section(self, column, N=1, symbols=None):
+        """Get the latest N values of a column of all loaded symbols as one matrix, e.g. to rank the universe. See backtester/cross_section.py for the helpers.
+        The symbol index is stable: a symbol keeps its column for the whole backtest and new symbols are appended. The column of an unloaded symbol is NaN (also when it is loaded again, it gets its old column back), until compact_cross_section() drops it. So the column of a symbol can be cached.
+        A symbol with less than N bars is padded with NaN at the top.
+
+        Args:
+            column (str): the column, e.g. 'close'
+            N (int, optional): the amount of bars. Defaults to 1.
+            symbols (list, optional): the symbols, in the order of the columns. Defaults to the symbol index (all symbols that were loaded since the last compact_cross_section()).
+
+        Returns:
+            tuple: the symbols and a float matrix of N rows (oldest first) and a column per symbol
+        """
+        loaded = self.get_loaded_symbols()
+        if symbols is None:
+            for symbol in loaded:
+                self._cross_section_columns.setdefault(symbol, len(self._cross_section_columns))
+            symbols = list(self._cross_section_columns)
+        else:
+            symbols = list(symbols)
+
+        loaded = set(loaded)
+        matrix = np.full((N, len(symbols)), np.nan)
+        for i, symbol in enumerate(symbols):
+            if symbol not in loaded:
+                continue
+            values = self.get_latest_values(symbol, column, N)
+            if len(values) > 0:
+                matrix[N - len(values) :, i] = values
+        return symbols, matrix
+
+    def compact_cross_section(self):
+        """Drops the unloaded symbols from the symbol index of get_cross_section(). The symbols after them move to the left, so look up the cached columns again.
+
+        Returns:
+            list: the symbols of the new index, in the order of the columns
+        """
+        loaded = set(self.get_loaded_symbols())
+        symbols = [symbol for symbol in self._cross_section_columns if symbol in loaded]
+        self._cross_section_columns = {symbol: column for column, symbol in enumerate(symbols)}
+        return symbols
+
+    def register_indicator(self, name, function, column="close"):
+        """Registers an indicator that is computed at once over all bars of a symbol when it is loaded, including the lookback bars (see load_data()). It becomes a column of the bars with the name of the indicator.
+        The function must only use past values (like a rolling mean or an EMA), because the values of future bars are also passed. Register the indicators before loading the data, because the latest bars that were already added do not get the column.
+
+            data_handler.register_indicator("sma200", lambda close: close.rolling(200).mean())
+            data_handler.register_indicator("ema20", lambda close: kernels.ema(close, 20))
+
+        Args:
+            name (str): the name of the column
+            function (callable): gets the column as a Series and returns the values of the indicator for all bars
+            column (str, optional): the column to compute the indicator on. Defaults to 'close'.
+        """
+        self._indicators[name] = (function, column)
+        for symbol in self.get_loaded_symbols():
+            # The evicted symbols get it when they are reloaded
+            if symbol not in self._evicted:
+                self._add_indicator(symbol, name)
+
+    def _add_indicators(self, symbol):
+        for name in self._indicators:
+            self._add_indicator(symbol, name)
+
+    def _add_indicator(self, symbol, name):
+        """Computes an indicator over all bars of a symbol and adds it as a column."""
+        raise NotImplementedError("This is just an interface! Use the implementation.")
+
+    def _update_bars(self):
+        """Adds the bars of the current time to the latest bars."""
+        raise NotImplementedError("This is just an interface! Use the implementation.")
+
+    def next(self):
+        """Simulates a passed minute by appending self.latest_bars and generating a MarketEvent.
+
+        Args:
+            dt (Datetime): the datetime minute to which we update.
+        """
+        # Let the clock 'tick'
+        self.current_time = next(self._clock)
+        if self.current_time == self._time_to_stop:
+            self.continue_backtest = False
+
+        # Check if market open/market close.
+        # Note: Only the market close/backtest end is necessary because these cannot be easily checked because they are variable. However other scheduled events can be programmed in the Strategy itself easily by checking the current_time.
+        scheduled_events = self._check_time(self.current_time)
+        for event in scheduled_events:
+            self.events.put(event)
+
+        # Update the universe at the first bar of a new date
+        if self._universe is not None and self.current_time.date() != self._universe_date:
+            self._update_universe()
+
+        # Update data
+        self._update_bars()
+
+        self.events.put(MarketEvent())
+
+    def skip_to_future(self, dt):
+        """Sets the clock to a specific time to avoid unnecessary looping. Use with caution. This does not load data.
+
+        Args:
+            dt (datetime): the datetime to which to skip to
+        """
+        while self.current_time < dt:
+            self.current_time = next(self._clock)
+
+
+class HistoricalPolygonDataHandler(HistoricalDataHandler):
+    """Plays the bars of the Polygon database. The clock follows the market calendar of the database."""
+
+    def __init__(
+        self,
+        events,
+        start_date,
+        end_date,
+        timeframe,
+        extended_hours=True,
+        anchor="midnight",
+        columns=None,
+        compact=False,
+    ):
+        """Initializes the data handler.
+
+        Args:
+            columns (list, optional): the columns to load by default, see load_data(). The Backtest sets the columns of the strategy. Defaults to all.
+            compact (bool/str, optional): how to compact the bars by default, see compact_bars(). Defaults to False.
+        """
+        self.columns = columns
+        self.compact = compact
+        self._first_positions = {}  # {'AAPL': the position on the clock of the first bar}
+        self._lookbacks = {}  # {'AAPL': the amount of bars before the first bar on the clock}
+        self._position = -1  # The position of the current time on the clock
+        super().__init__(events, start_date, end_date, timeframe, extended_hours, anchor)
+
+    @classmethod
+    def get_data_fingerprint(cls, timeframe, anchor="midnight", **kwargs):
+        return get_data_fingerprint(timeframe, anchor=anchor)
+
+    def _get_market_minutes(self, start_date, end_date, extended_hours):
+        return get_market_minutes(start_date, end_date, extended_hours, self.timeframe, self.anchor)
+
+    def _get_market_dates(self, start_date, end_date):
+        return get_market_dates(start_date, end_date)
+
+    def _get_calendar(self):
+        return get_market_calendar("datetime", self.timeframe, self.anchor)
+
     def load_data(
         self,
         symbol,
@@ -134,26 +436,110 @@ class HistoricalPolygonDataHandler(DataHandler):
         end_date=date(2100, 1, 1),
         timeframe=1,
         extended_hours=True,
+        fill_policy="ffill",
+        lookback=0,
+        columns=None,
+        compact=None,
     ):
         # In live trading we either load this from a data vendor or broker.
-        """Loads the data. You should build your own 'get_data' function if you use another database. There should be no time gaps!
+        """Loads the data. You should build your own 'get_data' function if you use another database.
+        The bars are aligned to the clock once, see align_bars(): gaps between the first and last bar are filled and bars that are not on the clock are dropped. So every bar can be looked up by its position on the clock.
+        With a lookback, the bars before the first bar on the clock are loaded too and added to the latest bars at once. So the indicators are warmed up at the first bar, without running the backtest over a warm-up period.
 
         Args:
             symbol (str): the ticker or ID
             start (datetime/date, optional): the start date(time) (inclusive). Defaults to no bounds.
             end (datetime/date, optional): the end date(time) (inclusive). Defaults to no bounds.
-            timeframe (str, optional): the timeframe of the bar in minutes or 'daily' for daily bars.
+            timeframe (str, optional): the timeframe of the bar in minutes or 'daily' for daily bars. Timeframes other than 1 and 5 are derived from the 1-minute bars and cached, see polygon.data.get_data().
             extended_hours (bool, optional): whether we need to keep extended hours. Defaults to True.
+            fill_policy (str, optional): how to fill the gaps, see align_bars(). Defaults to 'ffill'.
+            lookback (int, optional): the amount of bars before the first bar on the clock to add to the latest bars. These are not aligned. Defaults to 0.
+            columns (list, optional): the columns to read from the database. The close is always read, because the portfolio and the broker need it. Defaults to the columns of the data handler (all by default).
+            compact (bool/str, optional): True to store the volume as integers and the flags as bool, 'float32' to store the prices as float32 as well, see compact_bars(). Defaults to the setting of the data handler.
+
+        Returns:
+            dict: the gap report, see align_bars()
+        """
+        self._load_arguments[symbol] = dict(
+            start_date=start_date,
+            end_date=end_date,
+            timeframe=timeframe,
+            extended_hours=extended_hours,
+            fill_policy=fill_policy,
+            lookback=lookback,
+            columns=columns,
+            compact=compact,
+        )
+        self._evicted.pop(symbol, None)
+        columns = self.columns if columns is None else columns
+        if columns is not None and "close" not in columns:
+            columns = [*columns, "close"]
+        compact = self.compact if compact is None else compact
+
+        history, aligned, self.gap_reports[symbol] = self._get_aligned_bars(
+            symbol, start_date, end_date, timeframe, extended_hours, fill_policy, lookback, columns
+        )
+        if len(aligned) > 0:
+            self._all_bars[symbol] = pd.concat([history, aligned]) if len(history) > 0 else aligned
+            self._first_positions[symbol] = self._market_minutes.get_loc(aligned.index[0])
+        else:
+            self._all_bars[symbol] = aligned
+            self._first_positions[symbol] = 0
+        self._lookbacks[symbol] = len(history)
+        if compact:
+            self._all_bars[symbol] = compact_bars(self._all_bars[symbol], float32=compact == "float32")
+
+        self._add_indicators(symbol)
+        bars = self._all_bars[symbol]
+        self._latest_bars[symbol] = [bars.iloc[row] for row in range(len(history))]
+        return self.gap_reports[symbol]
+
+    def _get_aligned_bars(
+        self, symbol, start_date, end_date, timeframe, extended_hours, fill_policy, lookback, columns=None
+    ):
+        """Gets the bars from the database and aligns them to the clock, see load_data(). Only the columns are read from the Parquet files.
+
+        Returns:
+            tuple: the lookback bars before the first aligned bar, the aligned bars and the gap report
         """
-        self._latest_bars[symbol] = []
+        history_start = start_date
+        if lookback > 0:
+            history_start = min(
+                start_date, self._get_lookback_start(max(start_date, self._market_minutes[0].date()), lookback)
+            )
 
-        self._all_bars[symbol] = get_data(
+        # Without columns, get_data() reads all columns
+        projection = {} if columns is None else {"columns": list(columns)}
+        bars = get_data(
             symbol,
-            start_date=start_date,
+            start_date=history_start,
             end_date=end_date,
             timeframe=timeframe,
             extended_hours=extended_hours,
+            anchor=self.anchor,
+            **projection,
         )
+        # The lookback bars are not aligned, also when the clock starts before the start date
+        aligned, report = align_bars(bars[bars.index >= pd.Timestamp(start_date)], self._market_minutes, fill_policy)
+        if len(aligned) > 0 and lookback > 0:
+            history = bars[bars.index < aligned.index[0]].iloc[-lookback:]
+        else:
+            history = bars.iloc[:0]
+        return history, aligned, report
+
+    def _get_lookback_start(self, day, lookback):
+        """Gets a date early enough to have the lookback bars before the day."""
+        dates = get_market_calendar().index
+        if self.timeframe == "daily":
+            days = lookback
+        else:
+            days = -(-lookback * self.timeframe // 210)  # The shortest regular session (an early close) is 210 minutes
+        return dates[max(0, dates.searchsorted(day) - days - 1)]
+
+    def _add_indicator(self, symbol, name):
+        function, column = self._indicators[name]
+        bars = self._all_bars[symbol]
+        self._all_bars[symbol] = bars.assign(**{name: np.asarray(function(bars[column]), dtype=np.float64)})
 
     def unload_data(self, symbol):
         """Unloads the data.
@@ -163,62 +549,708 @@ class HistoricalPolygonDataHandler(DataHandler):
         """
         self._all_bars.pop(symbol, None)
         self._latest_bars.pop(symbol, None)
+        self._first_positions.pop(symbol, None)
+        self._lookbacks.pop(symbol, None)
+        self.gap_reports.pop(symbol, None)
+        for data in [self._load_arguments, self._evicted, self._last_access]:
+            data.pop(symbol, None)
 
-    def get_loaded_symbols(self):
-        """Get the loaded symbols
+    def _evict(self, symbol):
+        # The latest bars are rows of all bars, so only their row numbers are kept. The symbol stays in the dicts to keep its place in get_loaded_symbols().
+        bars = self._all_bars[symbol]
+        rows = bars.index.get_indexer([bar.name for bar in self._latest_bars[symbol]])
+        self._evicted[symbol] = {"rows": rows.tolist(), "length": len(bars)}
+        self._all_bars[symbol] = None
+        self._latest_bars[symbol] = None
+
+    def _reload(self, symbol):
+        rows = self._evicted[symbol]["rows"]
+        self.load_data(symbol, **self._load_arguments[symbol])
+        bars = self._all_bars[symbol]
+        self._latest_bars[symbol] = [bars.iloc[row] for row in rows]
+
+    def set_universe(self, listing_index):
+        """Lets the listings drive load_data/unload_data. At the first bar of every date, the IDs that got listed are loaded and the IDs that got delisted are unloaded.
+        The data is loaded from that date up to the end of the backtest with the timeframe and extended hours of the clock.
+        Beware that a delisted ID is unloaded at the first bar after its end_date. So close those positions before, e.g. in on_market_close.
+
+        Args:
+            listing_index (ListingIndex): the listings, see polygon.tickers.get_listing_index(). Build it from a filtered ticker list to restrict the universe.
+        """
+        self._universe = listing_index
+        self._universe_date = None
+
+    def _update_universe(self):
+        """Loads the newly listed IDs and unloads the delisted IDs since the last update."""
+        day = self.current_time.date()
+        if self._universe_date is None:
+            added, removed = self._universe.get_listed(day), []
+        else:
+            added, removed = self._universe.get_changes(self._universe_date, day)
+
+        for id in removed:
+            self.unload_data(id)
+        for id in added:
+            self.load_data(
+                id,
+                start_date=day,
+                end_date=self._time_to_stop.date(),
+                timeframe=self.timeframe,
+                extended_hours=self.extended_hours,
+            )
+
+        self._universe_date = day
+
+    def _update_bars(self):
+        # The bars are aligned to the clock, so the row of a symbol is the position on the clock minus the position of its first bar. Before the first and after the last bar there is nothing to add.
+        position = self._position = self._market_minutes.get_loc(self.current_time)
+        for symbol, first_position in self._first_positions.items():
+            row = position - first_position + self._lookbacks[symbol]
+            if symbol in self._evicted:
+                evicted = self._evicted[symbol]
+                if self._lookbacks[symbol] <= row < evicted["length"]:
+                    evicted["rows"].append(row)
+            elif self._lookbacks[symbol] <= row < len(self._all_bars[symbol]):
+                self._latest_bars[symbol].append(self._all_bars[symbol].iloc[row])
+
+    def get_latest_bars(self, symbol, N=1):
+        """Get the most recent bars
+
+        Args:
+            symbol (str): the ticker or ID
+            N (int, optional): the amount of bars. Defaults to 1.
 
         Returns:
-            list: list of symbols
+            DataFrame: the DataFrame with the data
         """
-        if len(self._all_bars) == 0:
-            return list()
+        self._read(symbol)
+        return pd.DataFrame(self._latest_bars[symbol][-N:])
+
+    def get_latest_values(self, symbol, column, N=1):
+        """Get the most recent values of a column without creating a DataFrame
+
+        Args:
+            symbol (str): the ticker or ID
+            column (str): the column, e.g. 'close'
+            N (int, optional): the amount of values. Defaults to 1.
+
+        Returns:
+            ndarray: the values
+        """
+        self._read(symbol)
+        # The latest bars are the lookback bars and the aligned bars up to the current row, see _update_bars()
+        lookback = self._lookbacks[symbol]
+        end = min(max(self._position - self._first_positions[symbol] + 1, 0) + lookback, len(self._all_bars[symbol]))
+        return self._all_bars[symbol][column].to_numpy()[max(0, end - N) : end]
+
+
+def align_bars(bars, clock, fill_policy="ffill"):
+    """Aligns the bars of a symbol to the clock. Between the first and the last bar, every datetime of the clock gets a bar. The bars that are not on the clock are dropped.
+    A filled bar has no volume and is not tradeable. The other columns depend on the fill policy:
+        - 'ffill': the open, high, low and close are the previous close. The other columns are forward filled.
+        - 'nan': the open, high, low and close are NaN. The other columns are forward filled.
+
+    Args:
+        bars (DataFrame): the bars with a DatetimeIndex
+        clock (DatetimeIndex): the datetimes of the clock
+        fill_policy (str, optional): 'ffill' or 'nan'. Defaults to 'ffill'.
+
+    Returns:
+        tuple: the aligned bars and the gap report, a dict with the amount of bars, filled bars, the longest gap (in bars) and the bars within the clock period that are not on the clock
+    """
+    if fill_policy not in ["ffill", "nan"]:
+        raise ValueError("The fill policy must be 'ffill' or 'nan'!")
+
+    on_clock = bars.index.isin(clock)
+    within_clock = (bars.index >= clock[0]) & (bars.index <= clock[-1])
+    report = {"bars": 0, "filled": 0, "longest_gap": 0, "off_clock": int((within_clock & ~on_clock).sum())}
+    bars = bars[on_clock]
+    if len(bars) == 0:
+        return bars, report
+
+    clock = clock[(clock >= bars.index[0]) & (clock <= bars.index[-1])]
+    report["bars"] = len(clock)
+    if len(clock) == len(bars):
+        return bars, report
+
+    missing = ~clock.isin(bars.index)
+    report["filled"] = int(missing.sum())
+    report["longest_gap"] = get_longest_gap(missing)
+
+    aligned = bars.reindex(clock)
+    for column in aligned.columns:
+        if column == "volume":
+            aligned[column] = aligned[column].fillna(0)
+        elif column == "tradeable":
+            aligned[column] = aligned[column].where(~missing, False)
+        elif column not in ["open", "high", "low"] and not (fill_policy == "nan" and column == "close"):
+            aligned[column] = aligned[column].ffill()
+    if fill_policy == "ffill" and "close" in aligned.columns:
+        for column in ["open", "high", "low"]:
+            if column in aligned.columns:
+                aligned[column] = aligned[column].fillna(aligned["close"])
+
+    # The reindex turns the bool and integer columns into objects and floats. These are all filled.
+    dtypes = {
+        column: dtype for column, dtype in bars.dtypes.items() if column in aligned and aligned[column].notna().all()
+    }
+    return aligned.astype(dtypes), report
+
+
+def compact_bars(bars, float32=False):
+    """Stores the bars in smaller dtypes. The volume becomes the smallest unsigned integer that holds it (if it is whole), the flags become bool and, optionally, the prices become float32.
+    The flags stay one byte per value: NumPy and pandas have no bit-packed bool columns.
+    With float32 prices, the fills and holdings use the rounded prices. So the results differ slightly from the float64 prices.
+
+    Args:
+        bars (DataFrame): the bars, e.g. the output of align_bars()
+        float32 (bool, optional): whether to store the prices as float32. Defaults to False.
+
+    Returns:
+        DataFrame: the compacted bars
+    """
+    dtypes = {}
+    for column in bars.columns:
+        values = bars[column]
+        if column == "volume" and values.notna().all():
+            dtypes[column] = pd.to_numeric(values, downcast="unsigned").dtype  # Stays a float if not whole
+        elif column in ["tradeable", "halted"] and values.notna().all():
+            dtypes[column] = bool
+        elif float32 and column in ["open", "high", "low", "close", "close_original"]:
+            dtypes[column] = np.float32
+    return bars.astype(dtypes)
+
+
+def get_longest_gap(missing):
+    """Gets the longest run of missing bars.
+
+    Args:
+        missing (ndarray): whether every bar is missing (bool)
+
+    Returns:
+        int: the length of the longest run, 0 if no bar is missing
+    """
+    gaps = np.diff(np.concatenate([[0], np.asarray(missing, dtype=np.int8), [0]]))
+    if len(gaps) == 0 or not gaps.any():
+        return 0
+    return int((np.flatnonzero(gaps == -1) - np.flatnonzero(gaps == 1)).max())
+
+
+class InMemoryDataHandler(HistoricalDataHandler):
+    """Plays bars that are already in memory, e.g. from your own store or from memory-mapped files, instead of the Polygon database.
+    The clock and the scheduled events follow the calendar that you pass, in the format of market_calendar.csv.
+
+    The bars can be a DataFrame with a DatetimeIndex (or a 'datetime' column), an Arrow Table/RecordBatch with a 'datetime' column, a NumPy structured array or a dict of NumPy arrays with a 'datetime' field.
+    The columns are kept as NumPy arrays. These are views of the input where possible: numeric Arrow columns with one chunk and no nulls are not copied, neither are the columns of a DataFrame block or a structured array.
+    The latest bars are not copied every bar either. We keep a cursor per symbol and slice the arrays when get_latest_bars() is called.
+    """
+
+    def __init__(
+        self, events, start_date, end_date, timeframe, extended_hours=True, calendar=None, bars=None, anchor="midnight"
+    ):
+        """Initializes the data handler. Use Backtest(..., data_handler_params={'calendar': ..., 'bars': ...}) to pass the data.
+
+        Args:
+            calendar (DataFrame): the market calendar, with dates as index and the columns premarket_open, regular_open, regular_close and postmarket_close
+            bars (dict, optional): the bars per symbol, see load_data(). Defaults to None (load them later).
+            anchor (str, optional): where the intraday bars start, see polygon.times.get_bar_labels(). The bars must already have these labels. Defaults to 'midnight'.
+        """
+        if calendar is None:
+            raise ValueError("The InMemoryDataHandler needs a market calendar!")
+        self._market_calendar = calendar
+
+        self._timestamps = {}  # {'AAPL': int64 array of nanoseconds}
+        self._first_rows = {}  # The first row that the clock passes
+        self._cursors = {}  # The amount of rows that the clock has passed
+        self._last_tick = np.iinfo(np.int64).min
+        super().__init__(events, start_date, end_date, timeframe, extended_hours, anchor)
+        self._clock_nanoseconds = pd.DatetimeIndex(self._market_minutes).asi8
+
+        for symbol, symbol_bars in (bars or {}).items():
+            self.load_data(symbol, symbol_bars)
+
+    @classmethod
+    def get_data_fingerprint(cls, timeframe, calendar=None, bars=None, anchor="midnight"):
+        sha = hashlib.sha1()
+        if anchor != "midnight":
+            sha.update(anchor.encode())
+        if calendar is not None:
+            sha.update(calendar.to_csv().encode())
+        for symbol in sorted(bars or {}):
+            timestamps, columns = _to_arrays(bars[symbol])
+            sha.update(symbol.encode())
+            for name, values in [("datetime", timestamps), *sorted(columns.items())]:
+                sha.update(name.encode())
+                sha.update(np.ascontiguousarray(values).data)
+        return sha.hexdigest()[:16]
+
+    def _get_market_minutes(self, start_date, end_date, extended_hours):
+        calendar = format_market_calendar(self._market_calendar, "datetime")
+        calendar = calendar[(calendar.index >= start_date) & (calendar.index <= end_date)]
+        return get_calendar_minutes(calendar, extended_hours, self.timeframe, self.anchor)
+
+    def _get_market_dates(self, start_date, end_date):
+        dates = pd.to_datetime(self._market_calendar.index).date
+        return list(dates[(dates >= start_date) & (dates <= end_date)])
+
+    def _get_calendar(self):
+        return format_market_calendar(self._market_calendar, "datetime", self.timeframe, self.anchor)
+
+    def load_data(self, symbol, bars, lookback=0):
+        """Loads the bars of a symbol. Bars that are not on the clock (e.g. extended hours on a regular hours clock) are dropped, which copies the arrays.
+        The gaps are not filled: at a datetime of the clock without a bar, the latest bars stay the same. The gaps are counted in the gap report.
+
+        Args:
+            symbol (str): the symbol
+            bars (DataFrame/Table/RecordBatch/ndarray/dict): the bars, sorted by datetime
+            lookback (int, optional): the amount of bars before the current time (or the start of the clock) that are already in the latest bars, e.g. to warm up indicators. Defaults to 0.
+
+        Returns:
+            dict: the gap report, like align_bars(). The missing bars between the first and the last bar on the clock are 'filled'.
+        """
+        self._load_arguments[symbol] = {"bars": bars, "lookback": lookback}
+        self._evicted.pop(symbol, None)
+        timestamps, columns = _to_arrays(bars)
+
+        on_clock = np.isin(timestamps, self._clock_nanoseconds)
+        clock = self._clock_nanoseconds
+        within_clock = (timestamps >= clock[0]) & (timestamps <= clock[-1])
+        report = {"bars": 0, "filled": 0, "longest_gap": 0, "off_clock": int((within_clock & ~on_clock).sum())}
+        if on_clock.any():
+            first, last = timestamps[on_clock][[0, -1]]
+            clock = clock[np.searchsorted(clock, first) : np.searchsorted(clock, last, side="right")]
+            missing = ~np.isin(clock, timestamps)
+            report.update(bars=len(clock), filled=int(missing.sum()), longest_gap=get_longest_gap(missing))
+        self.gap_reports[symbol] = report
+
+        if lookback > 0:
+            # Keep the lookback bars before the start of the clock
+            on_clock[np.flatnonzero(timestamps < self._clock_nanoseconds[0])[-lookback:]] = True
+        if not on_clock.all():
+            timestamps = timestamps[on_clock]
+            columns = {name: values[on_clock] for name, values in columns.items()}
+
+        self._timestamps[symbol] = timestamps
+        self._all_bars[symbol] = columns
+        cursor = np.searchsorted(timestamps, max(self._last_tick, self._clock_nanoseconds[0] - 1), side="right")
+        self._cursors[symbol] = cursor
+        self._first_rows[symbol] = max(0, cursor - lookback)
+        self._add_indicators(symbol)
+        return report
+
+    def _add_indicator(self, symbol, name):
+        function, column = self._indicators[name]
+        columns = self._all_bars[symbol]
+        columns[name] = np.asarray(function(pd.Series(columns[column])), dtype=np.float64)
+
+    def unload_data(self, symbol):
+        """Unloads the data.
+
+        Args:
+            symbol (str): the symbol
+        """
+        for data in [self._all_bars, self._timestamps, self._first_rows, self._cursors, self.gap_reports]:
+            data.pop(symbol, None)
+        for data in [self._load_arguments, self._evicted, self._last_access]:
+            data.pop(symbol, None)
+
+    def _evict(self, symbol):
+        # The timestamps and the cursors are kept, so the clock keeps moving the cursor of an evicted symbol
+        self._evicted[symbol] = True
+        self._all_bars[symbol] = None
+
+    def _reload(self, symbol):
+        cursor, first_row = self._cursors[symbol], self._first_rows[symbol]
+        self.load_data(symbol, **self._load_arguments[symbol])
+        self._cursors[symbol], self._first_rows[symbol] = cursor, first_row
+
+    def memory_usage(self):
+        """Estimates the memory of the bars, see backtester/memory.py. The bars are often views of your own arrays, which are counted too.
+
+        Returns:
+            dict: the bytes of all bars and of the timestamps
+        """
+        return {"all_bars": get_size(self._all_bars), "timestamps": get_size(self._timestamps)}
+
+    def _update_bars(self):
+        # A symbol without a bar at this time is skipped. The gaps are in the gap report, see load_data().
+        self._last_tick = self.current_time.value
+        for symbol, timestamps in self._timestamps.items():
+            cursor = self._cursors[symbol]
+            if cursor < len(timestamps) and timestamps[cursor] == self._last_tick:
+                self._cursors[symbol] = cursor + 1
+
+    def _get_latest_rows(self, symbol, N):
+        cursor = self._cursors[symbol]
+        return max(self._first_rows[symbol], cursor - N), cursor
+
+    def get_latest_bars(self, symbol, N=1):
+        """Get the most recent bars
+
+        Args:
+            symbol (str): the symbol
+            N (int, optional): the amount of bars. Defaults to 1.
+
+        Returns:
+            DataFrame: the DataFrame with the data
+        """
+        self._read(symbol)
+        start, end = self._get_latest_rows(symbol, N)
+        return pd.DataFrame(
+            {name: values[start:end] for name, values in self._all_bars[symbol].items()},
+            index=pd.DatetimeIndex(self._timestamps[symbol][start:end]),
+        )
+
+    def get_latest_values(self, symbol, column, N=1):
+        """Get the most recent values of a column without creating a DataFrame
+
+        Args:
+            symbol (str): the symbol
+            column (str): the column, e.g. 'close'
+            N (int, optional): the amount of values. Defaults to 1.
+
+        Returns:
+            ndarray: a read-only view of the values
+        """
+        self._read(symbol)
+        start, end = self._get_latest_rows(symbol, N)
+        values = self._all_bars[symbol][column][start:end]
+        values.flags.writeable = False
+        return values
+
+
+def _get_datetime_range(file, row_group):
+    """Gets the first and last datetime of a row group of a Parquet file from its statistics.
+
+    Args:
+        file (ParquetFile): the file
+        row_group (int): the index of the row group
+
+    Returns:
+        tuple: the first and last datetime in nanoseconds, or None without statistics
+    """
+    field = file.schema_arrow.field("datetime")
+    if not pa.types.is_timestamp(field.type):
+        return None
+    statistics = file.metadata.row_group(row_group).column(file.schema_arrow.get_field_index("datetime")).statistics
+    if statistics is None or not statistics.has_min_max:
+        return None
+    nanoseconds = {"s": 10**9, "ms": 10**6, "us": 10**3, "ns": 1}[field.type.unit]
+    return statistics.min_raw * nanoseconds, statistics.max_raw * nanoseconds
+
+
+def _to_arrays(bars):
+    """Converts bars to an int64 array of nanoseconds and a dict of NumPy arrays, without copying where possible.
+
+    Args:
+        bars (DataFrame/Table/RecordBatch/ndarray/dict): the bars with a 'datetime' index, column or field
+
+    Returns:
+        tuple: the timestamps and the columns
+    """
+    if isinstance(bars, pd.DataFrame):
+        if "datetime" in bars.columns:
+            bars = bars.set_index("datetime")
+        timestamps = bars.index
+        columns = {name: bars[name].to_numpy() for name in bars.columns}
+    elif isinstance(bars, (pa.Table, pa.RecordBatch)):
+        timestamps = bars.column("datetime").to_numpy()
+        columns = {name: bars.column(name).to_numpy() for name in bars.column_names if name != "datetime"}
+    elif isinstance(bars, np.ndarray):
+        timestamps = bars["datetime"]
+        columns = {name: bars[name] for name in bars.dtype.names if name != "datetime"}
+    else:
+        timestamps = bars["datetime"]
+        columns = {name: np.asarray(values) for name, values in bars.items() if name != "datetime"}
+
+    timestamps = np.asarray(timestamps, dtype="datetime64[ns]").view(np.int64)
+    return timestamps, columns
+
+
+class AsyncReplayPolygonDataHandler(HistoricalPolygonDataHandler):
+    """Replays the Polygon database into an asyncio event loop as if it were a live feed.
+
+    The bars are released at a fixed pace: one bar every timeframe minutes divided by the speed. So speed=1 is real time and speed=60 replays a 1-minute bar every second. Gaps (nights, weekends) are skipped, just like a live feed that only sends bars during trading hours. A speed of None releases the bars as fast as possible.
+    The time at which each bar is due on this wall-clock schedule is the 'arrival' of that bar, also when the bar is released late because the consumer is busy. The AsyncBacktest uses it to measure how long it takes before we react.
+    """
+
+    def __init__(
+        self,
+        events,
+        start_date,
+        end_date,
+        timeframe,
+        extended_hours=True,
+        speed=None,
+        anchor="midnight",
+        columns=None,
+        compact=False,
+    ):
+        super().__init__(events, start_date, end_date, timeframe, extended_hours, anchor, columns, compact)
+        self.speed = speed
+
+    def _get_bar_interval(self):
+        """Gets the wall clock time in seconds between two bar releases."""
+        if self.speed is None:
+            return 0
+        elif self.timeframe == "daily":
+            return 390 * 60 / self.speed  # One regular session
         else:
-            return list(self._all_bars.keys())
+            return self.timeframe * 60 / self.speed
 
-    def next(self):
-        """Simulates a passed minute by appending self.latest_bars and generating a MarketEvent.
+    async def replay(self, arrivals):
+        """Puts the arrival time (time.perf_counter()) of every bar in the arrivals queue at the replay pace.
+        The arrival is the time at which the bar is due, so a slow consumer that delays the feed is measured against the schedule. Without a speed, the arrival is the release time.
 
         Args:
-            dt (Datetime): the datetime minute to which we update.
+            arrivals (asyncio.Queue): the queue that the consumer awaits
         """
-        # Let the clock 'tick'
-        self.current_time = next(self._clock)
+        interval = self._get_bar_interval()
+        replay_start = timer.perf_counter()
+
+        for i in range(len(self._market_minutes)):
+            # Sleep until the bar is due. If we are behind, the bar is released immediately.
+            due = replay_start + i * interval
+            await asyncio.sleep(max(0, due - timer.perf_counter()))
+            arrivals.put_nowait(due if interval > 0 else timer.perf_counter())
+
+
+class EventTimeDataHandler(HistoricalDataHandler):
+    """Plays irregular events (e.g. trades, quotes or sparse bars) at their own timestamps instead of on a fixed grid of minutes or days.
+
+    Every symbol is a stream of rows that is read in chunks from a Parquet file with a 'datetime' column. The streams are merged with a heap: every tick is the next timestamp of any stream, and only the symbols with a row at that timestamp are updated.
+    Rows of one symbol with the same timestamp are separate ticks. Rows outside the sessions of the calendar are skipped.
+    The MarketEvent of a tick has the updated symbols, which are also in data_handler.updated_symbols. The scheduled events are merged into the clock: a MarketCloseEvent at the regular close (e.g. 16:00:00) and a BacktestEndEvent at the end of the last session. These ticks have no MarketEvent.
+    The broker and the portfolio use the 'close' column as the price, so name the trade price 'close'.
+    """
+
+    def __init__(
+        self,
+        events,
+        start_date,
+        end_date,
+        timeframe=1,
+        extended_hours=True,
+        calendar=None,
+        paths=None,
+        batch_size=65536,
+        max_history=10000,
+    ):
+        """Initializes the data handler. Use Backtest(..., data_handler_params={'paths': ...}) to pass the files.
+
+        Args:
+            timeframe (int, optional): not used by the clock, but the portfolio and the calendar treat the data as intraday. Defaults to 1.
+            calendar (DataFrame, optional): the market calendar in the format of market_calendar.csv. Defaults to the calendar of the database.
+            paths (dict, optional): the Parquet file per symbol, see load_data(). Defaults to None (load them later).
+            batch_size (int, optional): the amount of rows that are read at once per symbol. Defaults to 65536.
+            max_history (int, optional): the amount of latest rows that are kept per symbol. Defaults to 10000.
+        """
+        self._market_calendar = calendar
+        self.batch_size = batch_size
+        self.max_history = max_history
+
+        self._streams = {}  # {'AAPL': (generator of chunks, [timestamps, columns, position])}
+        self._columns = {}  # {'AAPL': the column names}
+        self._heap = []  # (next timestamp, rank, generation, symbol)
+        self._ranks = {}  # The order of loading, so the symbols of a tick are always in the same order
+        self._generations = {}  # {'AAPL': how often it was loaded}. The heap entries of an earlier load are stale.
+        self._last_tick = np.iinfo(np.int64).min
+        self.updated_symbols = []
+        super().__init__(events, start_date, end_date, timeframe, extended_hours)
+
+        for symbol, path in (paths or {}).items():
+            self.load_data(symbol, path)
+
+    def _get_calendar(self):
+        if self._market_calendar is None:
+            return get_market_calendar("datetime")
+        return format_market_calendar(self._market_calendar, "datetime")
+
+    def _initiate_clock(self, start_date, end_date, extended_hours):
+        calendar = self._get_calendar()
+        calendar = calendar[(calendar.index >= start_date) & (calendar.index <= end_date)]
+
+        # The sessions, in nanoseconds. The closes are the minute after the last minute.
+        minute = np.timedelta64(1, "m")
+        opens = calendar["premarket_open" if extended_hours else "regular_open"].values
+        closes = calendar["postmarket_close" if extended_hours else "regular_close"].values + minute
+        self._session_opens = opens.astype("datetime64[ns]").view(np.int64)
+        self._session_closes = closes.astype("datetime64[ns]").view(np.int64)
+
+        # The scheduled events: the regular close of every day and the end of the backtest
+        market_closes = (calendar["regular_close"].values + minute).astype("datetime64[ns]").view(np.int64)
+        self._scheduled = [(timestamp, [MarketCloseEvent]) for timestamp in market_closes]
+        if self._scheduled[-1][0] == self._session_closes[-1]:
+            self._scheduled[-1][1].append(BacktestEndEvent)
+        else:
+            self._scheduled.append((self._session_closes[-1], [BacktestEndEvent]))
+
+        self.current_time = pd.Timestamp(self._session_opens[0])
+        self._time_to_stop = pd.Timestamp(self._session_closes[-1])
+        self._market_minutes = pd.DatetimeIndex(self._session_opens)  # The session opens. There is no grid.
+        return self._create_clock()
+
+    def _create_clock(self):
+        """A generator that yields the timestamp, the updated rows and the scheduled events of every tick."""
+        next_scheduled = 0
+        while True:
+            next_row = self._heap[0][0] if len(self._heap) > 0 else None
+            if next_scheduled < len(self._scheduled) and (
+                next_row is None or self._scheduled[next_scheduled][0] <= next_row
+            ):
+                timestamp, scheduled_events = self._scheduled[next_scheduled]
+                next_scheduled += 1
+                yield timestamp, [], scheduled_events
+                continue
+            elif next_row is None:
+                return
+
+            # Pop all symbols with a row at this timestamp first, so a symbol with two rows at the same timestamp gets two ticks
+            popped = []
+            while len(self._heap) > 0 and self._heap[0][0] == next_row:
+                _, _, generation, symbol = heapq.heappop(self._heap)
+                if symbol in self._streams and generation == self._generations[symbol]:  # Else it was unloaded
+                    popped.append(symbol)
+
+            rows = []
+            for symbol in popped:
+                rows.append((symbol, self._read_row(symbol)))
+                self._push_next(symbol)
+            yield next_row, rows, []
+
+    def _read_chunks(self, path, columns, start):
+        """Reads the rows after the start (in nanoseconds) that are in a session, in chunks.
+        The row groups that end before the start (or the first session) or begin after the last session are skipped with their statistics, and the reading stops at the first row after the last session.
+        """
+        file = pq.ParquetFile(path)
+        begin, end = max(start, self._session_opens[0] - 1), self._session_closes[-1]
+        row_groups = []
+        for row_group in range(file.num_row_groups):
+            datetime_range = _get_datetime_range(file, row_group)
+            if datetime_range is None or (datetime_range[1] > begin and datetime_range[0] < end):
+                row_groups.append(row_group)
+
+        for batch in file.iter_batches(batch_size=self.batch_size, row_groups=row_groups, columns=columns):
+            timestamps, values = _to_arrays(batch)
+            sessions = np.searchsorted(self._session_opens, timestamps, side="right") - 1
+            in_session = (
+                (sessions >= 0) & (timestamps < self._session_closes[np.maximum(sessions, 0)]) & (timestamps > start)
+            )
+            if in_session.any():
+                yield timestamps[in_session], {name: column[in_session] for name, column in values.items()}
+            if len(timestamps) > 0 and timestamps[-1] >= end:
+                return  # The rows are sorted, so the other rows are after the last session too
+
+    def _push_next(self, symbol):
+        """Pushes the next timestamp of a symbol on the heap, reading the next chunk if necessary."""
+        chunks, chunk = self._streams[symbol]
+        if chunk[2] == len(chunk[0]):
+            next_chunk = next(chunks, None)
+            if next_chunk is None:
+                return
+            chunk[:] = [next_chunk[0], next_chunk[1], 0]
+        heapq.heappush(self._heap, (chunk[0][chunk[2]], self._ranks[symbol], self._generations[symbol], symbol))
+
+    def _read_row(self, symbol):
+        _, chunk = self._streams[symbol]
+        timestamps, columns, position = chunk
+        chunk[2] += 1
+        return timestamps[position], tuple(columns[name][position] for name in self._columns[symbol])
+
+    def load_data(self, symbol, path, columns=None):
+        """Loads the stream of a symbol. Only the rows after the current time are played.
+
+        Args:
+            symbol (str): the symbol
+            path (str): the Parquet file with a 'datetime' column, sorted by datetime
+            columns (list, optional): the columns to read. Defaults to all.
+        """
+        if columns is not None:
+            columns = ["datetime"] + [column for column in columns if column != "datetime"]
+        chunks = self._read_chunks(path, columns, self._last_tick)
+
+        self._columns[symbol] = [name for name in pq.read_schema(path).names if name != "datetime"]
+        if columns is not None:
+            self._columns[symbol] = [name for name in self._columns[symbol] if name in columns]
+        self._all_bars[symbol] = collections.deque(maxlen=self.max_history)
+        self._ranks.setdefault(symbol, len(self._ranks))
+        self._generations[symbol] = self._generations.get(symbol, 0) + 1
+        self._streams[symbol] = (chunks, [np.empty(0, dtype=np.int64), {}, 0])
+        self._push_next(symbol)
+
+    def unload_data(self, symbol):
+        """Unloads the stream of a symbol.
+
+        Args:
+            symbol (str): the symbol
+        """
+        for data in [self._streams, self._columns, self._all_bars]:
+            data.pop(symbol, None)
+
+    def next(self):
+        """Plays the next tick: the scheduled events or the rows of the next timestamp, followed by a MarketEvent with the updated symbols."""
+        timestamp, rows, scheduled_events = next(self._clock)
+        self._last_tick = timestamp
+        self.current_time = pd.Timestamp(timestamp)
         if self.current_time == self._time_to_stop:
             self.continue_backtest = False
 
-        # Check if market open/market close.
-        # Note: Only the market close/backtest end is necessary because these cannot be easily checked because they are variable. However other scheduled events can be programmed in the Strategy itself easily by checking the current_time.
-        scheduled_events = self._check_time(self.current_time)
         for event in scheduled_events:
-            self.events.put(event)
+            self.events.put(event())
 
-        # Update data
-        for symbol in self.get_loaded_symbols():
-            try:
-                # By the way, dictionary lookup is O(1) so we do not need to worry about speed for large dataframes.
-                self._latest_bars[symbol].append(self._all_bars[symbol].loc[self.current_time])
-            except KeyError:
-                print(f"The symbol {symbol} has no data for {self.current_time.isoformat()}.")
+        self.updated_symbols = []
+        for symbol, row in rows:
+            if symbol in self._all_bars:
+                self._all_bars[symbol].append(row)
+                self.updated_symbols.append(symbol)
 
-        self.events.put(MarketEvent())
+        if len(self.updated_symbols) > 0:
+            self.events.put(MarketEvent(self.updated_symbols))
 
     def skip_to_future(self, dt):
-        """Sets the clock to a specific time to avoid unnecessary looping. Use with caution. This does not load data.
+        """Sets the clock to a specific time. The skipped rows are not added to the latest rows and the skipped scheduled events are not fired.
 
         Args:
             dt (datetime): the datetime to which to skip to
         """
         while self.current_time < dt:
-            self.current_time = next(self._clock)
+            timestamp, _, _ = next(self._clock)
+            self._last_tick = timestamp
+            self.current_time = pd.Timestamp(timestamp)
+
+    def _get_latest_rows(self, symbol, N):
+        rows = self._all_bars[symbol]
+        return list(itertools.islice(rows, max(0, len(rows) - N), None))
 
     def get_latest_bars(self, symbol, N=1):
-        """Get the most recent bars
+        """Get the most recent rows
 
         Args:
-            symbol (str): the ticker or ID
-            N (int, optional): the amount of bars. Defaults to 1.
+            symbol (str): the symbol
+            N (int, optional): the amount of rows. Defaults to 1.
 
         Returns:
             DataFrame: the DataFrame with the data
         """
-        return pd.DataFrame(self._latest_bars[symbol][-N:])
+        self._read(symbol)
+        rows = self._get_latest_rows(symbol, N)
+        return pd.DataFrame(
+            [values for _, values in rows],
+            index=pd.DatetimeIndex([timestamp for timestamp, _ in rows], dtype="datetime64[ns]"),
+            columns=self._columns[symbol],
+        )
+
+    def get_latest_values(self, symbol, column, N=1):
+        """Get the most recent values of a column without creating a DataFrame
+
+        Args:
+            symbol (str): the symbol
+            column (str): the column, e.g. 'close'
+            N (int, optional): the amount of values. Defaults to 1.
+
+        Returns:
+            ndarray: the values
+        """
+        self._read(symbol)
+        index = self._columns[symbol].index(column)
+        return np.array([values[index] for _, values in self._get_latest_rows(symbol, N)])
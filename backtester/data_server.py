@@ -0,0 +1,427 @@
+"""A local data server that shares the bars of the Polygon database between concurrent backtests.
+
+Every backtest that loads a symbol with get_data() holds its own copy of the bars. The data server loads a symbol once into POSIX shared memory and the backtests map the same memory:
+    - the server aligns the full history of a symbol to the full clock once (see align_bars()) and lays out the columns in one shared memory block, with a mask of the filled bars and the datetimes of the bars that are not on the clock
+    - SharedMemoryPolygonDataHandler asks the server for a symbol and gets the name and layout of the block. The bars are read-only NumPy views of the block, so loading a symbol copies nothing.
+      The lookback bars and the indicators are private copies, see load_data().
+    - the server counts the references per client process and evicts the least recently used symbols without references when the shared memory exceeds the budget.
+      A symbol that is in use is never evicted, so the budget can be exceeded until it is released. The references of processes that exited without releasing are dropped.
+
+A backtest that does not run on the clock of the server (e.g. a regular hours clock on extended hours bars) falls back to get_data().
+The server serves the bars as they were when the symbol was loaded. Restart the server after updating the database.
+
+Usage:
+    python -m backtester.data_server --budget 16                                     start a server with a budget of 16 GB
+    Backtest(..., data_handler=SharedMemoryPolygonDataHandler)                       run a backtest on the bars of the server
+    Backtest(..., data_handler_params={'address': ('localhost', 50055), 'authkey': b'backtester'})
+"""
+
+import argparse
+import atexit
+import collections
+import os
+import sys
+import threading
+import weakref
+from datetime import datetime, time
+from multiprocessing import resource_tracker, shared_memory
+from multiprocessing.managers import BaseManager
+
+import numpy as np
+import pandas as pd
+
+from backtester.data_handler import HistoricalPolygonDataHandler, align_bars, get_longest_gap
+from polygon.data import get_data
+from polygon.times import get_clock, get_market_calendar
+
+ADDRESS = ("localhost", 50055)
+AUTHKEY = b"backtester"
+
+
+class DataServer:
+    """Loads symbols into shared memory on demand. A symbol is identified by its key: (ID, timeframe, extended hours, anchor, fill policy)."""
+
+    def __init__(self, budget=8 * 1024**3):
+        """Initializes the server.
+
+        Args:
+            budget (int, optional): the shared memory budget in bytes. Defaults to 8 GB.
+        """
+        self.budget = budget
+        self._lock = threading.Lock()
+        # {key: {'memory', 'layout', 'nbytes', 'clients'}}, least recently used first
+        self._symbols = collections.OrderedDict()
+        self._loading = {}  # {key: an Event that is set when the load is done}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def acquire(self, key, client):
+        """Gets the layout of the shared memory block of a symbol and adds a reference. Loads the symbol if needed.
+        The symbol is loaded outside the lock, so the other clients are not blocked by a load. Concurrent requests for the same symbol wait for the same load.
+
+        Args:
+            key (tuple): (ID, timeframe, extended hours, anchor, fill policy)
+            client (int): the process ID of the client
+
+        Returns:
+            dict: the layout, see _load()
+        """
+        key = tuple(key)
+        while True:
+            with self._lock:
+                if key in self._symbols:
+                    self.hits += 1
+                    self._symbols.move_to_end(key)
+                    entry = self._symbols[key]
+                    entry["clients"][client] += 1
+                    self._evict()
+                    return entry["layout"]
+                loading = self._loading.get(key)
+                if loading is None:
+                    loading = self._loading[key] = threading.Event()
+                    self.misses += 1
+                    break
+            # Another client loads the symbol. Look again when it is done, the load may have failed.
+            loading.wait()
+
+        try:
+            memory, layout = self._load(*key)
+        except BaseException:
+            with self._lock:
+                del self._loading[key]
+                loading.set()
+            raise
+
+        with self._lock:
+            self._symbols[key] = {
+                "memory": memory,
+                "layout": layout,
+                "nbytes": memory.size,
+                "clients": collections.Counter({client: 1}),
+            }
+            del self._loading[key]
+            loading.set()
+            self._evict()
+            return layout
+
+    def release(self, key, client):
+        """Removes a reference to a symbol.
+
+        Args:
+            key (tuple): (ID, timeframe, extended hours, anchor, fill policy)
+            client (int): the process ID of the client
+        """
+        key = tuple(key)
+        with self._lock:
+            entry = self._symbols.get(key)
+            if entry is not None and entry["clients"][client] > 0:
+                entry["clients"][client] -= 1
+                entry["clients"] += collections.Counter()  # Drops the zero counts
+            self._evict()
+
+    def stats(self):
+        """Gets the statistics of the server.
+
+        Returns:
+            dict: the budget, the bytes in use, the hits, misses and evictions and the symbols (least recently used first) with their size and references
+        """
+        with self._lock:
+            for entry in self._symbols.values():
+                self._drop_exited_clients(entry)
+            return {
+                "budget": self.budget,
+                "nbytes": sum(entry["nbytes"] for entry in self._symbols.values()),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "symbols": [
+                    {"key": key, "nbytes": entry["nbytes"], "references": sum(entry["clients"].values())}
+                    for key, entry in self._symbols.items()
+                ],
+            }
+
+    def shutdown(self):
+        """Unlinks all shared memory blocks. The clients keep their mappings until they unload the symbols."""
+        with self._lock:
+            for entry in self._symbols.values():
+                entry["memory"].close()
+                entry["memory"].unlink()
+            self._symbols.clear()
+
+    def _evict(self):
+        """Unlinks the least recently used symbols without references until the shared memory is within the budget."""
+        nbytes = sum(entry["nbytes"] for entry in self._symbols.values())
+        for key in list(self._symbols.keys()):
+            if nbytes <= self.budget:
+                break
+            entry = self._symbols[key]
+            self._drop_exited_clients(entry)
+            if not entry["clients"]:
+                # The clients that still map the block keep their mapping
+                entry["memory"].close()
+                entry["memory"].unlink()
+                del self._symbols[key]
+                nbytes -= entry["nbytes"]
+                self.evictions += 1
+
+    def _drop_exited_clients(self, entry):
+        """Drops the references of the processes that exited without releasing, e.g. after a crash."""
+        for client in list(entry["clients"].keys()):
+            if not _is_alive(client):
+                del entry["clients"][client]
+
+    def _load(self, id, timeframe, extended_hours, anchor, fill_policy):
+        """Loads the full history of a symbol, aligns it to the full clock and copies it into a new shared memory block.
+
+        Returns:
+            tuple: the SharedMemory and the layout: the name of the block, the amount of bars and the dtype, offset and length of every array
+        """
+        bars = get_data(id, timeframe=timeframe, extended_hours=extended_hours, anchor=anchor)
+        if isinstance(timeframe, int):
+            clock = pd.DatetimeIndex(np.asarray(get_clock(extended_hours, timeframe, anchor)).view("datetime64[ns]"))
+        else:
+            clock = pd.to_datetime(get_market_calendar().index)
+        aligned, _ = align_bars(bars, clock, fill_policy)
+
+        arrays = {
+            "datetime": aligned.index.values.astype("datetime64[ns]").view(np.int64),
+            "filled": ~aligned.index.isin(bars.index),
+            "off_clock": bars.index[~bars.index.isin(clock)].values.astype("datetime64[ns]").view(np.int64),
+        }
+        for column in aligned.columns:
+            if aligned[column].dtype == object:
+                raise TypeError(f"The column {column} of {id} is not numeric!")
+            arrays[column] = aligned[column].to_numpy()
+
+        # Every array starts at a multiple of 8 bytes
+        layout = {"bars": len(aligned), "columns": list(aligned.columns), "arrays": {}}
+        offset = 0
+        for name, array in arrays.items():
+            layout["arrays"][name] = (array.dtype.str, offset, len(array))
+            offset += -(-array.nbytes // 8) * 8
+
+        memory = shared_memory.SharedMemory(create=True, size=max(offset, 1))
+        for name, array in arrays.items():
+            dtype, offset, length = layout["arrays"][name]
+            np.ndarray(length, dtype=dtype, buffer=memory.buf, offset=offset)[:] = array
+        layout["name"] = memory.name
+        return memory, layout
+
+
+def _is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass  # The process exists, but belongs to another user
+    return True
+
+
+class DataManager(BaseManager):
+    pass
+
+
+def serve(address=ADDRESS, authkey=AUTHKEY, budget=8 * 1024**3):
+    """Runs a data server until it is interrupted.
+
+    Args:
+        address (tuple, optional): the host and port. Defaults to ('localhost', 50055).
+        authkey (bytes, optional): the key that the clients must have. Defaults to b'backtester'.
+        budget (int, optional): the shared memory budget in bytes. Defaults to 8 GB.
+    """
+    server = DataServer(budget)
+    DataManager.register("data_server", callable=lambda: server)
+    manager = DataManager(address=address, authkey=authkey)
+    try:
+        manager.get_server().serve_forever()
+    finally:
+        server.shutdown()
+
+
+def connect(address=ADDRESS, authkey=AUTHKEY):
+    """Connects to a data server.
+
+    Args:
+        address (tuple, optional): the host and port. Defaults to ('localhost', 50055).
+        authkey (bytes, optional): the key of the server. Defaults to b'backtester'.
+
+    Returns:
+        DataServer: a proxy of the server
+    """
+    DataManager.register("data_server")
+    manager = DataManager(address=address, authkey=authkey)
+    manager.connect()
+    return manager.data_server()
+
+
+def _attach(name):
+    """Maps an existing shared memory block without tracking it. Else the resource tracker unlinks the block when this process exits."""
+    try:
+        return shared_memory.SharedMemory(name, track=False)  # Python 3.13+
+    except TypeError:
+        memory = shared_memory.SharedMemory(name)
+        resource_tracker.unregister(memory._name, "shared_memory")
+        return memory
+
+
+def _release_all(server, leases):
+    """Releases all symbols of a data handler, also when it is garbage collected."""
+    for memory, key in leases.values():
+        try:
+            server.release(key, os.getpid())
+        except (OSError, EOFError):
+            pass  # The server is gone
+        try:
+            memory.close()
+        except BufferError:
+            pass  # The bars are still referenced. The mapping is closed when they are garbage collected.
+    leases.clear()
+
+
+class SharedMemoryPolygonDataHandler(HistoricalPolygonDataHandler):
+    """Plays the bars of the Polygon database from the shared memory of a data server, see the module docstring."""
+
+    def __init__(
+        self,
+        events,
+        start_date,
+        end_date,
+        timeframe,
+        extended_hours=True,
+        anchor="midnight",
+        columns=None,
+        compact=False,
+        address=ADDRESS,
+        authkey=AUTHKEY,
+    ):
+        """Initializes the data handler and connects to the data server.
+
+        Args:
+            address (tuple, optional): the host and port of the data server. Defaults to ('localhost', 50055).
+            authkey (bytes, optional): the key of the data server. Defaults to b'backtester'.
+        """
+        self._server = connect(address, authkey)
+        self._leases = {}  # {symbol: (SharedMemory, key)}
+        self._finalizer = weakref.finalize(self, _release_all, self._server, self._leases)
+        # At exit, release before multiprocessing disconnects the proxy. The atexit handlers run last in, first out.
+        self._finalizer.atexit = False
+        atexit.register(self._finalizer)
+        super().__init__(events, start_date, end_date, timeframe, extended_hours, anchor, columns, compact)
+
+    def _get_aligned_bars(
+        self, symbol, start_date, end_date, timeframe, extended_hours, fill_policy, lookback, columns=None
+    ):
+        """Gets the aligned bars as read-only views of the shared memory. The server holds all columns, the bars only view the columns. Falls back to get_data() if the server does not run on the clock of the backtest."""
+        self._release(symbol)
+        if timeframe != self.timeframe or extended_hours != self.extended_hours:
+            return super()._get_aligned_bars(
+                symbol, start_date, end_date, timeframe, extended_hours, fill_policy, lookback, columns
+            )
+
+        key = (symbol, timeframe, extended_hours, self.anchor, fill_policy)
+        layout = self._server.acquire(key, os.getpid())
+        memory = _attach(layout["name"])
+        self._leases[symbol] = (memory, key)
+
+        arrays = {}
+        for name, (dtype, offset, length) in layout["arrays"].items():
+            arrays[name] = np.ndarray(length, dtype=dtype, buffer=memory.buf, offset=offset)
+            arrays[name].flags.writeable = False
+        datetimes, filled = arrays["datetime"], arrays["filled"]
+
+        # The bounds of get_data() within the clock of the backtest
+        clock = self._market_minutes.asi8
+        if isinstance(timeframe, int):
+            bounds = [datetime.combine(start_date, time(4)), datetime.combine(end_date, time(20))]
+        else:
+            bounds = [start_date, end_date]
+        start, end = pd.to_datetime(bounds).asi8
+        start, end = max(start, clock[0]), min(end, clock[-1])
+        first, last = np.searchsorted(datetimes, start), np.searchsorted(datetimes, end, "right")
+
+        # Like align_bars(), the aligned bars start and end with a bar of the database
+        bars = np.flatnonzero(~filled[first:last])
+        off_clock = arrays["off_clock"]
+        report = {
+            "bars": 0,
+            "filled": 0,
+            "longest_gap": 0,
+            "off_clock": int(((off_clock >= start) & (off_clock <= end)).sum()),
+        }
+        if len(bars) > 0:
+            first, last = first + bars[0], first + bars[-1] + 1
+            position = np.searchsorted(clock, datetimes[first])
+            if not np.array_equal(clock[position : position + last - first], datetimes[first:last]):
+                self._release(symbol)
+                return super()._get_aligned_bars(
+                    symbol, start_date, end_date, timeframe, extended_hours, fill_policy, lookback, columns
+                )
+            report["bars"] = last - first
+            report["filled"] = int(filled[first:last].sum())
+            report["longest_gap"] = get_longest_gap(filled[first:last])
+        else:
+            first = last = 0
+
+        def to_frame(rows):
+            index = pd.DatetimeIndex(datetimes[rows].view("datetime64[ns]"), name="datetime", copy=False)
+            names = (
+                layout["columns"] if columns is None else [column for column in columns if column in layout["columns"]]
+            )
+            return pd.DataFrame({column: arrays[column][rows] for column in names}, index=index, copy=False)
+
+        aligned = to_frame(slice(first, last))
+        if lookback > 0 and len(aligned) > 0:
+            history_start = min(
+                start_date, self._get_lookback_start(max(start_date, self._market_minutes[0].date()), lookback)
+            )
+            history_start = np.searchsorted(datetimes, pd.Timestamp(history_start).value)
+            rows = history_start + np.flatnonzero(~filled[history_start:first])
+            history = to_frame(rows[-lookback:])
+        else:
+            history = aligned.iloc[:0]
+        return history, aligned, report
+
+    def unload_data(self, symbol):
+        """Unloads the data and releases the symbol on the data server.
+
+        Args:
+            symbol (str): the ticker or ID
+        """
+        super().unload_data(symbol)
+        self._release(symbol)
+
+    def _evict(self, symbol):
+        super()._evict(symbol)
+        self._release(symbol)
+
+    def _release(self, symbol):
+        if symbol in self._leases:
+            memory, key = self._leases.pop(symbol)
+            self._server.release(key, os.getpid())
+            try:
+                memory.close()
+            except BufferError:
+                pass  # The bars are still referenced. The mapping is closed when they are garbage collected.
+
+    def close(self):
+        """Releases all symbols on the data server."""
+        self._finalizer()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Runs a data server that shares the bars between backtests.")
+    parser.add_argument("--host", default=ADDRESS[0])
+    parser.add_argument("--port", type=int, default=ADDRESS[1])
+    parser.add_argument("--authkey", default=AUTHKEY.decode())
+    parser.add_argument("--budget", type=float, default=8, help="the shared memory budget in GB")
+    args = parser.parse_args(argv)
+
+    print(f"Serving on {args.host}:{args.port} with a budget of {args.budget} GB")
+    serve((args.host, args.port), args.authkey.encode(), int(args.budget * 1024**3))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -7,6 +7,9 @@ class Event:
 class MarketEvent(Event):
     """For when the time period (e.g. 1-minute) has passed. Only the DataHandler generates these."""
 
+    def __init__(self, symbols=None):
+        self.symbols = symbols  # The symbols with new data. None means all loaded symbols.
+
 
 class MarketCloseEvent(Event):
     """For when the market closes (regular hours close). Beware of early closes."""
@@ -0,0 +1,215 @@
+"""Kernels for the hottest numeric loops: FIFO trade matching, the drawdown duration and the EMA.
+
+If numba is installed, the loops are JIT-compiled. Else a fallback is used: vectorized NumPy/pandas where possible and FifoTradeMatcher for the trade matching, because a plain Python loop over arrays is slower than its deques.
+The backend is selected on the first call of a kernel, because importing numba is slow and most imports of the backtester do not need the kernels. Set the environment variable BACKTESTER_KERNELS=numpy to force the fallback, e.g. to compare the results.
+See benchmarks/bench_kernels.py for the parity checks and timings.
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+
+_kernels = None  # {'backend': 'numba' or 'numpy', 'ema': the function, ...}, see _get_kernels()
+
+
+def get_backend():
+    """Gets the backend of the kernels. Imports numba on the first call.
+
+    Returns:
+        str: 'numba' if numba is installed and not disabled, else 'numpy'
+    """
+    return _get_kernels()["backend"]
+
+
+def _get_kernels():
+    """Selects the backend and gets its kernels, once."""
+    global _kernels
+    if _kernels is not None:
+        return _kernels
+
+    try:
+        if os.environ.get("BACKTESTER_KERNELS", "numba") == "numpy":
+            raise ImportError("The fallback is forced")
+        import numba
+    except ImportError:
+        _kernels = {
+            "backend": "numpy",
+            "fifo_match": _fifo_match,
+            "max_drawdown_duration": _max_drawdown_duration_numpy,
+            "ema": _ema_pandas,
+        }
+        return _kernels
+
+    # Compiled on the first call. The cache avoids compiling again in the next process.
+    jit = numba.njit(cache=True)
+    _kernels = {
+        "backend": "numba",
+        "fifo_match": jit(_fifo_match),
+        "max_drawdown_duration": jit(_max_drawdown_duration_loop),
+        "ema": jit(_ema_loop),
+    }
+    return _kernels
+
+
+def _fifo_match(symbol_codes, directions, quantities, prices, fees, n_symbols):
+    """The loop of FifoTradeMatcher.add_fill over all fills, on arrays. The trades are numbered in the order they are opened.
+    The open trades of a symbol form a linked list (head, tail and next_open), oldest first.
+    """
+    n = len(symbol_codes)
+    trade_fill = np.empty(n, dtype=np.int64)  # The fill that opened the trade
+    close_fill = np.full(n, -1, dtype=np.int64)  # The fill that closed the trade
+    trade_quantity = np.empty(n, dtype=quantities.dtype)
+    remaining_qty = np.empty(n, dtype=quantities.dtype)
+    entry = np.empty(n, dtype=np.float64)
+    trade_exit = np.full(n, np.nan, dtype=np.float64)
+    trade_fees = np.empty(n, dtype=np.float64)
+
+    head = np.full(n_symbols, -1, dtype=np.int64)
+    tail = np.full(n_symbols, -1, dtype=np.int64)
+    next_open = np.full(n, -1, dtype=np.int64)
+    n_trades = 0
+
+    for i in range(n):
+        symbol = symbol_codes[i]
+        quantity = quantities[i]
+        remaining = quantity
+
+        index = head[symbol]
+        if index != -1 and directions[trade_fill[index]] != directions[i]:
+            while remaining > 0 and index != -1:
+                already_filled_qty_open_trade = trade_quantity[index] - remaining_qty[index]
+                closed_qty = min(remaining, remaining_qty[index])
+
+                # Calculate new average fill
+                if already_filled_qty_open_trade == 0:
+                    trade_exit[index] = prices[i]
+                else:
+                    trade_exit[index] = (trade_exit[index] * already_filled_qty_open_trade + prices[i] * closed_qty) / (
+                        already_filled_qty_open_trade + closed_qty
+                    )
+
+                remaining_qty[index] -= closed_qty
+                trade_fees[index] += fees[i] * closed_qty / quantity
+                remaining -= closed_qty
+
+                if remaining_qty[index] == 0:
+                    close_fill[index] = i
+                    index = next_open[index]
+                    head[symbol] = index
+                    if index == -1:
+                        tail[symbol] = -1
+
+        # If no open trades in the opposite direction or there is still a remaining quantity, that is a new trade
+        if remaining > 0:
+            trade_fill[n_trades] = i
+            trade_quantity[n_trades] = remaining
+            remaining_qty[n_trades] = remaining
+            entry[n_trades] = prices[i]
+            trade_fees[n_trades] = fees[i] * remaining / quantity
+
+            if tail[symbol] == -1:
+                head[symbol] = n_trades
+            else:
+                next_open[tail[symbol]] = n_trades
+            tail[symbol] = n_trades
+            n_trades += 1
+
+    return (
+        trade_fill[:n_trades],
+        close_fill[:n_trades],
+        trade_quantity[:n_trades],
+        entry[:n_trades],
+        trade_exit[:n_trades],
+        trade_fees[:n_trades],
+        remaining_qty[:n_trades],
+    )
+
+
+def fifo_match(symbols, sides, quantities, prices, fees):
+    """Matches fills to trades FIFO per symbol, like FifoTradeMatcher. Only compiled with numba, the fallback runs the same loop in Python.
+
+    Args:
+        symbols (ndarray): the symbol of every fill
+        sides (ndarray): 'BUY' or 'SELL'
+        quantities (ndarray): the quantities
+        prices (ndarray): the fill prices
+        fees (ndarray): the fees
+
+    Returns:
+        tuple: for every trade in the order of opening: the index of the opening fill, the index of the closing fill (-1 if open), the quantity, entry, exit, fees and remaining quantity
+    """
+    symbol_codes, uniques = pd.factorize(np.asarray(symbols))
+    directions = np.where(np.asarray(sides) == "BUY", 1, -1)
+    return _get_kernels()["fifo_match"](
+        symbol_codes.astype(np.int64),
+        directions,
+        np.asarray(quantities),
+        np.asarray(prices, dtype=np.float64),
+        np.asarray(fees, dtype=np.float64),
+        len(uniques),
+    )
+
+
+def _max_drawdown_duration_loop(gross, timestamps):
+    max_duration = -1
+    peak = -np.inf
+    peak_time = -1
+    for i in range(len(gross)):
+        if gross[i] >= peak:
+            if peak_time != -1 and timestamps[i] - peak_time > max_duration:
+                max_duration = timestamps[i] - peak_time
+            peak = gross[i]
+            peak_time = timestamps[i]
+    return max_duration
+
+
+def _max_drawdown_duration_numpy(gross, timestamps):
+    highs = np.flatnonzero(gross == np.maximum.accumulate(gross))
+    if len(highs) < 2:
+        return -1
+    return np.diff(timestamps[highs]).max()
+
+
+def max_drawdown_duration(gross, timestamps):
+    """The longest time between two all time highs.
+
+    Args:
+        gross (ndarray): the gross cumulative returns (or the equity)
+        timestamps (ndarray): int64 nanoseconds, e.g. DatetimeIndex.asi8
+
+    Returns:
+        int: the duration in nanoseconds, -1 if there are less than two all time highs
+    """
+    return int(
+        _get_kernels()["max_drawdown_duration"](
+            np.asarray(gross, dtype=np.float64), np.asarray(timestamps, dtype=np.int64)
+        )
+    )
+
+
+def _ema_loop(values, alpha):
+    result = np.empty(len(values))
+    if len(values) == 0:
+        return result
+    result[0] = values[0]
+    for i in range(1, len(values)):
+        result[i] = alpha * values[i] + (1 - alpha) * result[i - 1]
+    return result
+
+
+def _ema_pandas(values, alpha):
+    return pd.Series(values).ewm(alpha=alpha, adjust=False).mean().to_numpy()
+
+
+def ema(values, span):
+    """The exponential moving average with alpha = 2 / (span + 1), like pandas' ewm(span=span, adjust=False).mean(). The values may not contain NaN.
+
+    Args:
+        values (ndarray): the values
+        span (float): the span
+
+    Returns:
+        ndarray: the EMA
+    """
+    return _get_kernels()["ema"](np.asarray(values, dtype=np.float64), 2 / (span + 1))
@@ -0,0 +1,111 @@
+"""Memory accounting of the components of a backtest.
+
+Every component reports its footprint with memory_usage(), a dict with the bytes of its parts. The sizes are estimated from the array sizes, so they are cheap enough to check at every market close:
+    - DataFrames and arrays count their buffers (not the Python objects in object columns). Series with objects (e.g. the rows of the latest bars) count their objects too.
+    - dicts count all keys and values, lists and deques count their length times the average size of the first and last item
+    - views count the memory they view, so bars that are shared (e.g. memory-mapped or from the data server) are counted in every process
+
+With tracemalloc, the memory that Python and NumPy actually allocated is traced as well. This is more accurate, but slows down the backtest.
+"""
+
+import collections
+import sys
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+MB = 1024**2
+
+
+def get_size(obj, depth=4):
+    """Estimates the memory of an object in bytes.
+
+    Args:
+        obj (object): the object
+        depth (int, optional): how deep to look into nested containers and objects. Defaults to 4.
+
+    Returns:
+        int: the estimate
+    """
+    if isinstance(obj, pd.DataFrame):
+        return int(obj.memory_usage(index=True, deep=False).sum())
+    if isinstance(obj, pd.Series):
+        # A bar of the latest bars is a Series with the Python objects of a row
+        return int(obj.memory_usage(index=True, deep=obj.dtype == object))
+    if isinstance(obj, (np.ndarray, pd.Index)):
+        return int(obj.nbytes)
+    if hasattr(obj, "nbytes") and not isinstance(obj, type):
+        return int(obj.nbytes)  # E.g. Arrow tables and arrays
+    size = sys.getsizeof(obj)
+    if depth == 0:
+        return size
+
+    if isinstance(obj, dict):
+        return size + sum(get_size(key, depth - 1) + get_size(value, depth - 1) for key, value in obj.items())
+    if isinstance(obj, (list, tuple, collections.deque)):
+        if len(obj) == 0:
+            return size
+        return size + len(obj) * (get_size(obj[0], depth - 1) + get_size(obj[-1], depth - 1)) // 2
+    if isinstance(obj, (set, frozenset)):
+        return size + sum(get_size(item, depth - 1) for item in obj)
+    if hasattr(obj, "__dict__") and not isinstance(obj, type):
+        return size + get_size(vars(obj), depth - 1)
+    return size
+
+
+class MemoryMonitor:
+    """Keeps the peak memory of every component of a backtest. Optionally traces the allocations with tracemalloc."""
+
+    def __init__(self, budget=None, mode="arrays"):
+        """Initializes the monitor. With the 'tracemalloc' mode, tracing starts immediately, so create the monitor before the components.
+
+        Args:
+            budget (float, optional): the memory budget in MB. Defaults to None (no budget).
+            mode (str, optional): 'arrays' to estimate the memory from the array sizes or 'tracemalloc' to trace the allocations as well. Defaults to 'arrays'.
+        """
+        if mode not in ["arrays", "tracemalloc"]:
+            raise ValueError("The mode must be 'arrays' or 'tracemalloc'!")
+        self.budget = budget
+        self.mode = mode
+        self.peaks = {}  # {'data_handler.all_bars': the peak in bytes}
+        self.peak_total = 0
+
+        if self.mode == "tracemalloc" and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def update(self, usage):
+        """Updates the peaks with the memory of the components.
+
+        Args:
+            usage (dict): the bytes of every part of every component, see Backtest.memory_usage()
+
+        Returns:
+            int: the total in bytes
+        """
+        total = 0
+        for component, parts in usage.items():
+            for part, size in parts.items():
+                key = f"{component}.{part}"
+                self.peaks[key] = max(self.peaks.get(key, 0), size)
+                total += size
+        self.peak_total = max(self.peak_total, total)
+        return total
+
+    def is_over_budget(self, total):
+        """Whether the total in bytes exceeds the budget."""
+        return self.budget is not None and total > self.budget * MB
+
+    def get_summary(self):
+        """Gets the peak memory of the run in MB. With tracemalloc, tracing stops.
+
+        Returns:
+            dict: the total peak, the peak of every part and the peak that was traced
+        """
+        summary = {"Peak memory MB": round(self.peak_total / MB, 1)}
+        summary.update({f"{key} MB": round(size / MB, 1) for key, size in self.peaks.items()})
+        if self.mode == "tracemalloc" and tracemalloc.is_tracing():
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            summary["Peak traced MB"] = round(peak / MB, 1)
+        return summary
@@ -0,0 +1,221 @@
+"""Streaming versions of the statistics in performance.py. They are updated during the backtest, so we do not need the portfolio log to report them."""
+
+import numpy as np
+
+
+class RunningMetrics:
+    """Accumulators that are updated on every portfolio log append. Percentages are base 100, just like in performance.py.
+
+    The return moments are calculated with Welford's algorithm, which is numerically stable and needs O(1) memory.
+    """
+
+    def __init__(self):
+        self.start_datetime = None
+        self.last_datetime = None
+        self.first_equity = None
+        self.last_equity = None
+
+        # Return moments, the same returns as the 'return' column in the portfolio log.
+        self.count = 0
+        self._mean = 0.0
+        self._m2 = 0.0
+        self.downside_count = 0
+        self._downside_mean = 0.0
+        self._downside_m2 = 0.0
+
+        # Drawdowns
+        self.peak_equity = None
+        self.peak_datetime = None
+        self.drawdown = 0.0
+        self.max_drawdown = 0.0
+        self.max_drawdown_duration = None  # The longest time between two all time highs
+
+        # Monthly returns (sum of returns in %, like in performance.calculate_winning_months) and exposure
+        self.monthly_returns = {}  # {(2020, 1): 1.5, ...}
+        self.periods_in_market = 0
+
+        # Fees
+        self.total_fees = 0.0
+        self._equity_sum = 0.0
+
+        # Closed trades, like the statistics of the trade log in performance.py
+        self.closed_trades = 0
+        self._profit_sum = 0.0  # The sum of the net P/L % of the closed trades
+        self._wins = 0
+        self._win_sum = 0.0
+        self._losses = 0
+        self._loss_sum = 0.0
+        self._duration_sum = None
+
+    def update(self, dt, equity, positions_value):
+        """Updates the accumulators with a new portfolio log row.
+
+        Args:
+            dt (datetime): the datetime of the row
+            equity (float): the equity
+            positions_value (float): the value of the positions
+        """
+        if self.count == 0:
+            self.start_datetime = dt
+            self.first_equity = equity
+            self.peak_equity = equity
+            self.peak_datetime = dt
+            ret = 0.0  # The first return is 0, like the fillna(0) in the portfolio log
+        else:
+            ret = equity / self.last_equity - 1
+
+        self.last_datetime = dt
+        self.last_equity = equity
+
+        # Returns
+        self.count += 1
+        delta = ret - self._mean
+        self._mean += delta / self.count
+        self._m2 += delta * (ret - self._mean)
+
+        if ret < 0:
+            self.downside_count += 1
+            delta = ret - self._downside_mean
+            self._downside_mean += delta / self.downside_count
+            self._downside_m2 += delta * (ret - self._downside_mean)
+
+        # Drawdowns
+        if equity >= self.peak_equity:
+            duration = dt - self.peak_datetime
+            if self.max_drawdown_duration is None or duration > self.max_drawdown_duration:
+                self.max_drawdown_duration = duration
+            self.peak_equity = equity
+            self.peak_datetime = dt
+            self.drawdown = 0.0
+        else:
+            self.drawdown = 1 - equity / self.peak_equity
+            self.max_drawdown = max(self.max_drawdown, self.drawdown)
+
+        # Monthly returns and exposure
+        month = (dt.year, dt.month)
+        self.monthly_returns[month] = self.monthly_returns.get(month, 0.0) + ret * 100
+        if positions_value != 0:
+            self.periods_in_market += 1
+
+        self._equity_sum += equity
+
+    def update_from_fill(self, fill):
+        """Updates the fees with a FillEvent."""
+        self.total_fees += fill.fees
+
+    def update_from_trade(self, datetime_in, datetime_out, net_pnl):
+        """Updates the trade statistics with a closed trade.
+
+        Args:
+            datetime_in (datetime): the datetime of the opening fill
+            datetime_out (datetime): the datetime of the closing fill
+            net_pnl (float): the net P/L in % (base 100)
+        """
+        self.closed_trades += 1
+        self._profit_sum += net_pnl
+        if net_pnl > 0:
+            self._wins += 1
+            self._win_sum += net_pnl
+        elif net_pnl < 0:
+            self._losses += 1
+            self._loss_sum += net_pnl
+
+        duration = datetime_out - datetime_in
+        self._duration_sum = duration if self._duration_sum is None else self._duration_sum + duration
+
+    @property
+    def current_drawdown(self):
+        """The current drawdown in %"""
+        return self.drawdown * 100
+
+    @property
+    def maximum_drawdown(self):
+        """The maximum drawdown so far in %"""
+        return self.max_drawdown * 100
+
+    def _get_years(self):
+        return (self.last_datetime - self.start_datetime).days / 365
+
+    def calculate_annual_return(self):
+        years = self._get_years()
+        if years == 0:
+            return np.nan
+        annual_return = (self.last_equity / self.first_equity) ** (1 / years) - 1
+        return round(annual_return * 100, 1)
+
+    def calculate_sharpe(self, risk_free=0):
+        # Riskfree also in base 100 percentage.
+        std = np.sqrt(self._m2 / (self.count - 1)) if self.count > 1 else np.nan
+        annual_mean = (self.calculate_annual_return() - risk_free) * 0.01
+        return round(annual_mean / (std * np.sqrt(252)), 2)
+
+    def calculate_sortina(self, risk_free=0):
+        # Riskfree also in base 100 percentage.
+        std = np.sqrt(self._downside_m2 / (self.downside_count - 1)) if self.downside_count > 1 else np.nan
+        annual_mean = (self.calculate_annual_return() - risk_free) * 0.01
+        return round(annual_mean / (std * np.sqrt(252)), 2)
+
+    def calculate_winning_months(self):
+        if len(self.monthly_returns) == 0:
+            return np.nan
+        winning_months = sum(ret > 0 for ret in self.monthly_returns.values())
+        return round(100 * winning_months / len(self.monthly_returns), 0)
+
+    def calculate_time_in_market(self):
+        if self.count == 0:
+            return np.nan
+        return round(100 * self.periods_in_market / self.count, 0)
+
+    def calculate_fees_drag(self):
+        years = self._get_years()
+        if years == 0:
+            return np.nan
+        average_equity = self._equity_sum / self.count
+        return round(100 * self.total_fees / average_equity / years, 1)
+
+    def calculate_average_profit(self):
+        if self.closed_trades == 0:
+            return np.nan
+        return round(self._profit_sum / self.closed_trades, 2)
+
+    def calculate_average_trade_duration(self):
+        if self.closed_trades == 0:
+            return np.nan
+        tdelta = self._duration_sum / self.closed_trades
+        days = tdelta.days
+        hours = tdelta.seconds // 3600
+        minutes = (tdelta.seconds // 60) % 60
+        return f"{days}d{hours}h{minutes}m"
+
+    def calculate_profit_factor(self):
+        if self._wins == 0 or self._losses == 0:
+            return np.nan
+        return round((self._win_sum / self._wins) / abs(self._loss_sum / self._losses), 2)
+
+    def calculate_trades_per_month(self):
+        # There are on average 21 trading days per month.
+        total_months = (self.last_datetime - self.start_datetime).days / 21
+        if total_months == 0:
+            return np.nan
+        return round(self.closed_trades / total_months, 1)
+
+    def get_statistics(self):
+        """Gets the statistics that can be calculated without the logs.
+
+        Returns:
+            dict: the statistics
+        """
+        return {
+            "Annual return %": self.calculate_annual_return(),
+            "Sharpe": self.calculate_sharpe(),
+            "Sortina": self.calculate_sortina(),
+            "Max drawdown %": round(self.maximum_drawdown, 1),
+            "Max drawdown duration": self.max_drawdown_duration,
+            "Winning months %": self.calculate_winning_months(),
+            "Time in market %": self.calculate_time_in_market(),
+            "Average profit %": self.calculate_average_profit(),
+            "Average duration per trade": self.calculate_average_trade_duration(),
+            "Profit factor": self.calculate_profit_factor(),
+            "Trades/month": self.calculate_trades_per_month(),
+            "Annual fees %": self.calculate_fees_drag(),
+        }
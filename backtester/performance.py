@@ -1,40 +1,36 @@
-"""Most functions were taken from Section 13 from the notebook series. The fills_to_trade is the most difficult function. See _dissection.ipynb to understand it."""
+"""Most functions were taken from Section 13 from the notebook series. The fills_to_trade is the most difficult function. See _dissection.ipynb and backtester/trades.py to understand it."""
 
 # The shortcut to collapse all functions is CTRL+K, CTRL+0
 # The shortcut to unfold is CTRL+K, CTRL+J
 
+from datetime import timedelta
+from functools import cached_property
+
 import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
-import matplotlib.ticker as mtick
-from scipy import stats
+
+from backtester import kernels
+from backtester.trades import TRADE_LOG_COLUMNS, FifoTradeMatcher
 
 
 def calculate_annual_return(portfolio_log):
     # In percentage (base 100)
-    cum_returns_gross = portfolio_log["return_cum"] * 0.01 + 1
-    total_length = portfolio_log.index[-1] - portfolio_log.index[0]
-    annual_return = (cum_returns_gross[-1]) ** (1 / (total_length.days / 365)) - 1
-    return round(annual_return * 100, 1)
+    return PerformanceReport(portfolio_log).annual_return
 
 
 def calculate_sortina(portfolio_log, risk_free=0):
     # Riskfree also in base 100 percentage.
-    returns = portfolio_log["return"] * 0.01
-    annual_mean = (calculate_annual_return(portfolio_log) - risk_free) * 0.01
-    annual_downward_std = returns[returns < 0].std() * np.sqrt(252)
-    return round(annual_mean / annual_downward_std, 2)
+    return PerformanceReport(portfolio_log, risk_free=risk_free).sortina
 
 
 def calculate_sharpe(portfolio_log, risk_free=0):
     # Riskfree also in base 100 percentage.
-    returns = portfolio_log["return"] * 0.01
-    annual_mean = (calculate_annual_return(portfolio_log) - risk_free) * 0.01
-    annual_downward_std = returns.std() * np.sqrt(252)
-    return round(annual_mean / annual_downward_std, 2)
+    return PerformanceReport(portfolio_log, risk_free=risk_free).sharpe
 
 
 def calculate_alpha_beta(returns, returns_benchmark, risk_free=0):
+    from scipy import stats  # Imported here, because scipy is slow to import and most runs do not need it
+
     returns = returns - risk_free / 252
     returns_benchmark = returns_benchmark - risk_free / 252
     beta, alpha = stats.linregress(returns_benchmark.dropna().values, returns.dropna().values)[0:2]
@@ -42,6 +38,8 @@ def calculate_alpha_beta(returns, returns_benchmark, risk_free=0):
 
 
 def calculate_alpha_beta_weekly(returns, returns_benchmark, risk_free=0):
+    from scipy import stats
+
     returns = returns - risk_free / 52
     returns = returns.resample("1W").last()
 
@@ -52,6 +50,120 @@ def calculate_alpha_beta_weekly(returns, returns_benchmark, risk_free=0):
     return round(alpha, 2), round(beta, 2)
 
 
+def _rolling_sum(values, window):
+    """The sum over the last window values along the last axis, with cumulative sums. The first window - 1 values are NaN."""
+    result = np.full(values.shape, np.nan)
+    if window > values.shape[-1]:
+        return result  # No window fits
+    cumsum = np.cumsum(values, axis=-1)
+    result[..., window - 1] = cumsum[..., window - 1]
+    result[..., window:] = cumsum[..., window:] - cumsum[..., :-window]
+    return result
+
+
+def _rolling_max(values, window):
+    """The maximum over the last window values along the last axis in O(n), with the van Herk/Gil-Werman algorithm.
+    The values are split in blocks of the window length. The maximum of a window is the maximum of the suffix maximum of one block and the prefix maximum of the next block.
+    """
+    periods = values.shape[-1]
+    if window > periods:
+        return np.full(values.shape, np.nan)  # No window fits
+    n_blocks = -(-periods // window)  # Rounded up
+    padded = np.full(values.shape[:-1] + (n_blocks * window,), -np.inf)
+    padded[..., :periods] = values
+    blocks = padded.reshape(values.shape[:-1] + (n_blocks, window))
+
+    prefix_max = np.maximum.accumulate(blocks, axis=-1).reshape(padded.shape)
+    suffix_max = np.flip(np.maximum.accumulate(np.flip(blocks, axis=-1), axis=-1), axis=-1).reshape(padded.shape)
+
+    result = np.full(values.shape, np.nan)
+    result[..., window - 1 :] = np.maximum(
+        suffix_max[..., : periods - window + 1], prefix_max[..., window - 1 : periods]
+    )
+    return result
+
+
+def calculate_rolling_statistics(returns, window, benchmark_returns=None, periods_per_year=252, risk_free=0):
+    """Calculates the rolling volatility, Sharpe, drawdown and optionally alpha/beta for every window in one vectorized pass.
+    The sums are calculated with cumulative sums and the maxima with a block algorithm, so the time does not depend on the window length.
+    Works on one return series or on many at once, with shape (runs, periods).
+
+    Args:
+        returns (ndarray): the returns in base 100 percentage, like the 'return' column of the portfolio log
+        window (int): the amount of periods in a window
+        benchmark_returns (ndarray, optional): the returns of the benchmark in base 100 percentage, with the same periods. Defaults to None.
+        periods_per_year (int, optional): for annualizing. E.g. 252 for daily bars and 252 * 390 for 1-minute bars. Defaults to 252.
+        risk_free (float, optional): the annual risk free rate in base 100 percentage. Defaults to 0.
+
+    Returns:
+        dict: arrays with the same shape as returns. The first window - 1 periods are NaN, so everything is NaN if the window is longer than the returns. With a window of 1, the volatility, Sharpe, alpha and beta are NaN.
+    """
+    if window < 1:
+        raise ValueError("The window must be at least 1!")
+    returns = np.asarray(returns, dtype=float) * 0.01 - risk_free * 0.01 / periods_per_year
+
+    # Mean and standard deviation (ddof=1). We subtract the overall mean first to avoid cancellation in the sums of squares.
+    centered = returns - returns.mean(axis=-1, keepdims=True)
+    sum_x = _rolling_sum(centered, window)
+    sum_xx = _rolling_sum(centered**2, window)
+    mean = sum_x / window
+
+    # Drawdown from the highest equity within the window
+    gross = np.cumprod(1 + returns, axis=-1)
+    drawdown = 1 - gross / _rolling_max(gross, window)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        std = np.sqrt(np.maximum(sum_xx - window * mean**2, 0) / (window - 1))  # NaN with a window of 1
+        if window == 1:
+            std = np.full(std.shape, np.nan)
+        mean = mean + returns.mean(axis=-1, keepdims=True)
+        statistics = {
+            "volatility %": std * np.sqrt(periods_per_year) * 100,
+            "sharpe": mean / std * np.sqrt(periods_per_year),
+            "drawdown %": drawdown * 100,
+        }
+
+        if benchmark_returns is not None:
+            # Least squares of returns = alpha + beta * benchmark_returns, like calculate_alpha_beta
+            benchmark = np.asarray(benchmark_returns, dtype=float) * 0.01 - risk_free * 0.01 / periods_per_year
+            benchmark_centered = benchmark - benchmark.mean(axis=-1, keepdims=True)
+            sum_y = _rolling_sum(benchmark_centered, window)
+            sum_yy = _rolling_sum(benchmark_centered**2, window)
+            sum_xy = _rolling_sum(centered * benchmark_centered, window)
+
+            covariance = sum_xy - sum_x * sum_y / window
+            variance = sum_yy - sum_y**2 / window
+            beta = covariance / variance if window > 1 else np.full(variance.shape, np.nan)
+            benchmark_mean = sum_y / window + benchmark.mean(axis=-1, keepdims=True)
+            statistics["alpha %"] = (mean - beta * benchmark_mean) * 100
+            statistics["beta"] = beta
+
+    return statistics
+
+
+def calculate_rolling_portfolio_statistics(
+    portfolio_log, window, benchmark_returns=None, periods_per_year=252, risk_free=0
+):
+    """Calculates the rolling statistics of the portfolio log, see calculate_rolling_statistics.
+
+    Args:
+        portfolio_log (DataFrame): the portfolio log
+        window (int): the amount of periods in a window
+        benchmark_returns (Series, optional): the returns of the benchmark in base 100 percentage. Aligned to the portfolio log. Defaults to None.
+        periods_per_year (int, optional): for annualizing. Defaults to 252.
+        risk_free (float, optional): the annual risk free rate in base 100 percentage. Defaults to 0.
+
+    Returns:
+        DataFrame: the rolling statistics
+    """
+    if benchmark_returns is not None:
+        benchmark_returns = benchmark_returns.reindex(portfolio_log.index).fillna(0).values
+    statistics = calculate_rolling_statistics(
+        portfolio_log["return"].values, window, benchmark_returns, periods_per_year, risk_free
+    )
+    return pd.DataFrame(statistics, index=portfolio_log.index)
+
+
 def calculate_drawdowns(portfolio_log):
     """
     Get drawdown Series, maximum DD and maximum duration. Base 100 for percentages.
@@ -59,19 +171,13 @@ def calculate_drawdowns(portfolio_log):
     Returns:
         (Series, float, datetime)
     """
-    cum_returns_gross = portfolio_log["return_cum"] * 0.01 + 1
-    maximum_gross_return = cum_returns_gross.cummax()
-    drawdown = 1 - cum_returns_gross / maximum_gross_return
-
-    ATH_series = drawdown[drawdown == 0]
-    durations = ATH_series.index[1:].to_pydatetime() - ATH_series.index[:-1].to_pydatetime()
-    drawdown = round(drawdown, 3)
-
-    return drawdown * 100, drawdown.max() * 100, durations.max()
+    report = PerformanceReport(portfolio_log)
+    return report.drawdowns, report.max_drawdown, report.max_drawdown_duration
 
 
 def fills_to_trades(fills_log):
-    """Converts the fills log to a trade log
+    """Converts the fills log to a trade log. The fills are matched FIFO per symbol, see FifoTradeMatcher.
+    With numba installed, the matching runs in a compiled kernel, see kernels.py.
 
     Args:
         fills (DataFrame): the fills log
@@ -79,110 +185,52 @@ def fills_to_trades(fills_log):
     Returns:
         DataFrame: the trade log
     """
-    trade_log = pd.DataFrame(
-        columns=[
-            "datetime_in",
-            "symbol",
-            "side",
-            "quantity",
-            "entry",
-            "exit",
-            "datetime_out",
-            "fees",
-            "net P/L %",
-            "net P/L $",
-            "remaining_qty",
-        ]
+    if kernels.get_backend() == "numba":
+        return calculate_PNL_trade_log(_match_fills_with_kernel(fills_log))
+
+    matcher = FifoTradeMatcher()
+    for dt, symbol, side, quantity, fill_price, fees in zip(
+        fills_log.index,
+        fills_log["symbol"].values,
+        fills_log["side"].values,
+        fills_log["quantity"].values,
+        fills_log["fill_price"].values,
+        fills_log["fees"].values,
+    ):
+        matcher.add_fill(dt, symbol, side, quantity, fill_price, fees)
+    return calculate_PNL_trade_log(matcher.to_df())
+
+
+def _match_fills_with_kernel(fills_log):
+    """The same trade log as FifoTradeMatcher.to_df(), from kernels.fifo_match."""
+    trade_fill, close_fill, quantity, entry, exit, fees, remaining_qty = kernels.fifo_match(
+        fills_log["symbol"].values,
+        fills_log["side"].values,
+        fills_log["quantity"].values,
+        fills_log["fill_price"].values,
+        fills_log["fees"].values,
+    )
+    datetimes = pd.DatetimeIndex(fills_log.index)
+    datetime_out = pd.Series(pd.NaT, index=range(len(trade_fill)), dtype="datetime64[ns]")
+    closed = close_fill >= 0
+    datetime_out[closed] = datetimes[close_fill[closed]]
+
+    return pd.DataFrame(
+        {
+            "datetime_in": pd.Series(datetimes[trade_fill]),
+            "symbol": pd.Series(fills_log["symbol"].values[trade_fill], dtype=object),
+            "side": pd.Series(fills_log["side"].values[trade_fill], dtype=object),
+            "quantity": pd.Series(quantity),
+            "entry": pd.Series(entry, dtype=float),
+            "exit": pd.Series(exit, dtype=float),
+            "datetime_out": datetime_out,
+            "fees": pd.Series(fees, dtype=float).round(2),
+            "net P/L %": np.nan,
+            "net P/L $": np.nan,
+            "remaining_qty": pd.Series(remaining_qty),
+        },
+        columns=TRADE_LOG_COLUMNS,
     )
-    for dt, trade in fills_log.iterrows():
-        symbol = trade["symbol"]
-        side = trade["side"]
-        opposite_side = "SELL" if side == "BUY" else "BUY"
-        quantity = trade["quantity"]
-        fill_price = trade["fill_price"]
-        fees = trade["fees"]
-
-        current_position_in_symbol_opposite = trade_log[
-            (trade_log["symbol"] == symbol) & (trade_log["side"] == opposite_side) & (trade_log["remaining_qty"] > 0)
-        ]
-        if len(current_position_in_symbol_opposite) == 0:
-            # If no open trades in this symbol in the opposite direction, create new trade
-            trade_log.loc[len(trade_log)] = [
-                dt,
-                symbol,
-                side,
-                quantity,
-                fill_price,
-                np.nan,
-                np.nan,
-                fees,
-                np.nan,
-                np.nan,
-                quantity,
-            ]
-        else:
-            # Else we (partially) close the trade(s) and create a new trade if a net position remains. Using FIFO.
-            for index, open_trade in current_position_in_symbol_opposite.iterrows():
-                remaining_qty_open_trade = open_trade["remaining_qty"]
-                already_filled_qty_open_trade = open_trade["quantity"] - open_trade["remaining_qty"]
-                current_average_fill = open_trade["exit"]
-
-                # Partial close of open_trade
-                if quantity < remaining_qty_open_trade:
-                    if np.isnan(current_average_fill):
-                        trade_log.loc[index, "exit"] = fill_price
-                    else:
-                        average_fill_exit = (
-                            (current_average_fill * already_filled_qty_open_trade) + (fill_price * quantity)
-                        ) / (
-                            already_filled_qty_open_trade + quantity
-                        )  # Calculate new average fill
-                        trade_log.loc[index, "exit"] = average_fill_exit
-
-                    trade_log.loc[index, "remaining_qty"] -= quantity
-                    trade_log.loc[index, "fees"] += fees
-                    break  # We don't have to look at the next trade
-
-                # Full close of open_trade
-                elif quantity >= remaining_qty_open_trade:
-                    if np.isnan(current_average_fill):
-                        trade_log.loc[index, "exit"] = fill_price
-                    else:
-                        average_fill_exit = (
-                            (current_average_fill * already_filled_qty_open_trade) + (fill_price * quantity)
-                        ) / (
-                            already_filled_qty_open_trade + quantity
-                        )  # Calculate new average fill
-                        trade_log.loc[index, "exit"] = average_fill_exit
-
-                    trade_log.loc[index, "remaining_qty"] = 0
-                    trade_log.loc[index, "fees"] += fees
-                    trade_log.loc[index, "datetime_out"] = dt
-
-                    if quantity == remaining_qty_open_trade:
-                        break  # We don't have to look at the next trade
-                    else:
-                        quantity = quantity - remaining_qty_open_trade  # Calculate remaining quantity
-
-                        # If we are at the end and there is still a remaining quantity, that is a new position
-                        if index == len(current_position_in_symbol_opposite) - 1:
-                            trade_log.loc[len(trade_log)] = [
-                                dt,
-                                symbol,
-                                side,
-                                quantity,
-                                fill_price,
-                                np.nan,
-                                np.nan,
-                                fees,
-                                np.nan,
-                                np.nan,
-                                quantity,
-                            ]
-        trade_log["datetime_in"] = pd.to_datetime(trade_log["datetime_in"])
-        trade_log["datetime_out"] = pd.to_datetime(trade_log["datetime_out"])
-        trade_log["fees"] = round(trade_log["fees"], 2)
-    return calculate_PNL_trade_log(trade_log)
 
 
 def calculate_PNL_trade_log(trade_log):
@@ -223,10 +271,7 @@ def calculate_time_in_market(portfolio_log):
     Returns:
         float: the percentage of days that the strategy is in the market. Base 100.
     """
-    trading_days_in_market = sum((portfolio_log["positions_value"] != 0))
-    total_market_days = len(portfolio_log)
-    fraction_in_market = trading_days_in_market / total_market_days
-    return round(fraction_in_market * 100, 0)
+    return PerformanceReport(portfolio_log).time_in_market
 
 
 def calculate_average_trade_duration(trade_log):
@@ -238,11 +283,7 @@ def calculate_average_trade_duration(trade_log):
     Returns:
         list(float, float, float): a list of the days, hours and minutes
     """
-    tdelta = (trade_log["datetime_out"] - trade_log["datetime_in"]).sum() / len(trade_log)
-    days = tdelta.days
-    hours = tdelta.seconds // 3600
-    minutes = (tdelta.seconds // 60) % 60
-    return [days, hours, minutes]
+    return PerformanceReport(trade_log=trade_log).average_trade_duration
 
 
 def calculate_fees_drag(portfolio_log, fills_log):
@@ -255,13 +296,7 @@ def calculate_fees_drag(portfolio_log, fills_log):
     Returns:
         float: the fees drag per year
     """
-    average_equity = portfolio_log["equity"].mean()
-    total_fees = fills_log["fees"].sum()
-    total_years = (portfolio_log.index[-1] - portfolio_log.index[0]).days / 365
-
-    fraction_of_fees = total_fees / average_equity
-    fraction_of_fees_per_year = fraction_of_fees / total_years
-    return round(fraction_of_fees_per_year * 100, 1)
+    return PerformanceReport(portfolio_log, fills_log=fills_log).fees_drag
 
 
 def calculate_average_profit(trade_log):
@@ -273,7 +308,7 @@ def calculate_average_profit(trade_log):
     Returns:
         float: the value
     """
-    return round(trade_log["net P/L %"].mean(), 2)
+    return PerformanceReport(trade_log=trade_log).average_profit
 
 
 def calculate_trades_per_month(portfolio_log, trade_log):
@@ -286,9 +321,7 @@ def calculate_trades_per_month(portfolio_log, trade_log):
     Returns:
         float: the value
     """
-    # There are on average 21 trading days per month.
-    total_months = (portfolio_log.index[-1] - portfolio_log.index[0]).days / 21
-    return round(len(trade_log) / total_months, 1)
+    return PerformanceReport(portfolio_log, trade_log=trade_log).trades_per_month
 
 
 def calculate_profit_factor(trade_log):
@@ -300,9 +333,7 @@ def calculate_profit_factor(trade_log):
     Returns:
         float: the profit factor
     """
-    average_profit = trade_log[trade_log["net P/L %"] > 0]["net P/L %"].mean()
-    average_loss = abs(trade_log[trade_log["net P/L %"] < 0]["net P/L %"].mean())
-    return round(average_profit / average_loss, 2)
+    return PerformanceReport(trade_log=trade_log).profit_factor
 
 
 def calculate_winning_months(portfolio_log):
@@ -314,41 +345,311 @@ def calculate_winning_months(portfolio_log):
     Returns:
         float: the percentage
     """
-    total_months = (portfolio_log.index[-1] - portfolio_log.index[0]).days / 30
-    monthly_return = portfolio_log["return"].resample("1M").sum()
-    return round(100 * monthly_return[monthly_return > 0].count() / len(monthly_return), 0)
-
-
-def plot_fig(portfolio_log):
-    fig, (ax1, ax2, ax3) = plt.subplots(nrows=3, gridspec_kw={"height_ratios": [2, 1, 1]})
-    fig.suptitle("IBS", fontsize=16)
-    fig.tight_layout(pad=1.5)
-
-    # Returns
-    ax1.plot(
-        portfolio_log.index,
-        portfolio_log["return_cum"],
-        color="midnightblue",
-        linewidth=1,
+    return PerformanceReport(portfolio_log).winning_months
+
+
+class PerformanceReport:
+    """Calculates the statistics of a backtest from the portfolio, fills and trade log. Percentages are base 100.
+
+    The intermediate results (gross returns, monthly returns and drawdowns) are shared by the statistics and calculated once.
+    Every statistic is only calculated when it is needed and then memoized. So get_statistics() does every calculation only once.
+    """
+
+    def __init__(self, portfolio_log=None, fills_log=None, trade_log=None, risk_free=0):
+        """
+        Args:
+            portfolio_log (DataFrame, optional): the portfolio log
+            fills_log (DataFrame, optional): the fills log
+            trade_log (DataFrame, optional): the trade log
+            risk_free (float, optional): the risk free rate in base 100 percentage. Defaults to 0.
+        """
+        self.portfolio_log = portfolio_log
+        self.fills_log = fills_log
+        self.trade_log = trade_log
+        self.risk_free = risk_free
+
+    ### Intermediate results
+    @cached_property
+    def returns(self):
+        return self.portfolio_log["return"] * 0.01
+
+    @cached_property
+    def cum_returns_gross(self):
+        return self.portfolio_log["return_cum"] * 0.01 + 1
+
+    @cached_property
+    def total_length(self):
+        return self.portfolio_log.index[-1] - self.portfolio_log.index[0]
+
+    @cached_property
+    def monthly_returns(self):
+        return self.portfolio_log["return"].resample("1M").sum()
+
+    @cached_property
+    def _drawdowns(self):
+        maximum_gross_return = self.cum_returns_gross.cummax()
+        drawdown = 1 - self.cum_returns_gross / maximum_gross_return
+
+        # The longest time between two all time highs. If we never reach a new all time high, there is no finished drawdown.
+        duration = kernels.max_drawdown_duration(self.cum_returns_gross.values, self.cum_returns_gross.index.asi8)
+        max_duration = pd.Timedelta(duration).to_pytimedelta() if duration >= 0 else timedelta(0)
+        drawdown = round(drawdown, 3)
+        return drawdown * 100, drawdown.max() * 100, max_duration
+
+    @property
+    def drawdowns(self):
+        return self._drawdowns[0]
+
+    @property
+    def max_drawdown(self):
+        return self._drawdowns[1]
+
+    @property
+    def max_drawdown_duration(self):
+        return self._drawdowns[2]
+
+    ### Statistics from the portfolio log
+    @cached_property
+    def annual_return(self):
+        annual_return = self.cum_returns_gross.iloc[-1] ** (1 / (self.total_length.days / 365)) - 1
+        return round(annual_return * 100, 1)
+
+    @cached_property
+    def sharpe(self):
+        annual_mean = (self.annual_return - self.risk_free) * 0.01
+        annual_std = self.returns.std() * np.sqrt(252)
+        return round(annual_mean / annual_std, 2)
+
+    @cached_property
+    def sortina(self):
+        annual_mean = (self.annual_return - self.risk_free) * 0.01
+        annual_downward_std = self.returns[self.returns < 0].std() * np.sqrt(252)
+        return round(annual_mean / annual_downward_std, 2)
+
+    @cached_property
+    def winning_months(self):
+        monthly_return = self.monthly_returns
+        return round(100 * monthly_return[monthly_return > 0].count() / len(monthly_return), 0)
+
+    @cached_property
+    def time_in_market(self):
+        # A 1% position on a day counts as one whole day.
+        trading_days_in_market = (self.portfolio_log["positions_value"] != 0).sum()
+        fraction_in_market = trading_days_in_market / len(self.portfolio_log)
+        return round(fraction_in_market * 100, 0)
+
+    @cached_property
+    def fees_drag(self):
+        average_equity = self.portfolio_log["equity"].mean()
+        total_fees = self.fills_log["fees"].sum()
+        total_years = self.total_length.days / 365
+
+        fraction_of_fees = total_fees / average_equity
+        fraction_of_fees_per_year = fraction_of_fees / total_years
+        return round(fraction_of_fees_per_year * 100, 1)
+
+    ### Statistics from the trade log
+    @cached_property
+    def average_profit(self):
+        return round(self.trade_log["net P/L %"].mean(), 2)
+
+    @cached_property
+    def average_trade_duration(self):
+        tdelta = (self.trade_log["datetime_out"] - self.trade_log["datetime_in"]).sum() / len(self.trade_log)
+        days = tdelta.days
+        hours = tdelta.seconds // 3600
+        minutes = (tdelta.seconds // 60) % 60
+        return [days, hours, minutes]
+
+    @cached_property
+    def profit_factor(self):
+        profits = self.trade_log["net P/L %"]
+        average_profit = profits[profits > 0].mean()
+        average_loss = abs(profits[profits < 0].mean())
+        return round(average_profit / average_loss, 2)
+
+    @cached_property
+    def trades_per_month(self):
+        # There are on average 21 trading days per month.
+        total_months = self.total_length.days / 21
+        return round(len(self.trade_log) / total_months, 1)
+
+    def get_statistics(self):
+        """Gets all statistics of the backtest.
+
+        Returns:
+            dict: the statistics
+        """
+        days, hours, minutes = self.average_trade_duration
+        return {
+            "Annual return %": self.annual_return,
+            "Sharpe": self.sharpe,
+            "Sortina": self.sortina,
+            "Winning months %": self.winning_months,
+            "Time in market %": self.time_in_market,
+            "Average profit %": self.average_profit,
+            "Average duration per trade": f"{days}d{hours}h{minutes}m",
+            "Profit factor": self.profit_factor,
+            "Trades/month": self.trades_per_month,
+            "Annual fees %": self.fees_drag,
+        }
+
+
+def calculate_return_statistics(returns, total_days, month_ids=None, risk_free=0, gross=None):
+    """Calculates the statistics of many return series at once. Every row is one run (or path) and every column one period.
+    All statistics are calculated with vectorized NumPy operations over the whole matrix. Percentages are base 100.
+    These are the statistics of PerformanceReport.get_statistics() that only need the returns (annual return, Sharpe, Sortina and winning months) and the maximum drawdown of PerformanceReport.max_drawdown, with the same rounding.
+
+    Args:
+        returns (ndarray): the returns as fractions with shape (runs, periods). The first period should be 0, like in the portfolio log.
+        total_days (int): the amount of calendar days between the first and last period
+        month_ids (ndarray, optional): the calendar month (year * 12 + month) of every period, for the winning months. Like the monthly resample of PerformanceReport, a month without periods counts as a month without profit. Defaults to None.
+        risk_free (float, optional): the risk free rate in base 100 percentage. Defaults to 0.
+        gross (ndarray, optional): the cumulative gross returns with the same shape, e.g. from the return_cum of the portfolio logs. Defaults to the cumulative product of the returns.
+
+    Returns:
+        dict: arrays with the annual return, Sharpe, Sortina, maximum drawdown and winning months for every run
+    """
+    returns = np.asarray(returns, dtype=float)
+    gross = np.cumprod(1 + returns, axis=1) if gross is None else np.asarray(gross, dtype=float)
+
+    annual_return = np.round((gross[:, -1] ** (1 / (total_days / 365)) - 1) * 100, 1)
+    annual_mean = (annual_return - risk_free) * 0.01
+
+    std = returns.std(axis=1, ddof=1)
+    downside_returns = np.where(returns < 0, returns, np.nan)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        downside_std = np.nanstd(downside_returns, axis=1, ddof=1)
+        sharpe = np.round(annual_mean / (std * np.sqrt(252)), 2)
+        sortina = np.round(annual_mean / (downside_std * np.sqrt(252)), 2)
+
+    drawdown = 1 - gross / np.maximum.accumulate(gross, axis=1)
+    max_drawdown = np.round(drawdown, 3).max(axis=1) * 100
+
+    statistics = {
+        "Annual return %": annual_return,
+        "Sharpe": sharpe,
+        "Sortina": sortina,
+        "Max drawdown %": max_drawdown,
+    }
+
+    if month_ids is not None:
+        month_starts = np.r_[0, np.flatnonzero(np.diff(month_ids)) + 1]
+        monthly_returns = np.add.reduceat(returns, month_starts, axis=1)
+        n_months = month_ids[-1] - month_ids[0] + 1
+        statistics["Winning months %"] = np.round(100 * (monthly_returns > 0).sum(axis=1) / n_months, 0)
+
+    return statistics
+
+
+def calculate_batch_statistics(portfolio_logs, fills_logs, trade_logs, risk_free=0):
+    """Calculates the statistics of PerformanceReport.get_statistics() for many runs at once, with the same keys and rounding.
+    The statistics of the portfolio logs are calculated over a matrix with a row per run, see calculate_return_statistics. The trade logs have a different length for every run, so their statistics are calculated per run with PerformanceReport.
+
+    Args:
+        portfolio_logs (dict): the portfolio log of every run, on a shared datetime index. E.g. {run_id: results_store.load(run_id) for run_id in run_ids}
+        fills_logs (dict): the fills log of every run
+        trade_logs (dict): the trade log of every run
+        risk_free (float, optional): the risk free rate in base 100 percentage. Defaults to 0.
+
+    Returns:
+        DataFrame: the statistics with a row for every run
+    """
+    runs = list(portfolio_logs)
+    index = portfolio_logs[runs[0]].index
+
+    def get_matrix(column):
+        return np.array([portfolio_logs[run][column].to_numpy(dtype=float) for run in runs])
+
+    total_days = (index[-1] - index[0]).days
+    month_ids = (index.year * 12 + index.month).to_numpy()
+    statistics = calculate_return_statistics(
+        get_matrix("return") * 0.01, total_days, month_ids, risk_free, gross=get_matrix("return_cum") * 0.01 + 1
     )
-    ax1.yaxis.set_major_formatter(mtick.PercentFormatter(decimals=0))
-    ax1.set_title("Total return", fontsize=10, fontweight="bold")
-
-    # Drawdown
-    drawdowns, _, _ = calculate_drawdowns(portfolio_log)
-    ax2.plot(drawdowns.index, -drawdowns, color="firebrick", linewidth=1)
-    ax2.yaxis.set_major_formatter(mtick.PercentFormatter(decimals=0))
-    ax2.set_title("Drawdown", fontsize=10, fontweight="bold")
-
-    # Monthly returns
-    monthly_return = portfolio_log["return"].resample("1M").sum()
-    colors = ["firebrick" if ret < 0 else "g" for ret in monthly_return]
-    monthly_return_index = monthly_return.index.values
-    monthly_return_index[0] = portfolio_log.index[0]  # To make the x-axis align
-    monthly_return_index[-1] = portfolio_log.index[-1]  # To make the x-axis align
-
-    ax3.bar(monthly_return.index, monthly_return.values, width=15, color=colors)
-    ax3.yaxis.set_major_formatter(mtick.PercentFormatter(decimals=0))
-    ax3.set_title("Monthly returns", fontsize=10, fontweight="bold")
+    del statistics["Max drawdown %"]  # Not one of the statistics of the report
+
+    # A 1% position on a day counts as one whole day, like PerformanceReport.time_in_market
+    time_in_market = np.round((get_matrix("positions_value") != 0).sum(axis=1) / len(index) * 100, 0)
+    total_fees = np.array([fills_logs[run]["fees"].sum() for run in runs])
+    fees_drag = np.round(total_fees / get_matrix("equity").mean(axis=1) / (total_days / 365) * 100, 1)
+
+    trade_statistics = []
+    for run in runs:
+        report = PerformanceReport(portfolio_logs[run], fills_logs[run], trade_logs[run])
+        days, hours, minutes = report.average_trade_duration
+        trade_statistics.append(
+            {
+                "Average profit %": report.average_profit,
+                "Average duration per trade": f"{days}d{hours}h{minutes}m",
+                "Profit factor": report.profit_factor,
+                "Trades/month": report.trades_per_month,
+            }
+        )
+
+    batch_statistics = pd.DataFrame(
+        {
+            "Annual return %": statistics["Annual return %"],
+            "Sharpe": statistics["Sharpe"],
+            "Sortina": statistics["Sortina"],
+            "Winning months %": statistics["Winning months %"],
+            "Time in market %": time_in_market,
+        },
+        index=runs,
+    )
+    batch_statistics = batch_statistics.join(pd.DataFrame(trade_statistics, index=runs))
+    batch_statistics["Annual fees %"] = fees_drag
+    return batch_statistics
+
+
+def calculate_latency_statistics(latencies):
+    """Calculates the distribution of latencies.
+
+    Args:
+        latencies (list): the latencies in seconds
+
+    Returns:
+        dict: the mean, median, 90th and 99th percentile and maximum in milliseconds
+    """
+    if len(latencies) == 0:
+        return {}
+    latencies = np.array(latencies) * 1000
+    return {
+        "mean": round(latencies.mean(), 3),
+        "p50": round(np.percentile(latencies, 50), 3),
+        "p90": round(np.percentile(latencies, 90), 3),
+        "p99": round(np.percentile(latencies, 99), 3),
+        "max": round(latencies.max(), 3),
+    }
+
+
+def calculate_late_bars(bar_delays, bar_interval):
+    """Calculates the percentage of bars that were processed after the next bar had already arrived. Base 100.
+    If this is not 0, the strategy cannot keep up with the feed.
+
+    Args:
+        bar_delays (list): the delays in seconds between the arrival and processing of each bar
+        bar_interval (float): the seconds between two bars
+
+    Returns:
+        float: the percentage
+    """
+    if len(bar_delays) == 0 or bar_interval == 0:
+        return 0.0
+    late_bars = sum(delay > bar_interval for delay in bar_delays)
+    return round(100 * late_bars / len(bar_delays), 2)
+
+
+def plot_fig(portfolio_log, title="IBS", max_points=2000):
+    """Shows the report in a window, e.g. in a notebook. This blocks until the window is closed. Use report.render_report in batch jobs.
+
+    Args:
+        portfolio_log (DataFrame): the portfolio log
+        title (str, optional): the title. Defaults to 'IBS'.
+        max_points (int, optional): the maximum amount of points per line. Defaults to 2000.
+    """
+    import matplotlib.pyplot as plt  # Imported here, because matplotlib is slow to import and batch runs do not plot
+    from backtester.report import draw_report  # Avoid circular import
 
+    fig = plt.figure()
+    draw_report(fig, portfolio_log, title, max_points)
     plt.show()
@@ -1,6 +1,14 @@
+import os
+import pickle
+import tempfile
 from datetime import datetime, time
 import pandas as pd
 
+from backtester.memory import get_size
+from backtester.metrics import RunningMetrics
+from backtester import performance
+from backtester.trades import FifoTradeMatcher
+
 
 class Portfolio:
     """An interface to simulate a portfolio. The portfolio forwards the orders and keeps track of the administration. In real trading, rest API calls can be used. E.g. for getting the real equity.
@@ -15,7 +23,7 @@ class Portfolio:
 
 
 class StandardPortfolio(Portfolio):
-    def __init__(self, events, data_handler, start_date, initial_capital=10000.0):
+    def __init__(self, events, data_handler, start_date, initial_capital=10000.0, keep_portfolio_log=True):
         self.events = events
         self.data_handler = data_handler
 
@@ -30,11 +38,15 @@ class StandardPortfolio(Portfolio):
         self._current_equity = initial_capital
 
         # These log the portfolio status and all transactions
+        # For long parameter sweeps the logs can be turned off. The statistics are then only available from self.metrics.
+        # Without logs, the fills are not logged and only the open trades are kept, because the metrics already got the P/L of the closed trades.
+        self.keep_portfolio_log = keep_portfolio_log
         self.portfolio_log = []  # list(dict(date, equity, cash, pos. value, positions))
+        self.metrics = RunningMetrics()  # Updated on every portfolio log append
 
         if isinstance(self.data_handler.timeframe, int):
             # If we use daily bars, we can skip the start of the portfolio log because the MarketCloseEvent and a bar coincide.
-            self.portfolio_log.append(
+            self._append_portfolio_log_row(
                 {
                     "datetime": datetime.combine(start_date, time(0)),
                     "equity": self._current_equity,
@@ -45,6 +57,13 @@ class StandardPortfolio(Portfolio):
             )
         self.fills_log = []  # list(dict(date, symbol, side, qty, fill, comm.))
 
+        # The trades are matched on every fill (FIFO), so the open lots are known during the backtest
+        # and the trade log is ready at the end.
+        self.trades = FifoTradeMatcher()
+
+        # The logs can be spilled to disk to save memory, see spill_logs()
+        self._spill_directory = None
+
     def update_from_fill(self, fill):
         # Update cash
         self.current_cash -= fill.fill_price * fill.quantity * fill.direction
@@ -57,14 +76,40 @@ class StandardPortfolio(Portfolio):
             self.current_positions[fill.symbol] = fill.direction * fill.quantity
 
         # Log transaction
-        self.fills_log.append(fill.dict())
+        if self.keep_portfolio_log:
+            self.fills_log.append(fill.dict())
+        self.metrics.update_from_fill(fill)
+
+        # Update trades
+        closed_trades = self.trades.add_fill(
+            fill.datetime, fill.symbol, fill.side, fill.quantity, fill.fill_price, fill.fees
+        )
+        for index in closed_trades:
+            net_pnl, _ = self.trades.get_net_pnl(index)
+            self.metrics.update_from_trade(self.trades.datetime_in[index], fill.datetime, net_pnl)
+        if not self.keep_portfolio_log:
+            self.trades.discard_closed_trades()
+
+    def get_open_lots(self, symbol):
+        """Gets the open trades of a symbol, oldest first. See FifoTradeMatcher.get_open_lots()."""
+        return self.trades.get_open_lots(symbol)
+
+    def get_average_entry(self, symbol):
+        """Gets the average entry of the open trades of a symbol. NaN if there is no position."""
+        return self.trades.get_average_entry(symbol)
+
+    def get_unrealized_pnl(self, symbol):
+        """Gets the unrealized P/L in $ of the position in a symbol at the latest close, without fees."""
+        if self.current_positions.get(symbol, 0) == 0:
+            return 0.0
+        price = self.data_handler.get_latest_bars(symbol, N=1)["close"].values[0]
+        return self.trades.get_unrealized_pnl(symbol, price)
 
     def _update_holdings_from_market(self):
         if len(self.data_handler.get_loaded_symbols()) > 0:
             # Update positions value if we have positions
             position_values = {
-                symbol: position
-                * (self.data_handler.get_latest_bars(symbol, N=1)["close"].values[0])
+                symbol: position * (self.data_handler.get_latest_bars(symbol, N=1)["close"].values[0])
                 for (symbol, position) in self.current_positions.items()
                 if position != 0
             }
@@ -78,7 +123,7 @@ class StandardPortfolio(Portfolio):
     def append_portfolio_log(self):
         self._update_holdings_from_market()
 
-        self.portfolio_log.append(
+        self._append_portfolio_log_row(
             {
                 "datetime": self.data_handler.current_time,
                 "equity": self._current_equity,
@@ -88,6 +133,11 @@ class StandardPortfolio(Portfolio):
             }
         )
 
+    def _append_portfolio_log_row(self, row):
+        self.metrics.update(row["datetime"], row["equity"], row["positions_value"])
+        if self.keep_portfolio_log:
+            self.portfolio_log.append(row)
+
     @property
     def current_positions_value(self):
         self._update_holdings_from_market()
@@ -98,23 +148,83 @@ class StandardPortfolio(Portfolio):
         self._update_holdings_from_market()
         return self._current_equity
 
+    def memory_usage(self):
+        """Estimates the memory of the logs and the trades, see backtester/memory.py.
+
+        Returns:
+            dict: the bytes of the portfolio log, the fills log and the trades
+        """
+        return {
+            "portfolio_log": get_size(self.portfolio_log),
+            "fills_log": get_size(self.fills_log),
+            "trades": get_size(self.trades),
+        }
+
+    def spill_logs(self):
+        """Appends the portfolio log and the fills log to files in a temporary directory and empties them.
+        The directory is removed when the portfolio is garbage collected. Use get_portfolio_log() and get_fills_log() to get the complete logs.
+        """
+        if self._spill_directory is None:
+            self._spill_directory = tempfile.TemporaryDirectory(prefix="backtester_")
+        for name, log in [("portfolio_log", self.portfolio_log), ("fills_log", self.fills_log)]:
+            if len(log) > 0:
+                with open(os.path.join(self._spill_directory.name, f"{name}.pickle"), "ab") as f:
+                    pickle.dump(log, f, protocol=pickle.HIGHEST_PROTOCOL)
+                log.clear()
+
+    def _read_log(self, name):
+        """Reads the spilled rows of a log and adds the rows in memory."""
+        rows = []
+        if self._spill_directory is not None:
+            path = os.path.join(self._spill_directory.name, f"{name}.pickle")
+            if os.path.exists(path):
+                with open(path, "rb") as f:
+                    while True:
+                        try:
+                            rows.extend(pickle.load(f))
+                        except EOFError:
+                            break
+        return rows + getattr(self, name)
+
+    def get_portfolio_log(self):
+        """Gets all rows of the portfolio log, including the spilled rows."""
+        return self._read_log("portfolio_log")
+
+    def get_fills_log(self):
+        """Gets all rows of the fills log, including the spilled rows."""
+        return self._read_log("fills_log")
+
     ### These functions should only be executed after the backtest
     def create_df_from_holdings_log(self):
         """Creates a DataFrame from portfolio_log. Percentages are base 100 for readability."""
-        df = pd.DataFrame(self.portfolio_log)
-        df.set_index("datetime", inplace=True)
-        df["return"] = df["equity"].pct_change()
-        df["return_cum"] = (1.0 + df["return"]).cumprod() - 1
+        return holdings_log_to_df(self.get_portfolio_log())
 
-        df["return"] = df["return"] * 100
-        df["return_cum"] = df["return_cum"] * 100
-        df = df.fillna(value=0)
+    def create_df_from_fills_log(self):
+        return fills_log_to_df(self.get_fills_log())
 
-        df[["equity", "cash", "positions_value", "return", "return_cum"]] = round(
-            df[["equity", "cash", "positions_value", "return", "return_cum"]], 3
-        )
-        return df
+    def create_df_from_trade_log(self):
+        """Creates the trade log from the trades that were matched during the backtest, see performance.fills_to_trades()."""
+        return performance.calculate_PNL_trade_log(self.trades.to_df())
 
-    def create_df_from_fills_log(self):
-        df = pd.DataFrame(self.fills_log)
-        return df.set_index("datetime")
+
+def holdings_log_to_df(portfolio_log):
+    """Creates a DataFrame from a portfolio log (list of dicts). Percentages are base 100 for readability."""
+    df = pd.DataFrame(portfolio_log)
+    df.set_index("datetime", inplace=True)
+    df["return"] = df["equity"].pct_change()
+    df["return_cum"] = (1.0 + df["return"]).cumprod() - 1
+
+    df["return"] = df["return"] * 100
+    df["return_cum"] = df["return_cum"] * 100
+    df = df.fillna(value=0)
+
+    df[["equity", "cash", "positions_value", "return", "return_cum"]] = round(
+        df[["equity", "cash", "positions_value", "return", "return_cum"]], 3
+    )
+    return df
+
+
+def fills_log_to_df(fills_log):
+    """Creates a DataFrame from a fills log (list of dicts)."""
+    df = pd.DataFrame(fills_log)
+    return df.set_index("datetime")
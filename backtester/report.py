@@ -0,0 +1,152 @@
+"""Renders the report (total return, drawdown and monthly returns) of a backtest.
+
+The figures are made with the object-oriented Matplotlib API and saved to static files, so this works headless and in parallel processes.
+Long series (e.g. per-minute equity) are downsampled with Largest-Triangle-Three-Buckets (LTTB), which keeps the shape of the curve including the peaks and troughs.
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import matplotlib.ticker as mtick
+from matplotlib.figure import Figure
+
+from backtester.performance import PerformanceReport
+
+
+def lttb(x, y, n_out):
+    """Largest-Triangle-Three-Buckets downsampling. The first and last point are kept and from every bucket in between we keep the point that forms the largest triangle with the previous kept point and the average of the next bucket.
+
+    Args:
+        x (ndarray): the x values (increasing)
+        y (ndarray): the y values
+        n_out (int): the amount of points to keep
+
+    Returns:
+        ndarray: the indices of the kept points
+    """
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+
+    # n_out - 2 buckets for the points between the first and the last point
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+    selected = np.empty(n_out, dtype=int)
+    selected[0] = 0
+    selected[-1] = n - 1
+
+    a = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+
+        # The average of the next bucket, or the last point for the last bucket
+        if i < n_out - 3:
+            next_start, next_end = edges[i + 1], edges[i + 2]
+            average_x = x[next_start:next_end].mean()
+            average_y = y[next_start:next_end].mean()
+        else:
+            average_x, average_y = x[-1], y[-1]
+
+        # Twice the area of the triangles, the factor does not matter for the maximum
+        areas = np.abs((x[a] - average_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (average_y - y[a]))
+        a = start + np.argmax(areas)
+        selected[i + 1] = a
+
+    return selected
+
+
+def _downsample(series, max_points):
+    """Downsamples a Series with a DatetimeIndex with LTTB."""
+    x = series.index.asi8 - series.index.asi8[0]  # Relative nanoseconds, for the float precision
+    return series.iloc[lttb(x, series.values, max_points)]
+
+
+def draw_report(fig, portfolio_log, title="", max_points=2000):
+    """Draws the total return, drawdown and monthly returns on a figure.
+
+    Args:
+        fig (Figure): the Matplotlib figure
+        portfolio_log (DataFrame): the portfolio log
+        title (str, optional): the title. Defaults to ''.
+        max_points (int, optional): the maximum amount of points per line. Defaults to 2000.
+    """
+    report = PerformanceReport(portfolio_log)
+    ax1, ax2, ax3 = fig.subplots(nrows=3, gridspec_kw={"height_ratios": [2, 1, 1]})
+    fig.suptitle(title, fontsize=16)
+    fig.tight_layout(pad=1.5)
+
+    # Returns
+    return_cum = _downsample(portfolio_log["return_cum"], max_points)
+    ax1.plot(return_cum.index, return_cum.values, color="midnightblue", linewidth=1)
+    ax1.yaxis.set_major_formatter(mtick.PercentFormatter(decimals=0))
+    ax1.set_title("Total return", fontsize=10, fontweight="bold")
+
+    # Drawdown
+    drawdowns = _downsample(report.drawdowns, max_points)
+    ax2.plot(drawdowns.index, -drawdowns.values, color="firebrick", linewidth=1)
+    ax2.yaxis.set_major_formatter(mtick.PercentFormatter(decimals=0))
+    ax2.set_title("Drawdown", fontsize=10, fontweight="bold")
+
+    # Monthly returns
+    monthly_return = report.monthly_returns
+    colors = ["firebrick" if ret < 0 else "g" for ret in monthly_return]
+    ax3.bar(monthly_return.index, monthly_return.values, width=15, color=colors)
+    ax3.yaxis.set_major_formatter(mtick.PercentFormatter(decimals=0))
+    ax3.set_title("Monthly returns", fontsize=10, fontweight="bold")
+
+
+def render_report(portfolio_log, path, title="", max_points=2000, figsize=(10, 8), dpi=100):
+    """Renders the report to a static file without opening a window. The format follows from the extension, e.g. .png, .svg or .pdf.
+
+    Args:
+        portfolio_log (DataFrame): the portfolio log
+        path (str): the file path
+        title (str, optional): the title. Defaults to ''.
+        max_points (int, optional): the maximum amount of points per line. Defaults to 2000.
+        figsize (tuple, optional): the size in inches. Defaults to (10, 8).
+        dpi (int, optional): the resolution. Defaults to 100.
+    """
+    fig = Figure(figsize=figsize)  # Not pyplot, so there is no GUI and no global state
+    draw_report(fig, portfolio_log, title, max_points)
+    fig.savefig(path, dpi=dpi)
+
+
+def _render_stored_report(store_path, run_id, path, max_points):
+    # Runs in the worker processes. Loading the log here avoids sending it to the worker.
+    from backtester.results import ResultsStore
+
+    store = ResultsStore(store_path)
+    portfolio_log = store.load(run_id, "portfolio_log")
+    render_report(portfolio_log, path, title=run_id, max_points=max_points)
+    return path
+
+
+def render_reports(store, run_ids, folder="output/reports", extension="png", max_points=2000, processes=None):
+    """Renders the reports of runs in a ResultsStore in parallel.
+
+    Args:
+        store (ResultsStore): the results store
+        run_ids (list): the run IDs
+        folder (str, optional): the output folder. Defaults to 'output/reports'.
+        extension (str, optional): the file format. Defaults to 'png'.
+        max_points (int, optional): the maximum amount of points per line. Defaults to 2000.
+        processes (int, optional): the amount of processes. Defaults to None (the amount of CPUs).
+
+    Returns:
+        list: the file paths
+    """
+    os.makedirs(folder, exist_ok=True)
+    paths = [os.path.join(folder, f"{run_id}.{extension}") for run_id in run_ids]
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        return list(
+            executor.map(
+                _render_stored_report,
+                [store.path] * len(run_ids),
+                run_ids,
+                paths,
+                [max_points] * len(run_ids),
+            )
+        )
@@ -0,0 +1,184 @@
+"""Stores the results of backtests as typed Parquet files, with a catalog to find and compare runs.
+
+The layout of the store is:
+    {path}/catalog/{run_id}.parquet     one catalog row per run
+    {path}/runs/{run_id}/portfolio_log.parquet
+    {path}/runs/{run_id}/fills_log.parquet
+    {path}/runs/{run_id}/trade_log.parquet
+
+Every run writes its own catalog row, so parallel runs never write to the same file.
+"""
+
+import hashlib
+import inspect
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+LOGS = ["portfolio_log", "fills_log", "trade_log"]
+
+
+def get_code_fingerprint(strategy):
+    """Hashes the source code of the backtester and the strategy. If one of them changes, the fingerprint changes.
+
+    Args:
+        strategy (class): the strategy class
+
+    Returns:
+        str: the fingerprint
+    """
+    sha = hashlib.sha1()
+    backtester_path = os.path.dirname(os.path.abspath(__file__))
+    for file in sorted(os.listdir(backtester_path)):
+        if file.endswith(".py"):
+            with open(os.path.join(backtester_path, file), "rb") as f:
+                sha.update(f.read())
+
+    try:
+        sha.update(inspect.getsource(strategy).encode())
+    except (OSError, TypeError):
+        # E.g. a class defined in a notebook cell. Fall back to the name.
+        sha.update(f"{strategy.__module__}.{strategy.__qualname__}".encode())
+    return sha.hexdigest()[:16]
+
+
+def get_run_id(parameters):
+    """Gets a deterministic run ID from the parameters. The same configuration always gets the same ID.
+
+    Args:
+        parameters (dict): the parameters of the run, including the fingerprints
+
+    Returns:
+        str: the run ID
+    """
+    return hashlib.sha1(json.dumps(parameters, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+
+def _positions_to_arrow(positions):
+    """Converts the positions column (dicts) to an Arrow map column, so the types are kept."""
+    all_integers = all(
+        isinstance(quantity, (int, np.integer)) for position in positions for quantity in position.values()
+    )
+    value_type = pa.int64() if all_integers else pa.float64()
+    return pa.array([list(position.items()) for position in positions], type=pa.map_(pa.string(), value_type))
+
+
+class ResultsStore:
+    """A directory with the results of many backtests."""
+
+    def __init__(self, path="output/results"):
+        self.path = path
+        self._catalog_path = os.path.join(path, "catalog")
+        os.makedirs(self._catalog_path, exist_ok=True)
+
+    def _get_run_path(self, run_id):
+        return os.path.join(self.path, "runs", run_id)
+
+    def has_run(self, run_id):
+        """Whether the run is already in the catalog."""
+        return os.path.exists(os.path.join(self._catalog_path, f"{run_id}.parquet"))
+
+    def save(self, run_id, name, parameters, statistics, portfolio_log=None, fills_log=None, trade_log=None):
+        """Saves the logs and adds the run to the catalog. The catalog row is written last, so a crashed run is never in the catalog.
+
+        Args:
+            run_id (str): the run ID, see get_run_id()
+            name (str): the name of the run
+            parameters (dict): the parameters of the run. Scalar values get their own catalog column 'param_{key}'.
+            statistics (dict): the statistics of the run
+            portfolio_log (DataFrame, optional): the portfolio log
+            fills_log (DataFrame, optional): the fills log
+            trade_log (DataFrame, optional): the trade log
+        """
+        run_path = self._get_run_path(run_id)
+        os.makedirs(run_path, exist_ok=True)
+
+        for log_name, log in zip(LOGS, [portfolio_log, fills_log, trade_log]):
+            if log is None:
+                continue
+            if log_name == "portfolio_log":
+                positions = _positions_to_arrow(log["positions"])
+                table = pa.Table.from_pandas(log.drop(columns=["positions"]))
+                table = table.append_column("positions", positions)
+            else:
+                table = pa.Table.from_pandas(log)
+            pq.write_table(table, os.path.join(run_path, f"{log_name}.parquet"))
+
+        row = {"run_id": run_id, "name": name, "parameters": json.dumps(parameters, sort_keys=True, default=str)}
+        for key, value in parameters.items():
+            if isinstance(value, (bool, int, float, str)):
+                row[f"param_{key}"] = value
+            elif value is not None:
+                row[f"param_{key}"] = str(value)
+        row.update(statistics)
+        row["created"] = pd.Timestamp.now()
+
+        pq.write_table(
+            pa.Table.from_pandas(pd.DataFrame([row]), preserve_index=False),
+            os.path.join(self._catalog_path, f"{run_id}.parquet"),
+        )
+
+    def get_catalog(self, filters=None, columns=None):
+        """Gets the catalog of all runs.
+
+        Args:
+            filters (list, optional): pyarrow filters, e.g. [("param_timeframe", "=", "daily"), ("Sharpe", ">", 1)]. Defaults to None.
+            columns (list, optional): the columns to read. Defaults to all.
+
+        Returns:
+            DataFrame: the catalog with a row for every run
+        """
+        files = [os.path.join(self._catalog_path, file) for file in sorted(os.listdir(self._catalog_path))]
+        if len(files) == 0:
+            return pd.DataFrame()
+
+        # The rows of different runs can have different parameters, so we unify the schemas.
+        schema = pa.unify_schemas([pq.read_schema(file) for file in files], promote_options="permissive")
+        dataset = ds.dataset(files, schema=schema, format="parquet")
+        if columns is not None and "run_id" not in columns:
+            columns = ["run_id"] + columns
+        table = dataset.to_table(columns=columns, filter=pq.filters_to_expression(filters) if filters else None)
+        return table.to_pandas().set_index("run_id")
+
+    def load(self, run_id, log="portfolio_log"):
+        """Loads a log of a run.
+
+        Args:
+            run_id (str): the run ID
+            log (str, optional): 'portfolio_log', 'fills_log' or 'trade_log'. Defaults to 'portfolio_log'.
+
+        Returns:
+            DataFrame: the log, with the positions as dicts again
+        """
+        df = pq.read_table(os.path.join(self._get_run_path(run_id), f"{log}.parquet")).to_pandas()
+        if log == "portfolio_log":
+            df["positions"] = [dict(position) for position in df["positions"]]
+        return df
+
+    def compare(self, run_ids, column="equity", log="portfolio_log"):
+        """Puts a column of multiple runs side by side, e.g. to plot the equity curves of the runs.
+
+        Args:
+            run_ids (list): the run IDs
+            column (str, optional): the column. Defaults to 'equity'.
+            log (str, optional): the log. Defaults to 'portfolio_log'.
+
+        Returns:
+            DataFrame: a column for every run
+        """
+        return pd.concat(
+            {
+                run_id: pq.read_table(
+                    os.path.join(self._get_run_path(run_id), f"{log}.parquet"),
+                    columns=[column],
+                    use_pandas_metadata=True,
+                ).to_pandas()[column]
+                for run_id in run_ids
+            },
+            axis=1,
+        )
@@ -0,0 +1,178 @@
+"""Monte Carlo and bootstrap tests of the robustness of a backtest.
+
+Every test creates a matrix of simulated returns with shape (paths, periods) on the calendar of the portfolio log. The statistics of all paths are then calculated at once with performance.calculate_return_statistics.
+The paths are simulated in chunks to limit the memory and the chunks can be spread over multiple processes.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from backtester.performance import calculate_return_statistics
+
+
+def _shuffled_trades_returns(rng, n_paths, pnl, slots, initial_capital, periods):
+    """The trades happen in a random order. The P/L of a trade is realized at an exit date of the original backtest."""
+    shuffled_pnl = rng.permuted(np.broadcast_to(pnl, (n_paths, len(pnl))), axis=1)
+
+    # Equity after every exit, then forward filled to every period
+    equity = np.empty((n_paths, len(pnl) + 1))
+    equity[:, 0] = initial_capital
+    equity[:, 1:] = initial_capital + np.cumsum(shuffled_pnl, axis=1)
+    equity = equity[:, np.searchsorted(slots, np.arange(periods), side="right")]
+
+    returns = np.zeros((n_paths, periods))
+    returns[:, 1:] = equity[:, 1:] / equity[:, :-1] - 1
+    return returns
+
+
+def _bootstrapped_returns(rng, n_paths, returns, block_size):
+    """Moving block bootstrap: glue random blocks of consecutive returns together. The blocks wrap around at the end."""
+    periods = len(returns)
+    n_blocks = -(-periods // block_size)  # Rounded up
+    starts = rng.integers(0, periods, size=(n_paths, n_blocks))
+    indices = (starts[:, :, None] + np.arange(block_size)).reshape(n_paths, -1)[:, :periods] % periods
+
+    bootstrapped = returns[indices]
+    bootstrapped[:, 0] = 0  # The first return is 0, like in the portfolio log
+    return bootstrapped
+
+
+def _delayed_entries_returns(rng, n_paths, returns, run_ids, run_positions, n_runs, max_delay):
+    """Every entry is delayed by a random amount of periods. We miss the returns of these periods."""
+    delays = rng.integers(0, max_delay + 1, size=(n_paths, max(n_runs, 1)))
+    in_market = run_ids >= 0
+    missed = in_market & (delays[:, np.maximum(run_ids, 0)] > run_positions)
+    return np.where(missed, 0.0, returns)
+
+
+_SIMULATIONS = {
+    "shuffle_trades": _shuffled_trades_returns,
+    "bootstrap_returns": _bootstrapped_returns,
+    "delay_entries": _delayed_entries_returns,
+}
+
+
+def _simulate_chunk(simulation, seed, n_paths, inputs, total_days, month_ids):
+    """Simulates one chunk of paths and calculates their statistics. This runs in the worker processes."""
+    rng = np.random.default_rng(seed)
+    returns = _SIMULATIONS[simulation](rng, n_paths, **inputs)
+    return calculate_return_statistics(returns, total_days, month_ids)
+
+
+def _simulate(simulation, inputs, portfolio_log, n_paths, confidence, chunk_size, processes, seed):
+    """Simulates n_paths paths in chunks and calculates the confidence intervals of the statistics.
+
+    Returns:
+        DataFrame: the lower bound, median and upper bound of every statistic
+    """
+    index = portfolio_log.index
+    total_days = (index[-1] - index[0]).days
+    month_ids = (index.year * 12 + index.month).to_numpy()
+
+    # Every chunk gets its own independent random stream, so the result does not depend on the amount of processes.
+    chunk_sizes = [min(chunk_size, n_paths - start) for start in range(0, n_paths, chunk_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(chunk_sizes))
+    arguments = [(simulation, seed, size, inputs, total_days, month_ids) for seed, size in zip(seeds, chunk_sizes)]
+
+    if processes == 1:
+        results = [_simulate_chunk(*args) for args in arguments]
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            results = list(executor.map(_simulate_chunk, *zip(*arguments)))
+
+    statistics = {name: np.concatenate([result[name] for result in results]) for name in results[0]}
+    return _confidence_intervals(statistics, confidence)
+
+
+def _confidence_intervals(statistics, confidence):
+    lower = 100 * (1 - confidence) / 2
+    upper = 100 - lower
+    return pd.DataFrame(
+        {
+            "lower": {name: np.nanpercentile(values, lower) for name, values in statistics.items()},
+            "median": {name: np.nanmedian(values) for name, values in statistics.items()},
+            "upper": {name: np.nanpercentile(values, upper) for name, values in statistics.items()},
+        }
+    )
+
+
+def shuffle_trades(portfolio_log, trade_log, n_paths=1000, confidence=0.95, chunk_size=500, processes=None, seed=None):
+    """Trade-order shuffling. The closed trades are realized in a random order at the exit dates of the backtest.
+    The total return stays the same, but the drawdowns show how much we depend on the order of the trades.
+
+    Args:
+        portfolio_log (DataFrame): the portfolio log
+        trade_log (DataFrame): the trade log
+        n_paths (int, optional): the amount of simulated paths. Defaults to 1000.
+        confidence (float, optional): the confidence level of the intervals. Defaults to 0.95.
+        chunk_size (int, optional): the amount of paths that are simulated at once. Defaults to 500.
+        processes (int, optional): the amount of processes. Defaults to None (the amount of CPUs).
+        seed (int, optional): the random seed. Defaults to None.
+
+    Returns:
+        DataFrame: the lower bound, median and upper bound of every statistic
+    """
+    closed_trades = trade_log[trade_log["datetime_out"].notna()].sort_values("datetime_out")
+    inputs = {
+        "pnl": closed_trades["net P/L $"].to_numpy(dtype=float),
+        "slots": portfolio_log.index.searchsorted(closed_trades["datetime_out"]),
+        "initial_capital": portfolio_log["equity"].iloc[0],
+        "periods": len(portfolio_log),
+    }
+    return _simulate("shuffle_trades", inputs, portfolio_log, n_paths, confidence, chunk_size, processes, seed)
+
+
+def bootstrap_returns(
+    portfolio_log, block_size=20, n_paths=1000, confidence=0.95, chunk_size=500, processes=None, seed=None
+):
+    """Block bootstrap of the returns. Random blocks of consecutive returns are glued together, which keeps most of the autocorrelation.
+
+    Args:
+        portfolio_log (DataFrame): the portfolio log
+        block_size (int, optional): the amount of periods in a block. Defaults to 20 (about a month of days).
+        See shuffle_trades for the other arguments.
+
+    Returns:
+        DataFrame: the lower bound, median and upper bound of every statistic
+    """
+    inputs = {
+        "returns": portfolio_log["return"].to_numpy(dtype=float) * 0.01,
+        "block_size": block_size,
+    }
+    return _simulate("bootstrap_returns", inputs, portfolio_log, n_paths, confidence, chunk_size, processes, seed)
+
+
+def delay_entries(portfolio_log, max_delay=1, n_paths=1000, confidence=0.95, chunk_size=500, processes=None, seed=None):
+    """Randomized entry delays. Every time we enter the market, the entry is delayed by 0 to max_delay periods and we miss the returns of those periods.
+    A strategy that only works if the entry is exactly on time is probably fragile.
+
+    Args:
+        portfolio_log (DataFrame): the portfolio log
+        max_delay (int, optional): the maximum delay in periods (bars of the portfolio log). Defaults to 1.
+        See shuffle_trades for the other arguments.
+
+    Returns:
+        DataFrame: the lower bound, median and upper bound of every statistic
+    """
+    returns = portfolio_log["return"].to_numpy(dtype=float) * 0.01
+
+    # The return of a period comes from the positions at the end of the previous period
+    in_market = np.zeros(len(portfolio_log), dtype=bool)
+    in_market[1:] = portfolio_log["positions_value"].to_numpy()[:-1] != 0
+
+    # Number the periods in the market by run (the period between an entry and an exit) and by position within the run
+    entries = in_market & ~np.r_[False, in_market[:-1]]
+    run_ids = np.where(in_market, np.cumsum(entries) - 1, -1)
+    run_starts = np.flatnonzero(entries)
+    run_positions = np.arange(len(returns)) - run_starts[np.maximum(run_ids, 0)] if len(run_starts) > 0 else 0
+
+    inputs = {
+        "returns": returns,
+        "run_ids": run_ids,
+        "run_positions": run_positions,
+        "n_runs": len(run_starts),
+        "max_delay": max_delay,
+    }
+    return _simulate("delay_entries", inputs, portfolio_log, n_paths, confidence, chunk_size, processes, seed)
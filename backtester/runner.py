@@ -0,0 +1,180 @@
+"""Runs backtests from config files, see __main__.py for the command line.
+
+A config is a TOML or JSON file with the arguments of Backtest. The classes are import paths like 'module:Class' (or 'module.Class'):
+
+    name = "IBS"
+    strategy = "strategies.ibs:IBS"
+    initial_capital = 10000
+    start_date = 2020-01-01
+    end_date = 2023-09-01
+    timeframe = "daily"
+    extended_hours = false
+
+    [strategy_params]
+    symbol = "SPY"
+
+Optionally the file contains a list of [[runs]]. Every run overrides the keys at the top, which are the defaults of the runs. The strategy_params are merged.
+The heavy modules (the backtester itself, matplotlib, pyarrow) are only imported when a run starts, so the command line starts fast and the workers only import what they need.
+"""
+
+import importlib
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+
+DEFAULTS = {
+    "initial_capital": 10000.0,
+    "extended_hours": False,
+    "data_handler": "backtester.data_handler:HistoricalPolygonDataHandler",
+    "broker": "backtester.broker:SimulatedBroker",
+    "portfolio": "backtester.portfolio:StandardPortfolio",
+    "keep_logs": True,
+    "max_drawdown": None,
+    "strategy_params": {},
+    "data_handler_params": {},
+    "results_store": None,
+    "skip_existing": True,
+    "report": None,
+    "trace": None,
+    "memory_budget": None,
+    "track_memory": False,
+}
+REQUIRED = ["name", "strategy", "start_date", "end_date", "timeframe"]
+
+
+def import_object(path):
+    """Imports an object from an import path
+
+    Args:
+        path (str): 'module:name' or 'module.name'
+
+    Returns:
+        object: the object
+    """
+    if ":" in path:
+        module, name = path.split(":")
+    else:
+        module, name = path.rsplit(".", 1)
+    return getattr(importlib.import_module(module), name)
+
+
+def load_configs(path):
+    """Loads the runs of a config file
+
+    Args:
+        path (str): a .toml or .json file
+
+    Returns:
+        list: a config (dict) for every run
+    """
+    if path.endswith(".toml"):
+        import tomllib
+
+        with open(path, "rb") as f:
+            config = tomllib.load(f)
+    else:
+        with open(path) as f:
+            config = json.load(f)
+
+    # A JSON file can also be a list of runs
+    if isinstance(config, list):
+        config = {"runs": config}
+
+    runs = config.pop("runs", [{}])
+    configs = []
+    for run in runs:
+        merged = {**DEFAULTS, **config, **run}
+        for params in ["strategy_params", "data_handler_params"]:
+            merged[params] = {**config.get(params, {}), **run.get(params, {})}
+        configs.append(_check_config(merged, path))
+    return configs
+
+
+def _check_config(config, path):
+    missing = [key for key in REQUIRED if key not in config]
+    if missing:
+        raise ValueError(f"The config {path} misses {', '.join(missing)}!")
+
+    unknown = [key for key in config if key not in DEFAULTS and key not in REQUIRED]
+    if unknown:
+        raise ValueError(f"The config {path} has unknown keys {', '.join(unknown)}!")
+
+    # JSON has no dates
+    for key in ["start_date", "end_date"]:
+        if isinstance(config[key], str):
+            config[key] = date.fromisoformat(config[key])
+    return config
+
+
+def run_config(config):
+    """Runs the backtest of a config. This runs in the worker processes.
+
+    Args:
+        config (dict): the config, see load_configs()
+
+    Returns:
+        dict: the name, run time, run ID (with a results store) and statistics
+    """
+    from backtester.backtest import Backtest
+
+    start = time.perf_counter()
+    results_store = None
+    if config["results_store"] is not None:
+        from backtester.results import ResultsStore
+
+        results_store = ResultsStore(config["results_store"])
+
+    backtest = Backtest(
+        config["name"],
+        config["initial_capital"],
+        config["start_date"],
+        config["end_date"],
+        config["timeframe"],
+        config["extended_hours"],
+        import_object(config["strategy"]),
+        import_object(config["data_handler"]),
+        import_object(config["broker"]),
+        import_object(config["portfolio"]),
+        keep_logs=config["keep_logs"],
+        max_drawdown=config["max_drawdown"],
+        strategy_params=config["strategy_params"],
+        data_handler_params=config["data_handler_params"],
+        results_store=results_store,
+        skip_existing=config["skip_existing"],
+        plot=False,
+        trace=config["trace"],
+        memory_budget=config["memory_budget"],
+        track_memory=config["track_memory"],
+    )
+    backtest.run()
+
+    if config["report"] is not None and backtest.portfolio_log is not None:
+        os.makedirs(os.path.dirname(config["report"]) or ".", exist_ok=True)
+        backtest.render_report(config["report"])
+
+    return {
+        "name": config["name"],
+        "run_id": getattr(backtest, "run_id", None),
+        "skipped": backtest.skipped,
+        "run time s": round(time.perf_counter() - start, 2),
+        **(backtest.statistics or {}),
+    }
+
+
+def run_configs(configs, processes=1):
+    """Runs the backtests of many configs, optionally in parallel
+
+    Args:
+        configs (list): the configs, see load_configs()
+        processes (int, optional): the amount of processes. 1 runs in this process, None uses all CPUs. Defaults to 1.
+
+    Returns:
+        list: the results of run_config() in the order of the configs
+    """
+    if processes == 1:
+        return [run_config(config) for config in configs]
+
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        return list(executor.map(run_config, configs))
@@ -0,0 +1,182 @@
+"""Sharded execution: the symbols are split over worker processes and every worker runs its own backtest (clock, portfolio, broker) over its shard.
+
+This is only valid if every symbol trades independently with a fixed slice of the capital. So the strategy must size its orders with its own capital per symbol, not with the cash of the portfolio, and it may not look at other symbols.
+The logs of the shards are then merged deterministically into the result of one StandardPortfolio:
+    - the fills are sorted by datetime and then by the position of the symbol in the symbol list, which is the order in which a strategy that loops over its symbols sends the orders.
+      Orders that are sent in another order within one bar (e.g. looping over a dict of positions at the end) can end up in another order in the fills log. The trade log is the same, because the trades are matched per symbol.
+    - the cash and positions are replayed from the merged fills with the same arithmetic as StandardPortfolio, so they are identical to a serial run
+    - the positions value is the sum of the positions values of the shards
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import backtester.performance as performance
+from backtester.backtest import Backtest
+from backtester.portfolio import fills_log_to_df, holdings_log_to_df
+
+
+def _run_shard(backtest_args, backtest_kwargs):
+    """Runs the backtest of one shard and returns the raw logs. This runs in the worker processes."""
+    backtest = Backtest(*backtest_args, **backtest_kwargs)
+    backtest._run_backtest()  # Without _process_results, the shards do not write output
+    return backtest.portfolio.get_portfolio_log(), backtest.portfolio.get_fills_log()
+
+
+def merge_shards(initial_capital, symbols, portfolio_logs, fills_logs):
+    """Merges the raw logs (lists of dicts) of the shards into the logs of one portfolio.
+
+    Args:
+        initial_capital (float): the total initial capital
+        symbols (list): all symbols, in the order of the strategy
+        portfolio_logs (list): the portfolio log of every shard
+        fills_logs (list): the fills log of every shard
+
+    Returns:
+        tuple: the merged portfolio log and fills log (lists of dicts)
+    """
+    datetimes = [row["datetime"] for row in portfolio_logs[0]]
+    for shard_log in portfolio_logs[1:]:
+        if [row["datetime"] for row in shard_log] != datetimes:
+            raise ValueError("The shards do not have the same clock!")
+
+    # Python's sort is stable, so fills with the same datetime and symbol keep their order
+    ranks = {symbol: rank for rank, symbol in enumerate(symbols)}
+    fills_log = sorted(
+        (fill for shard_fills in fills_logs for fill in shard_fills),
+        key=lambda fill: (fill["datetime"], ranks.get(fill["symbol"], len(ranks))),
+    )
+
+    # Replay the fills. A row of the portfolio log is appended at the market close, before the fills of that bar.
+    cash = initial_capital
+    positions = {}
+    next_fill = 0
+    portfolio_log = []
+    for i, dt in enumerate(datetimes):
+        while next_fill < len(fills_log) and fills_log[next_fill]["datetime"] < dt:
+            fill = fills_log[next_fill]
+            direction = 1 if fill["side"] == "BUY" else -1
+            cash -= fill["fill_price"] * fill["quantity"] * direction
+            cash -= fill["fees"]
+            if fill["symbol"] in positions.keys():
+                positions[fill["symbol"]] += direction * fill["quantity"]
+            else:
+                positions[fill["symbol"]] = direction * fill["quantity"]
+            next_fill += 1
+
+        positions_value = sum(shard_log[i]["positions_value"] for shard_log in portfolio_logs)
+        portfolio_log.append(
+            {
+                "datetime": dt,
+                "equity": cash + positions_value,
+                "cash": cash,
+                "positions_value": positions_value,
+                "positions": positions.copy(),
+            }
+        )
+
+    return portfolio_log, fills_log
+
+
+class ShardedBacktest:
+    """Runs a backtest of independent symbols over multiple processes. The result is the same as one Backtest over all symbols, see the module docstring for the conditions."""
+
+    def __init__(
+        self,
+        name,
+        initial_capital,
+        start_date,
+        end_date,
+        timeframe,
+        extended_hours,
+        strategy,
+        data_handler,
+        broker,
+        portfolio,
+        symbols,
+        n_shards=None,
+        symbols_param="symbols",
+        strategy_params=None,
+        data_handler_params=None,
+        processes=None,
+        plot=True,
+    ):
+        """Initializes the sharded backtest. See Backtest for the other arguments.
+
+        Args:
+            symbols (list): all symbols. The strategy gets its shard of them in strategy_params[symbols_param].
+            n_shards (int, optional): the amount of shards. Defaults to the amount of processes (or CPUs).
+            symbols_param (str, optional): the name of the strategy parameter with the symbols. Defaults to 'symbols'.
+            processes (int, optional): the amount of processes. 1 runs the shards in this process. Defaults to None (the amount of CPUs).
+        """
+        self.name = name
+        self.initial_capital = initial_capital
+        self.symbols = list(symbols)
+        self.processes = processes
+        self.plot = plot
+
+        n_shards = n_shards or processes or os.cpu_count()
+        n_shards = min(n_shards, len(self.symbols))
+
+        # Contiguous shards, so sorting by the symbol rank gives the order of a serial run. The capital is divided pro rata of the symbols.
+        self.shards = [list(shard) for shard in np.array_split(np.array(self.symbols, dtype=object), n_shards)]
+        strategy_params = strategy_params if strategy_params is not None else {}
+        self._shard_arguments = [
+            (
+                (
+                    f"{name}_shard{i}",
+                    initial_capital * len(shard) / len(self.symbols),
+                    start_date,
+                    end_date,
+                    timeframe,
+                    extended_hours,
+                    strategy,
+                    data_handler,
+                    broker,
+                    portfolio,
+                ),
+                {
+                    "strategy_params": {**strategy_params, symbols_param: shard},
+                    "data_handler_params": data_handler_params,
+                    "plot": False,
+                },
+            )
+            for i, shard in enumerate(self.shards)
+        ]
+
+        # The results, available after the run
+        self.portfolio_log = None
+        self.fills_log = None
+        self.trade_log = None
+        self.statistics = None
+
+    def run(self):
+        if self.processes == 1:
+            results = [_run_shard(*arguments) for arguments in self._shard_arguments]
+        else:
+            with ProcessPoolExecutor(max_workers=self.processes) as executor:
+                results = list(executor.map(_run_shard, *zip(*self._shard_arguments)))
+
+        portfolio_logs, fills_logs = zip(*results)
+        portfolio_log, fills_log = merge_shards(self.initial_capital, self.symbols, portfolio_logs, fills_logs)
+        self._process_results(portfolio_log, fills_log)
+
+    def _process_results(self, portfolio_log, fills_log):
+        # The same as Backtest with keep_logs=True and without a results store
+        self.portfolio_log = holdings_log_to_df(portfolio_log)
+        self.fills_log = fills_log_to_df(fills_log)
+        self.trade_log = performance.fills_to_trades(self.fills_log)
+        self.statistics = performance.PerformanceReport(
+            self.portfolio_log, self.fills_log, self.trade_log
+        ).get_statistics()
+
+        print(self.statistics)
+
+        self.portfolio_log.to_csv(f"output/{self.name}_portfolio_log.csv")
+        self.fills_log.to_csv(f"output/{self.name}_fills_log.csv")
+        self.trade_log.to_csv(f"output/{self.name}_trade_log.csv")
+
+        if self.plot:
+            performance.plot_fig(self.portfolio_log, title=self.name)
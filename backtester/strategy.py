@@ -4,6 +4,7 @@ import pandas as pd
 import queue
 
 from backtester.event import OrderEvent
+from backtester.memory import get_size
 
 
 class Strategy:
@@ -13,6 +14,9 @@ class Strategy:
     The calculate_signals gets called after a MarketEvent
     """
 
+    # The columns of the bars that the strategy reads, e.g. ['open', 'close']. The data handler only loads these (and the close). None loads all columns.
+    columns = None
+
     def __init__(self, events, data_handler, portfolio, **kwargs):
         self.events = events
         self.data_handler = data_handler
@@ -23,3 +27,14 @@ class Strategy:
     def calculate_signals(self):
         # Takes the latest market data and creates OrderEvents
         raise NotImplementedError()
+
+    def memory_usage(self):
+        """Estimates the memory of the state of the strategy: all attributes except the other components. See backtester/memory.py.
+
+        Returns:
+            dict: the bytes of the state
+        """
+        state = {
+            name: value for name, value in vars(self).items() if name not in ["events", "data_handler", "portfolio"]
+        }
+        return {"state": get_size(state)}
@@ -0,0 +1,420 @@
+"""Records the event stream of a backtest in a compact binary trace, to replay a strategy or the portfolio without the database and to find where two runs diverge.
+
+The layout of a trace file is:
+    b'QSTRACE1', the length of the header (uint32) and the header (JSON with the parameters of the backtest)
+    records, each starting with the kind (uint8) and the current time of the clock in nanoseconds (int64)
+
+The kinds of records are:
+    TICK            the clock ticked. It is followed by a BAR record for every symbol that has a bar at this time.
+    SYMBOL          the first time a symbol is seen: its ID (uint32) and a JSON payload with the symbol, columns and dtypes
+    BAR             the bar of a symbol: its ID and the values as float64
+    MARKET          MarketEvent
+    MARKET_CLOSE    MarketCloseEvent
+    BACKTEST_END    BacktestEndEvent
+    ORDER           OrderEvent: symbol ID, datetime, side and quantity
+    FILL            FillEvent: symbol ID, datetime, side, quantity, fill price and fees
+
+Usage:
+    Backtest(..., trace="output/IBS.trace")                                      record a run
+    Backtest(..., data_handler=TraceDataHandler, data_handler_params={'trace': path})  replay another strategy on the recorded bars
+    replay_fills(path)                                                             rerun the portfolio and performance stage from the recorded fills
+    python -m backtester.trace diff a.trace b.trace                                find the first diverging event
+"""
+
+import hashlib
+import json
+import struct
+import sys
+
+import numpy as np
+import pandas as pd
+
+from backtester.data_handler import InMemoryDataHandler
+from backtester.event import BacktestEndEvent, FillEvent, MarketCloseEvent, MarketEvent, OrderEvent
+from backtester.strategy import Strategy
+
+MAGIC = b"QSTRACE1"
+
+TICK, SYMBOL, BAR, MARKET, MARKET_CLOSE, BACKTEST_END, ORDER, FILL = range(8)
+KIND_NAMES = ["TICK", "SYMBOL", "BAR", "MARKET", "MARKET_CLOSE", "BACKTEST_END", "ORDER", "FILL"]
+EVENT_KINDS = {MarketEvent: MARKET, MarketCloseEvent: MARKET_CLOSE, BacktestEndEvent: BACKTEST_END}
+
+RECORD = struct.Struct("<Bq")  # kind, current time
+SYMBOL_RECORD = struct.Struct("<II")  # symbol ID, payload length
+BAR_RECORD = struct.Struct("<I")  # symbol ID, followed by the values
+ORDER_RECORD = struct.Struct("<IqBd")  # symbol ID, datetime, side (0 = BUY), quantity
+FILL_RECORD = struct.Struct("<IqBddd")  # symbol ID, datetime, side, quantity, fill price, fees
+
+
+def _to_nanoseconds(dt):
+    return pd.Timestamp(dt).value
+
+
+def _to_quantity(quantity):
+    # Quantities are integers in the backtester, but we store them as float64 to also allow fractional shares
+    return int(quantity) if quantity.is_integer() else quantity
+
+
+class TraceWriter:
+    """Writes the records of a running backtest. See the module docstring for the format."""
+
+    def __init__(self, path, header):
+        """Opens the trace file and writes the header.
+
+        Args:
+            path (str): the file path
+            header (dict): the parameters of the backtest
+        """
+        self._file = open(path, "wb")
+        header = json.dumps(header, default=str).encode()
+        self._file.write(MAGIC + struct.pack("<I", len(header)) + header)
+
+        self._symbol_ids = {}
+        self._now = 0
+
+    def _get_symbol_id(self, symbol, bars=None):
+        symbol_id = self._symbol_ids.get(symbol)
+        if symbol_id is None:
+            symbol_id = self._symbol_ids[symbol] = len(self._symbol_ids)
+            payload = {"symbol": symbol}
+            if bars is not None:
+                payload["columns"] = list(bars.columns)
+                payload["dtypes"] = [str(dtype) for dtype in bars.infer_objects().dtypes]
+            payload = json.dumps(payload).encode()
+            self._file.write(RECORD.pack(SYMBOL, self._now) + SYMBOL_RECORD.pack(symbol_id, len(payload)) + payload)
+        return symbol_id
+
+    def record_tick(self, data_handler):
+        """Records the tick of the clock and the new bars of the loaded symbols. Call this after data_handler.next()."""
+        self._now = _to_nanoseconds(data_handler.current_time)
+        self._file.write(RECORD.pack(TICK, self._now))
+
+        for symbol in data_handler.get_loaded_symbols():
+            bars = data_handler.get_latest_bars(symbol, N=1)
+            if len(bars) == 0 or bars.index[-1] != data_handler.current_time:
+                continue  # No bar at this time
+            symbol_id = self._get_symbol_id(symbol, bars)
+            values = bars.iloc[-1].to_numpy(dtype=np.float64)
+            self._file.write(RECORD.pack(BAR, self._now) + BAR_RECORD.pack(symbol_id) + values.tobytes())
+
+    def record_event(self, event):
+        """Records an event that the backtest handles."""
+        if isinstance(event, OrderEvent):
+            self._file.write(
+                RECORD.pack(ORDER, self._now)
+                + ORDER_RECORD.pack(
+                    self._get_symbol_id(event.symbol),
+                    _to_nanoseconds(event.datetime),
+                    event.side != "BUY",
+                    event.quantity,
+                )
+            )
+        elif isinstance(event, FillEvent):
+            self._file.write(
+                RECORD.pack(FILL, self._now)
+                + FILL_RECORD.pack(
+                    self._get_symbol_id(event.symbol),
+                    _to_nanoseconds(event.datetime),
+                    event.side != "BUY",
+                    event.quantity,
+                    event.fill_price,
+                    event.fees,
+                )
+            )
+        else:
+            self._file.write(RECORD.pack(EVENT_KINDS[type(event)], self._now))
+
+    def close(self):
+        self._file.close()
+
+
+def read_header(path):
+    """Reads the header of a trace.
+
+    Args:
+        path (str): the file path
+
+    Returns:
+        dict: the parameters of the backtest
+    """
+    with open(path, "rb") as f:
+        data = f.read(len(MAGIC) + 4)
+        if data[: len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not a trace file!")
+        (length,) = struct.unpack_from("<I", data, len(MAGIC))
+        return json.loads(f.read(length))
+
+
+def read_trace(path):
+    """Reads the records of a trace. The symbol IDs are replaced by the symbols.
+
+    Args:
+        path (str): the file path
+
+    Yields:
+        tuple: the kind, the current time in nanoseconds and a dict with the content of the record
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    if data[: len(MAGIC)] != MAGIC:
+        raise ValueError(f"{path} is not a trace file!")
+    (length,) = struct.unpack_from("<I", data, len(MAGIC))
+    offset = len(MAGIC) + 4 + length
+
+    symbols = {}  # {id: payload}
+    while offset < len(data):
+        kind, now = RECORD.unpack_from(data, offset)
+        offset += RECORD.size
+
+        if kind == SYMBOL:
+            symbol_id, length = SYMBOL_RECORD.unpack_from(data, offset)
+            offset += SYMBOL_RECORD.size
+            symbols[symbol_id] = json.loads(data[offset : offset + length])
+            offset += length
+            yield kind, now, symbols[symbol_id]
+        elif kind == BAR:
+            (symbol_id,) = BAR_RECORD.unpack_from(data, offset)
+            offset += BAR_RECORD.size
+            symbol = symbols[symbol_id]
+            values = np.frombuffer(data, dtype=np.float64, count=len(symbol["columns"]), offset=offset)
+            offset += values.nbytes
+            yield kind, now, {"symbol": symbol["symbol"], "values": values}
+        elif kind == ORDER:
+            symbol_id, dt, side, quantity = ORDER_RECORD.unpack_from(data, offset)
+            offset += ORDER_RECORD.size
+            yield kind, now, {
+                "symbol": symbols[symbol_id]["symbol"],
+                "datetime": dt,
+                "side": "SELL" if side else "BUY",
+                "quantity": _to_quantity(quantity),
+            }
+        elif kind == FILL:
+            symbol_id, dt, side, quantity, fill_price, fees = FILL_RECORD.unpack_from(data, offset)
+            offset += FILL_RECORD.size
+            yield kind, now, {
+                "symbol": symbols[symbol_id]["symbol"],
+                "datetime": dt,
+                "side": "SELL" if side else "BUY",
+                "quantity": _to_quantity(quantity),
+                "fill_price": fill_price,
+                "fees": fees,
+            }
+        else:
+            yield kind, now, {}
+
+
+class TraceDataHandler(InMemoryDataHandler):
+    """Replays the recorded bars and scheduled events of a trace, without the database.
+    The clock contains the recorded ticks and the MarketCloseEvents/BacktestEndEvent are emitted where they were recorded. So a strategy sees exactly the same market as in the recorded run.
+    load_data() loads the recorded bars of a symbol and ignores the other arguments. Only the symbols that were loaded in the recorded run are available.
+    """
+
+    def __init__(self, events, start_date, end_date, timeframe, extended_hours=True, trace=None):
+        """Initializes the data handler. Use Backtest(..., data_handler_params={'trace': path}).
+
+        Args:
+            trace (str): the path of the trace
+        """
+        ticks, scheduled, bars, symbols = [], {}, {}, {}
+        for kind, now, record in read_trace(trace):
+            if kind == TICK:
+                ticks.append(now)
+            elif kind in [MARKET_CLOSE, BACKTEST_END]:
+                scheduled.setdefault(now, []).append(kind)
+            elif kind == SYMBOL:
+                symbols[record["symbol"]] = record
+            elif kind == BAR:
+                bars.setdefault(record["symbol"], ([], []))
+                bars[record["symbol"]][0].append(now)
+                bars[record["symbol"]][1].append(record["values"])
+
+        self._ticks = pd.DatetimeIndex(np.array(ticks, dtype="datetime64[ns]"))
+        self._scheduled = scheduled
+        self._recorded_bars = {}
+        for symbol, (timestamps, values) in bars.items():
+            values = np.array(values).reshape(len(timestamps), -1)
+            columns = {"datetime": np.array(timestamps, dtype="datetime64[ns]")}
+            for i, (column, dtype) in enumerate(zip(symbols[symbol]["columns"], symbols[symbol]["dtypes"])):
+                columns[column] = values[:, i].astype(dtype if dtype != "object" else np.float64)
+            self._recorded_bars[symbol] = columns
+
+        # The calendar only serves get_current_market_close_time(). The closes are the recorded MarketCloseEvents.
+        dates = self._ticks.normalize().unique()
+        closes = pd.Series(
+            [pd.Timestamp(now) for now, kinds in scheduled.items() if MARKET_CLOSE in kinds], dtype="datetime64[ns]"
+        )
+        calendar = pd.DataFrame(
+            {
+                "premarket_open": self._ticks.to_series().groupby(self._ticks.normalize()).min().values,
+                "regular_open": self._ticks.to_series().groupby(self._ticks.normalize()).min().values,
+                "regular_close": closes.groupby(closes.dt.normalize()).max().reindex(dates).values,
+                "postmarket_close": self._ticks.to_series().groupby(self._ticks.normalize()).max().values,
+            },
+            index=dates.date,
+        )
+        calendar["regular_close"] = calendar["regular_close"].fillna(
+            calendar["postmarket_close"]
+        )  # E.g. a run that stopped early
+        super().__init__(events, start_date, end_date, timeframe, extended_hours, calendar=calendar)
+
+    @classmethod
+    def get_data_fingerprint(cls, timeframe, trace=None):
+        with open(trace, "rb") as f:
+            return hashlib.sha1(f.read()).hexdigest()[:16]
+
+    def _get_market_minutes(self, start_date, end_date, extended_hours):
+        return self._ticks[(self._ticks.date >= start_date) & (self._ticks.date <= end_date)]
+
+    def _get_market_dates(self, start_date, end_date):
+        return list(self._get_market_minutes(start_date, end_date, True).date)
+
+    def _check_time(self, timestamp):
+        kinds = self._scheduled.get(timestamp.value, [])
+        return [MarketCloseEvent() if kind == MARKET_CLOSE else BacktestEndEvent() for kind in kinds]
+
+    def load_data(self, symbol, *args, **kwargs):
+        """Loads the recorded bars of a symbol. The other arguments are ignored.
+
+        Args:
+            symbol (str): the symbol
+        """
+        super().load_data(symbol, self._recorded_bars[symbol])
+
+    def set_universe(self, listing_index):
+        """Loads all recorded symbols, because the recorded run may have used a universe. The listing index is ignored."""
+        for symbol in self._recorded_bars:
+            self.load_data(symbol)
+
+
+class FillReplayStrategy(Strategy):
+    """Puts the recorded fills back in the event queue, so the portfolio and performance stage run exactly as in the recorded run.
+    The fills of a tick are put in the queue at the MarketEvent of that tick. That is after the MarketCloseEvent, just like in the recorded run.
+    """
+
+    def __init__(self, events, data_handler, portfolio, trace=None):
+        self.events = events
+        self.data_handler = data_handler
+        self.portfolio = portfolio
+
+        self._fills = {}  # {tick: [fill, ...]}
+        for kind, now, record in read_trace(trace):
+            if kind == FILL:
+                self._fills.setdefault(now, []).append(record)
+
+        # The prices of the recorded symbols are needed for the positions value
+        for symbol in data_handler._recorded_bars:
+            data_handler.load_data(symbol)
+
+    def calculate_signals(self):
+        for fill in self._fills.pop(self.data_handler.current_time.value, []):
+            self.events.put(
+                FillEvent(
+                    pd.Timestamp(fill["datetime"]),
+                    fill["symbol"],
+                    fill["side"],
+                    fill["quantity"],
+                    fill["fill_price"],
+                    fill["fees"],
+                )
+            )
+
+    def on_market_close(self):
+        pass
+
+    def on_backtest_end(self):
+        pass
+
+
+def replay_fills(path, name=None, **kwargs):
+    """Reruns the portfolio and performance stage of a recorded run from its fills, without the strategy, broker and database.
+
+    Args:
+        path (str): the path of the trace
+        name (str, optional): the name of the run. Defaults to the recorded name.
+        **kwargs: other arguments for Backtest, e.g. keep_logs or plot
+
+    Returns:
+        Backtest: the backtest, after the run
+    """
+    from backtester.backtest import Backtest
+    from backtester.broker import SimulatedBroker
+    from backtester.portfolio import StandardPortfolio
+
+    header = read_header(path)
+    backtest = Backtest(
+        name or header["name"],
+        header["initial_capital"],
+        pd.Timestamp(header["start_date"]).date(),
+        pd.Timestamp(header["end_date"]).date(),
+        header["timeframe"],
+        header["extended_hours"],
+        FillReplayStrategy,
+        TraceDataHandler,
+        SimulatedBroker,
+        StandardPortfolio,
+        strategy_params={"trace": path},
+        data_handler_params={"trace": path},
+        **kwargs,
+    )
+    backtest.run()
+    return backtest
+
+
+def _format_record(index, record):
+    if record is None:
+        return f"#{index}: <end of trace>"
+    kind, now, content = record
+    content = {key: (list(value) if isinstance(value, np.ndarray) else value) for key, value in content.items()}
+    if "datetime" in content:
+        content["datetime"] = pd.Timestamp(content["datetime"])
+    return f"#{index} {KIND_NAMES[kind]} at {pd.Timestamp(now)}: {content}"
+
+
+def _records_equal(a, b):
+    if a is None or b is None or a[0] != b[0] or a[1] != b[1]:
+        return False
+    if a[2].keys() != b[2].keys():
+        return False
+    return all(np.array_equal(a[2][key], b[2][key]) for key in a[2])
+
+
+def diff_traces(path_a, path_b):
+    """Finds the first diverging record of two traces. The symbol IDs do not matter, only the symbols.
+
+    Args:
+        path_a (str): the path of the first trace
+        path_b (str): the path of the second trace
+
+    Returns:
+        tuple: the index and the records of a and b (None at the end of a trace), or None if the traces are equal
+    """
+    records_a, records_b = read_trace(path_a), read_trace(path_b)
+    index = 0
+    while True:
+        a, b = next(records_a, None), next(records_b, None)
+        if a is None and b is None:
+            return None
+        if not _records_equal(a, b):
+            return index, a, b
+        index += 1
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) != 3 or argv[0] != "diff":
+        print("Usage: python -m backtester.trace diff a.trace b.trace")
+        return 2
+
+    difference = diff_traces(argv[1], argv[2])
+    if difference is None:
+        print("The traces are equal.")
+        return 0
+    index, a, b = difference
+    print("The traces diverge at:")
+    print(f"  a {_format_record(index, a)}")
+    print(f"  b {_format_record(index, b)}")
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,209 @@
+"""Matching of fills to trades. A trade is opened by a fill and closed by one or more fills in the opposite direction, first in first out (FIFO)."""
+
+from collections import deque
+
+import numpy as np
+import pandas as pd
+
+TRADE_LOG_COLUMNS = [
+    "datetime_in",
+    "symbol",
+    "side",
+    "quantity",
+    "entry",
+    "exit",
+    "datetime_out",
+    "fees",
+    "net P/L %",
+    "net P/L $",
+    "remaining_qty",
+]
+
+
+class FifoTradeMatcher:
+    """Matches fills to trades with a FIFO queue of open trades per symbol.
+    The open trades of a symbol always have the same side, because a fill in the opposite direction closes them first.
+    Every fill only touches the trades it closes, so matching all fills is O(n).
+
+    The trades are stored column by column in plain lists. The index of a trade is its position in these lists. If the closed trades are not needed (e.g. without a trade log), discard_closed_trades() keeps only the open trades.
+    """
+
+    COLUMNS = ["datetime_in", "symbol", "side", "quantity", "entry", "exit", "datetime_out", "fees", "remaining_qty"]
+
+    def __init__(self):
+        self.datetime_in = []
+        self.symbol = []
+        self.side = []
+        self.quantity = []
+        self.entry = []
+        self.exit = []
+        self.datetime_out = []
+        self.fees = []
+        self.remaining_qty = []
+
+        self._open_trades = {}  # {'AAPL': deque([0, 3]), ...} the indices of the open trades, oldest first
+        self._open_quantity = {}  # {'AAPL': 15, ...} the remaining quantity of the open trades
+        self._open_cost = {}  # {'AAPL': 1520.5, ...} the sum of remaining quantity * entry of the open trades
+        self._n_open_trades = 0
+
+    def __len__(self):
+        return len(self.symbol)
+
+    def add_fill(self, dt, symbol, side, quantity, fill_price, fees):
+        """Processes a fill. The fill closes the open trades in the opposite direction (FIFO). If there is a remaining quantity, a new trade is opened.
+        The fees are divided over the trades pro rata of the quantity.
+
+        Returns:
+            list: the indices of the trades that were fully closed by this fill
+        """
+        open_trades = self._open_trades.get(symbol)
+        closed_trades = []
+        remaining = quantity
+
+        if open_trades and self.side[open_trades[0]] != side:
+            while remaining > 0 and open_trades:
+                index = open_trades[0]
+                remaining_qty_open_trade = self.remaining_qty[index]
+                already_filled_qty_open_trade = self.quantity[index] - remaining_qty_open_trade
+                closed_qty = min(remaining, remaining_qty_open_trade)
+
+                # Calculate new average fill
+                if already_filled_qty_open_trade == 0:
+                    self.exit[index] = fill_price
+                else:
+                    self.exit[index] = (self.exit[index] * already_filled_qty_open_trade + fill_price * closed_qty) / (
+                        already_filled_qty_open_trade + closed_qty
+                    )
+
+                self.remaining_qty[index] -= closed_qty
+                self.fees[index] += fees * closed_qty / quantity
+                remaining -= closed_qty
+                self._open_quantity[symbol] -= closed_qty
+                self._open_cost[symbol] -= closed_qty * self.entry[index]
+
+                if self.remaining_qty[index] == 0:
+                    self.datetime_out[index] = dt
+                    open_trades.popleft()
+                    closed_trades.append(index)
+                    self._n_open_trades -= 1
+
+            if not open_trades:
+                # Avoid rounding errors in the cost of a flat position
+                self._open_quantity[symbol] = 0
+                self._open_cost[symbol] = 0.0
+
+        # If no open trades in the opposite direction or there is still a remaining quantity, that is a new trade
+        if remaining > 0:
+            self.datetime_in.append(dt)
+            self.symbol.append(symbol)
+            self.side.append(side)
+            self.quantity.append(remaining)
+            self.entry.append(fill_price)
+            self.exit.append(np.nan)
+            self.datetime_out.append(pd.NaT)
+            self.fees.append(fees * remaining / quantity)
+            self.remaining_qty.append(remaining)
+
+            if open_trades is None:
+                open_trades = self._open_trades[symbol] = deque()
+            open_trades.append(len(self.symbol) - 1)
+            self._n_open_trades += 1
+            self._open_quantity[symbol] = self._open_quantity.get(symbol, 0) + remaining
+            self._open_cost[symbol] = self._open_cost.get(symbol, 0.0) + remaining * fill_price
+
+        return closed_trades
+
+    def discard_closed_trades(self):
+        """Drops the closed trades and keeps the open trades. This changes the indices of the open trades.
+        The trades are only rebuilt once the closed trades outnumber the open trades, so calling this after every fill costs O(1) per fill on average.
+        """
+        if len(self.symbol) - self._n_open_trades <= max(self._n_open_trades, 64):
+            return
+        indices = sorted(index for open_trades in self._open_trades.values() for index in open_trades)
+        for name in self.COLUMNS:
+            column = getattr(self, name)
+            setattr(self, name, [column[index] for index in indices])
+
+        new_indices = {index: new_index for new_index, index in enumerate(indices)}
+        self._open_trades = {
+            symbol: deque(new_indices[index] for index in open_trades)
+            for symbol, open_trades in self._open_trades.items()
+        }
+
+    def get_open_trades(self, symbol):
+        """Gets the indices of the open trades of a symbol, oldest first."""
+        return list(self._open_trades.get(symbol, []))
+
+    def get_open_lots(self, symbol):
+        """Gets the open lots of a symbol, oldest first.
+
+        Args:
+            symbol (str): the ticker or ID
+
+        Returns:
+            list: a tuple (datetime_in, side, remaining_qty, entry) for every open trade
+        """
+        return [
+            (self.datetime_in[index], self.side[index], self.remaining_qty[index], self.entry[index])
+            for index in self._open_trades.get(symbol, [])
+        ]
+
+    def get_average_entry(self, symbol):
+        """Gets the average entry of the open trades of a symbol, weighted by the remaining quantity. NaN if there are no open trades."""
+        quantity = self._open_quantity.get(symbol, 0)
+        return self._open_cost[symbol] / quantity if quantity != 0 else np.nan
+
+    def get_unrealized_pnl(self, symbol, price):
+        """Gets the unrealized P/L in $ of the open trades of a symbol at a price, without fees.
+
+        Args:
+            symbol (str): the ticker or ID
+            price (float): the current price
+
+        Returns:
+            float: the P/L, 0 if there are no open trades
+        """
+        open_trades = self._open_trades.get(symbol)
+        if not open_trades:
+            return 0.0
+        direction = 1 if self.side[open_trades[0]] == "BUY" else -1
+        return direction * (price * self._open_quantity[symbol] - self._open_cost[symbol])
+
+    def get_net_pnl(self, index):
+        """Gets the net P/L of a trade in % (base 100) and $, rounded like the trade log. See performance.calculate_PNL_trade_log.
+
+        Args:
+            index (int): the index of the trade
+
+        Returns:
+            tuple: the P/L in % and in $
+        """
+        # The same arithmetic as the trade log, so the results are identical
+        direction = 1 if self.side[index] == "BUY" else -1
+        gross = (self.quantity[index] - self.remaining_qty[index]) * direction * (self.exit[index] - self.entry[index])
+        invested = self.entry[index] * self.quantity[index]
+        pnl = 100 * (gross - np.round(self.fees[index], 2)) / invested
+        return float(np.round(pnl, 2)), float(np.round(pnl * 0.01 * invested, 2))
+
+    def to_df(self):
+        """Creates the trade log. The P/L columns are not calculated yet, see performance.calculate_PNL_trade_log.
+
+        Returns:
+            DataFrame: the trade log
+        """
+        return pd.DataFrame(
+            {
+                "datetime_in": pd.to_datetime(pd.Series(self.datetime_in, dtype=object)),
+                "symbol": pd.Series(self.symbol, dtype=object),
+                "side": pd.Series(self.side, dtype=object),
+                "quantity": pd.Series(self.quantity),
+                "entry": pd.Series(self.entry, dtype=float),
+                "exit": pd.Series(self.exit, dtype=float),
+                "datetime_out": pd.to_datetime(pd.Series(self.datetime_out, dtype=object)),
+                "fees": pd.Series(self.fees, dtype=float).round(2),
+                "net P/L %": np.nan,
+                "net P/L $": np.nan,
+                "remaining_qty": pd.Series(self.remaining_qty),
+            },
+            columns=TRADE_LOG_COLUMNS,
+        )
@@ -0,0 +1,110 @@
+"""Parity checks and timings of the kernels in backtester/kernels.py against the pure Python/pandas versions.
+
+Usage (from the root of the repository):
+    python benchmarks/bench_kernels.py
+    python benchmarks/bench_kernels.py --fills 100000 --bars 1000000
+
+Every kernel is checked against its reference and timed after a warm-up call, so the numba compile time is not counted.
+Without numba the kernels are the fallbacks, so the timings show the fallback against the reference.
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backtester import kernels
+from backtester.performance import _match_fills_with_kernel
+from backtester.trades import FifoTradeMatcher
+
+
+def create_fills(n_fills, n_symbols, seed=0):
+    """Random fills that open, add to, partially close and reverse positions."""
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame(
+        {
+            "symbol": rng.choice([f"S{i}" for i in range(n_symbols)], n_fills).astype(object),
+            "side": rng.choice(["BUY", "SELL"], n_fills).astype(object),
+            "quantity": rng.integers(1, 100, n_fills),
+            "fill_price": rng.uniform(10, 100, n_fills),
+            "fees": rng.uniform(1, 5, n_fills).round(2),
+        },
+        index=pd.date_range("2020-01-01", periods=n_fills, freq="1min", name="datetime"),
+    )
+
+
+def match_fills_with_matcher(fills_log):
+    matcher = FifoTradeMatcher()
+    for dt, symbol, side, quantity, fill_price, fees in zip(
+        fills_log.index,
+        fills_log["symbol"].values,
+        fills_log["side"].values,
+        fills_log["quantity"].values,
+        fills_log["fill_price"].values,
+        fills_log["fees"].values,
+    ):
+        matcher.add_fill(dt, symbol, side, quantity, fill_price, fees)
+    return matcher.to_df()
+
+
+def max_drawdown_duration_reference(gross):
+    """The original implementation in PerformanceReport."""
+    drawdown = 1 - gross / gross.cummax()
+    ATH_series = drawdown[drawdown == 0]
+    durations = ATH_series.index[1:].to_pydatetime() - ATH_series.index[:-1].to_pydatetime()
+    return durations.max()
+
+
+def measure(function, *args, repeat=3):
+    function(*args)  # Warm-up, e.g. the JIT compilation
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = function(*args)
+    return result, (time.perf_counter() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--fills", type=int, default=20000)
+    parser.add_argument("--symbols", type=int, default=50)
+    parser.add_argument("--bars", type=int, default=500000)
+    args = parser.parse_args()
+
+    print(f"Backend: {kernels.get_backend()}")
+    results = []
+
+    # FIFO trade matching
+    fills_log = create_fills(args.fills, args.symbols)
+    reference, reference_time = measure(match_fills_with_matcher, fills_log)
+    kernel, kernel_time = measure(_match_fills_with_kernel, fills_log)
+    results.append(("fifo_match", reference.equals(kernel), reference_time, kernel_time))
+
+    # Drawdown duration
+    rng = np.random.default_rng(0)
+    index = pd.date_range("2020-01-01", periods=args.bars, freq="1min")
+    gross = pd.Series(np.cumprod(1 + rng.normal(0.00002, 0.001, args.bars)), index=index)
+    reference, reference_time = measure(max_drawdown_duration_reference, gross)
+    kernel, kernel_time = measure(kernels.max_drawdown_duration, gross.values, index.asi8)
+    results.append(
+        ("max_drawdown_duration", pd.Timedelta(kernel).to_pytimedelta() == reference, reference_time, kernel_time)
+    )
+
+    # EMA
+    values = gross.values
+    reference, reference_time = measure(lambda: pd.Series(values).ewm(span=20, adjust=False).mean().to_numpy())
+    kernel, kernel_time = measure(kernels.ema, values, 20)
+    results.append(("ema", np.allclose(reference, kernel, rtol=1e-12), reference_time, kernel_time))
+
+    results = pd.DataFrame(results, columns=["kernel", "equal", "reference s", "kernel s"])
+    results["speedup"] = (results["reference s"] / results["kernel s"]).round(1)
+    print(results.to_string(index=False))
+    return 0 if results["equal"].all() else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
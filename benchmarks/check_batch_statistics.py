@@ -0,0 +1,94 @@
+"""Checks that performance.calculate_batch_statistics gives the same statistics as PerformanceReport.get_statistics and times it.
+
+Usage (from the root of the repository):
+    python benchmarks/check_batch_statistics.py
+    python benchmarks/check_batch_statistics.py --runs 2000 --days 2500
+
+Every run is a random portfolio log with random fills. The calendar has a gap of two months, so the months without periods are checked too.
+Every run is checked alone (a batch of one) and in the batch of all runs.
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backtester.performance import PerformanceReport, calculate_batch_statistics, fills_to_trades
+from backtester.portfolio import holdings_log_to_df
+
+
+def create_run(index, n_fills, seed):
+    """A random portfolio log, fills log and trade log on the index."""
+    rng = np.random.default_rng(seed)
+    equity = 100000 * np.cumprod(1 + rng.normal(0.0003, 0.01, len(index)))
+    positions_value = np.where(rng.random(len(index)) < 0.3, 0, equity * rng.uniform(0.1, 1, len(index)))
+    portfolio_log = holdings_log_to_df(
+        {
+            "datetime": index,
+            "equity": equity,
+            "cash": equity - positions_value,
+            "positions_value": positions_value,
+        }
+    )
+
+    fills_log = pd.DataFrame(
+        {
+            "symbol": rng.choice([f"S{i}" for i in range(10)], n_fills).astype(object),
+            "side": rng.choice(["BUY", "SELL"], n_fills).astype(object),
+            "quantity": rng.integers(1, 100, n_fills),
+            "fill_price": rng.uniform(10, 100, n_fills),
+            "fees": rng.uniform(1, 5, n_fills).round(2),
+        },
+        index=pd.DatetimeIndex(np.sort(rng.choice(index, n_fills)), name="datetime"),
+    )
+    return portfolio_log, fills_log, fills_to_trades(fills_log)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=50)
+    parser.add_argument("--days", type=int, default=750)
+    parser.add_argument("--fills", type=int, default=200)
+    args = parser.parse_args()
+
+    index = pd.bdate_range("2020-01-01", periods=args.days + 43)
+    index = index[(index < pd.Timestamp("2021-03-01")) | (index >= pd.Timestamp("2021-05-01"))][: args.days]
+    runs = [create_run(index, args.fills, seed) for seed in range(args.runs)]
+    portfolio_logs, fills_logs, trade_logs = ({i: run[j] for i, run in enumerate(runs)} for j in range(3))
+
+    start = time.perf_counter()
+    reference = pd.DataFrame([PerformanceReport(*run).get_statistics() for run in runs])
+    reference_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    batch = calculate_batch_statistics(portfolio_logs, fills_logs, trade_logs)
+    batch_time = time.perf_counter() - start
+
+    singles = pd.concat(
+        [
+            calculate_batch_statistics({i: portfolio_logs[i]}, {i: fills_logs[i]}, {i: trade_logs[i]})
+            for i in range(len(runs))
+        ]
+    )
+
+    results = pd.DataFrame(
+        {
+            "same keys": [list(batch.columns) == list(reference.columns)] * 2,
+            "equal": [batch.equals(reference), singles.equals(reference)],
+        },
+        index=["batch", "single runs"],
+    )
+    print(f"{args.runs} runs x {args.days} days: reports {reference_time:.3f}s, batch {batch_time:.3f}s")
+    print(results.to_string())
+    if not results.all(axis=None):
+        print(batch.compare(reference))
+    return 0 if results.all(axis=None) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
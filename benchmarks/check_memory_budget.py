@@ -0,0 +1,143 @@
+"""Checks that a memory budget does not change the results of a backtest, see Backtest(..., memory_budget=...).
+
+Usage (from the root of the repository):
+    python benchmarks/check_memory_budget.py
+    python benchmarks/check_memory_budget.py --symbols 20 --timeframe 5 --days 10
+
+The strategy reads its symbols only on Mondays, so with a tiny budget their bars are evicted between the Mondays and reloaded when they are read again.
+The backtest runs with and without the budget on a synthetic database, and the portfolio, fills and trade logs must be equal.
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import sys
+import tempfile
+from datetime import date
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def run_backtest(timeframe, symbols, start_date, end_date, memory_budget):
+    """Runs the backtest and returns the logs and the amount of evictions."""
+    import matplotlib
+
+    matplotlib.use("Agg")
+
+    from backtester.backtest import Backtest
+    from backtester.broker import SimulatedBroker
+    from backtester.data_handler import HistoricalPolygonDataHandler
+    from backtester.event import OrderEvent
+    from backtester.portfolio import StandardPortfolio
+    from backtester.strategy import Strategy
+
+    class MondayStrategy(Strategy):
+        """Reads the symbols only on Mondays. Buys one share when the close is above the SMA and sells the position otherwise."""
+
+        def __init__(self, events, data_handler, portfolio, symbols=[]):
+            self.events = events
+            self.data_handler = data_handler
+            self.portfolio = portfolio
+            self.symbols = symbols
+            self.data_handler.register_indicator("sma5", lambda close: close.rolling(5).mean())
+            for symbol in symbols:
+                self.data_handler.load_data(
+                    symbol,
+                    start_date=start_date,
+                    end_date=end_date,
+                    timeframe=timeframe,
+                    extended_hours=False,
+                    lookback=5,
+                )
+
+        def calculate_signals(self):
+            if self.data_handler.current_time.weekday() != 0:
+                return
+            for symbol in self.symbols:
+                bars = self.data_handler.get_latest_bars(symbol, N=3)
+                sma = self.data_handler.get_latest_values(symbol, "sma5")
+                if len(bars) == 0 or len(sma) == 0:
+                    continue
+                quantity = self.portfolio.current_positions.get(symbol, 0)
+                if bars["close"].iloc[-1] > sma[-1]:
+                    self.events.put(OrderEvent(self.data_handler.current_time, symbol, "BUY", 1))
+                elif quantity > 0:
+                    self.events.put(OrderEvent(self.data_handler.current_time, symbol, "SELL", quantity))
+
+        def on_market_close(self):
+            pass
+
+        def on_backtest_end(self):
+            for symbol, quantity in self.portfolio.current_positions.items():
+                if quantity > 0:
+                    self.events.put(OrderEvent(self.data_handler.current_time, symbol, "SELL", quantity))
+
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        backtest = Backtest(
+            "memory_budget",
+            100000,
+            start_date,
+            end_date,
+            timeframe,
+            False,
+            MondayStrategy,
+            HistoricalPolygonDataHandler,
+            SimulatedBroker,
+            StandardPortfolio,
+            strategy_params={"symbols": symbols},
+            plot=False,
+            memory_budget=memory_budget,
+        )
+        backtest.run()
+    evictions = output.getvalue().count("Evicted the bars of")
+    return backtest.portfolio_log, backtest.fills_log, backtest.trade_log, evictions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--symbols", type=int, default=5)
+    parser.add_argument("--timeframe", default="daily", help="'daily' or minutes, e.g. 5")
+    parser.add_argument("--days", type=int, default=120, help="the amount of trading days")
+    parser.add_argument("--budget", type=float, default=0.001, help="the memory budget in MB")
+    args = parser.parse_args()
+
+    from polygon.synthetic import create_synthetic_database
+
+    timeframe = int(args.timeframe) if args.timeframe.isdigit() else args.timeframe
+    days = pd.bdate_range(date(2020, 1, 1), periods=args.days).date
+    symbols = [f"SYN{i}-2000-01-01" for i in range(args.symbols)]
+
+    with tempfile.TemporaryDirectory() as path:
+        # The data paths are relative ('../data/'), so the backtests run in a 'work' folder next to the data
+        work_path = os.path.join(path, "work")
+        os.makedirs(os.path.join(work_path, "output"))
+        create_synthetic_database(
+            os.path.join(path, "data") + "/",
+            n_symbols=args.symbols,
+            start_date=days[0],
+            end_date=days[-1],
+            timeframes=[timeframe],
+        )
+        os.chdir(work_path)
+        reference = run_backtest(timeframe, symbols, days[0], days[-1], None)
+        budgeted = run_backtest(timeframe, symbols, days[0], days[-1], args.budget)
+        os.chdir(os.path.dirname(path))
+
+    results = pd.DataFrame(
+        [
+            (name, len(reference[i]), reference[i].equals(budgeted[i]))
+            for i, name in enumerate(["portfolio_log", "fills_log", "trade_log"])
+        ],
+        columns=["log", "rows", "equal"],
+    )
+    print(f"Evictions with a budget of {args.budget} MB: {budgeted[3]}")
+    print(results.to_string(index=False))
+    return 0 if results["equal"].all() and budgeted[3] > 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,210 @@
+"""Benchmarks of the backtester on a synthetic database, so performance regressions are visible.
+
+Usage (from the root of the repository):
+    python benchmarks/run_benchmarks.py
+    python benchmarks/run_benchmarks.py --symbols 1 50 --timeframes daily --days 250
+
+For every timeframe and amount of symbols we run a strategy that trades all symbols and measure:
+    bars/sec      symbol bars processed per second (clock bars * symbols / run time)
+    events/sec    events handled per second
+    peak memory   the peak resident memory of the process that ran the backtest
+    trades/report the time of fills_to_trades and of the performance report
+
+Every configuration runs in a fresh process, so the peak memory and the caches of one run do not affect another.
+The synthetic databases are written to a temporary folder and the backtests run in a 'work' folder next to them, because the data paths are relative ('../data/').
+"""
+
+import argparse
+import contextlib
+import io
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def warm_up_kernels():
+    """Calls every kernel once, so the timings do not include the JIT compilation or the loading of the numba cache."""
+    from backtester import kernels
+
+    kernels.fifo_match(
+        np.array(["A", "A"], dtype=object),
+        np.array(["BUY", "SELL"], dtype=object),
+        np.array([1, 1]),
+        np.array([1.0, 2.0]),
+        np.array([0.0, 0.0]),
+    )
+    kernels.max_drawdown_duration(np.array([1.0, 2.0]), np.array([0, 1]))
+    kernels.ema(np.array([1.0, 2.0]), 2)
+
+
+def run_benchmark(work_path, timeframe, n_symbols, start_date, end_date, period):
+    """Runs one backtest and measures it. This runs in a fresh process."""
+    import matplotlib
+
+    matplotlib.use("Agg")
+
+    from backtester.backtest import Backtest
+    from backtester.broker import SimulatedBroker
+    from backtester.data_handler import HistoricalPolygonDataHandler
+    from backtester.event import OrderEvent
+    from backtester.performance import PerformanceReport, fills_to_trades
+    from backtester.portfolio import StandardPortfolio
+    from backtester.report import render_report
+    from backtester.strategy import Strategy
+
+    os.chdir(work_path)
+    warm_up_kernels()
+
+    class RotationStrategy(Strategy):
+        """Reads the last bar of every symbol and buys or sells one share of every symbol once every period bars."""
+
+        def __init__(self, events, data_handler, portfolio, symbols=[], period=10):
+            self.events = events
+            self.data_handler = data_handler
+            self.portfolio = portfolio
+            self.symbols = symbols
+            self.period = period
+            self.bar = 0
+            for symbol in symbols:
+                self.data_handler.load_data(
+                    symbol,
+                    start_date=start_date,
+                    end_date=end_date,
+                    timeframe=timeframe,
+                    extended_hours=False,
+                )
+
+        def calculate_signals(self):
+            for i, symbol in enumerate(self.symbols):
+                self.data_handler.get_latest_bars(symbol, N=1)
+                if (self.bar + i) % self.period == 0:
+                    side = "SELL" if self.portfolio.current_positions.get(symbol, 0) > 0 else "BUY"
+                    self.events.put(OrderEvent(self.data_handler.current_time, symbol, side, 1))
+            self.bar += 1
+
+        def on_market_close(self):
+            pass
+
+        def on_backtest_end(self):
+            for symbol, quantity in self.portfolio.current_positions.items():
+                if quantity > 0:
+                    self.events.put(OrderEvent(self.data_handler.current_time, symbol, "SELL", quantity))
+
+    class CountingBacktest(Backtest):
+        events_handled = 0
+
+        def _handle_event(self, event):
+            self.events_handled += 1
+            super()._handle_event(event)
+
+    symbols = [f"SYN{i}-2000-01-01" for i in range(n_symbols)]
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        backtest = CountingBacktest(
+            "benchmark",
+            100000,
+            start_date,
+            end_date,
+            timeframe,
+            False,
+            RotationStrategy,
+            HistoricalPolygonDataHandler,
+            SimulatedBroker,
+            StandardPortfolio,
+            strategy_params={"symbols": symbols, "period": period},
+            plot=False,
+        )
+        backtest.run()
+    run_time = time.perf_counter() - start
+    bars = len(backtest.data_handler._market_minutes)
+
+    fills_log = backtest.fills_log
+    start = time.perf_counter()
+    fills_to_trades(fills_log)
+    trades_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    PerformanceReport(backtest.portfolio_log, fills_log, backtest.trade_log).get_statistics()
+    render_report(backtest.portfolio_log, os.path.join(work_path, "output", "benchmark.png"))
+    report_time = time.perf_counter() - start
+
+    return {
+        "timeframe": timeframe,
+        "symbols": n_symbols,
+        "bars": bars,
+        "fills": len(fills_log),
+        "run time s": round(run_time, 2),
+        "bars/sec": round(bars * n_symbols / run_time),
+        "events/sec": round(backtest.events_handled / run_time),
+        "peak memory MB": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024),  # KB on Linux
+        "fills_to_trades s": round(trades_time, 3),
+        "report s": round(report_time, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--symbols", type=int, nargs="+", default=[1, 50, 500])
+    parser.add_argument("--timeframes", nargs="+", default=["daily", "1"], help="'daily' and/or minutes, e.g. 1 5")
+    parser.add_argument("--days", type=int, default=250, help="the amount of trading days of the daily runs")
+    parser.add_argument("--minute-days", type=int, default=2, help="the amount of trading days of the minute runs")
+    parser.add_argument("--period", type=int, default=10, help="every symbol trades once every period bars")
+    parser.add_argument(
+        "--path", default=None, help="the folder for the synthetic data. Defaults to a temporary folder."
+    )
+    parser.add_argument("--output", default=None, help="a CSV file to save the results")
+    args = parser.parse_args()
+
+    from polygon.synthetic import create_synthetic_database
+
+    timeframes = [int(timeframe) if timeframe.isdigit() else timeframe for timeframe in args.timeframes]
+
+    with tempfile.TemporaryDirectory() as temporary_path:
+        path = args.path or temporary_path
+
+        results = []
+        for timeframe in timeframes:
+            # A database per timeframe, so the minute runs do not need a year of minute bars
+            n_days = args.days if timeframe == "daily" else args.minute_days
+            days = pd.bdate_range(date(2020, 1, 1), periods=n_days).date
+            timeframe_path = os.path.join(path, str(timeframe))
+            work_path = os.path.join(timeframe_path, "work")
+            os.makedirs(os.path.join(work_path, "output"), exist_ok=True)
+
+            start = time.perf_counter()
+            create_synthetic_database(
+                os.path.join(timeframe_path, "data") + "/",
+                n_symbols=max(args.symbols),
+                start_date=days[0],
+                end_date=days[-1],
+                timeframes=[timeframe],
+            )
+            print(f"Created the {timeframe} database in {time.perf_counter() - start:.1f}s")
+
+            for n_symbols in args.symbols:
+                # A fresh process for every run. Spawn instead of fork, so the memory of this process is not counted.
+                with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context("spawn")) as executor:
+                    result = executor.submit(
+                        run_benchmark, work_path, timeframe, n_symbols, days[0], days[-1], args.period
+                    ).result()
+                print(result)
+                results.append(result)
+
+    results = pd.DataFrame(results)
+    print(results.to_string(index=False))
+    if args.output is not None:
+        results.to_csv(args.output, index=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,13 +2,28 @@
 This file contains several functions for dealing with getting the data from the database we built.
 They were all made in the notebook series https://github.com/shinathan/polygon.io-stock-database.
 """
+import hashlib
+import os
+import pyarrow as pa
 import pyarrow.parquet as pq
 from datetime import datetime, date, time, timedelta
 from polygon.tickers import get_id
-from polygon.times import get_market_calendar
+from polygon.times import get_bar_labels, get_market_calendar
 
 POLYGON_DATA_PATH = "../data/polygon/"
 
+# How the columns of 1-minute bars are aggregated into longer bars
+AGGREGATION = {
+    "open": "first",
+    "high": "max",
+    "low": "min",
+    "close": "last",
+    "close_original": "last",
+    "volume": "sum",
+    "tradeable": "last",
+    "halted": "last",
+}
+
 
 def remove_extended_hours(bars):
     """
@@ -31,6 +46,92 @@ def remove_extended_hours(bars):
     return bars
 
 
+def get_folder(timeframe="daily", extended_hours=False, anchor="midnight"):
+    """Get the folder of the bars of a timeframe, relative to the location. The 1 and 5-minute bars are in the database, the other intraday timeframes are derived from the 1-minute bars.
+
+    Args:
+        timeframe (str, optional): the timeframe in minutes or 'daily'. Defaults to daily bars.
+        extended_hours (bool, optional): whether the bars include extended hours. Defaults to False.
+        anchor (str, optional): where the bars start, see polygon.times.get_bar_labels(). Defaults to 'midnight'.
+
+    Returns:
+        str: the folder
+    """
+    if timeframe == "daily":
+        return "d1"
+    elif timeframe == 1 or (timeframe == 5 and anchor == "midnight"):
+        return f"m{timeframe}"
+
+    # The regular hours are aggregated separately, because with the midnight anchor a bar can contain pre-market and regular minutes
+    folder = f"derived/m{timeframe}"
+    if anchor != "midnight":
+        folder += f"_{anchor}"
+    if not extended_hours:
+        folder += "_regular"
+    return folder
+
+
+def resample_bars(bars, timeframe, anchor="midnight"):
+    """Aggregates 1-minute bars into longer bars. Like the clock, there are only bars for the minutes with data, so gaps are not filled.
+
+    Args:
+        bars (DataFrame): the 1-minute bars with a DatetimeIndex
+        timeframe (int): the timeframe in minutes
+        anchor (str, optional): where the bars start, see polygon.times.get_bar_labels(). Defaults to 'midnight'.
+
+    Returns:
+        DataFrame: the bars, labelled by their first minute
+    """
+    aggregation = {col: AGGREGATION[col] for col in bars.columns if col in AGGREGATION}
+    labels = get_bar_labels(bars.index, timeframe, anchor).rename("datetime")
+    return bars.groupby(labels).agg(aggregation)
+
+
+def build_derived_bars(
+    id, timeframe, extended_hours=False, anchor="midnight", location="processed"
+):
+    """Builds the derived bars of an ID from the 1-minute bars, unless they are up to date. The size and modification time of the 1-minute file are stored in the metadata of the derived file, so it is rebuilt when the 1-minute file changes.
+
+    Args:
+        id (str): the ID
+        timeframe (int): the timeframe in minutes
+        extended_hours (bool, optional): whether to include extended hours. Defaults to False.
+        anchor (str, optional): where the bars start, see polygon.times.get_bar_labels(). Defaults to 'midnight'.
+        location (str): 'processed' or 'raw'. Defaults to 'processed'.
+
+    Returns:
+        str: the path of the derived file
+    """
+    source_path = POLYGON_DATA_PATH + f"{location}/m1/{id}.parquet"
+    path = (
+        POLYGON_DATA_PATH
+        + f"{location}/{get_folder(timeframe, extended_hours, anchor)}/{id}.parquet"
+    )
+
+    stat = os.stat(source_path)
+    source = {
+        b"source_size": str(stat.st_size).encode(),
+        b"source_mtime_ns": str(stat.st_mtime_ns).encode(),
+    }
+    if os.path.exists(path):
+        metadata = pq.read_schema(path).metadata or {}
+        if all(metadata.get(key) == value for key, value in source.items()):
+            return path
+
+    bars = pq.read_table(source_path).to_pandas()
+    if not extended_hours:
+        bars = remove_extended_hours(bars)
+    table = pa.Table.from_pandas(resample_bars(bars, timeframe, anchor))
+    table = table.replace_schema_metadata({**table.schema.metadata, **source})
+
+    # Write to a temporary file first, so a concurrent reader never sees half a file
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temporary_path = f"{path}.{os.getpid()}.tmp"
+    pq.write_table(table, temporary_path)
+    os.replace(temporary_path, path)
+    return path
+
+
 def get_data(
     ticker_or_id,
     start_date=date(2000, 1, 1),
@@ -48,6 +149,7 @@ def get_data(
         "tradeable",
         "halted",
     ],
+    anchor="midnight",
 ):
     """Retrieves the data from our database
 
@@ -55,10 +157,11 @@ def get_data(
         ticker_or_id (str): the ticker or ID
         start_date (date, optional): the start date (inclusive). Defaults to no bounds.
         end_date (date, optional): the end date (inclusive). Defaults to no bounds.
-        timeframe (str, optional): 1 for 1-minute, 5 for 5-minute. Defaults to daily bars.
+        timeframe (str, optional): the timeframe in minutes, e.g. 1, 5, 15 or 60. Other timeframes than 1 and 5 are derived from the 1-minute bars once, see build_derived_bars(). Defaults to daily bars.
         extended_hours (bool, optional): Whether we need to include extended hours (not applicable to daily timeframes). Defaults to True.
         location (str): 'processed' or 'raw'. Defaults to 'processed'.
         columns (list): list of columns. Defaults to all.
+        anchor (str, optional): where the intraday bars start, see polygon.times.get_bar_labels(). Defaults to 'midnight'.
 
     Returns:
         DataFrame: the output
@@ -73,9 +176,13 @@ def get_data(
         id = get_id(ticker_or_id, timeframe)
 
     # Read data
-    if timeframe in [1, 5]:
+    folder = get_folder(timeframe, extended_hours, anchor)
+    if folder.startswith("derived"):
+        build_derived_bars(id, timeframe, extended_hours, anchor, location)
+
+    if isinstance(timeframe, int):
         dataset = pq.ParquetDataset(
-            POLYGON_DATA_PATH + f"{location}/m{timeframe}/{id}.parquet",
+            POLYGON_DATA_PATH + f"{location}/{folder}/{id}.parquet",
             filters=[
                 ("datetime", ">=", datetime.combine(start_date, time(4))),
                 ("datetime", "<=", datetime.combine(end_date, time(20))),
@@ -91,8 +198,32 @@ def get_data(
         )
     df = dataset.read(columns=["datetime"] + columns).to_pandas()
 
-    # Remove extended hours if necessary
-    if not extended_hours and (timeframe in [1, 5]):
+    # Remove extended hours if necessary. The derived bars of the regular hours are already without.
+    if not extended_hours and folder in ["m1", "m5"]:
         return remove_extended_hours(df)
     else:
         return df
+
+
+def get_data_fingerprint(timeframe="daily", location="processed", anchor="midnight"):
+    """Hashes the names, sizes and modification times of the data files of a timeframe. If the data is updated, the fingerprint changes.
+
+    Args:
+        timeframe (str, optional): the timeframe in minutes. Derived timeframes use the 1-minute files. Defaults to daily bars.
+        location (str): 'processed' or 'raw'. Defaults to 'processed'.
+        anchor (str, optional): where the intraday bars start, see polygon.times.get_bar_labels(). Defaults to 'midnight'.
+
+    Returns:
+        str: the fingerprint
+    """
+    folder = get_folder(timeframe, anchor=anchor)
+    if folder.startswith("derived"):
+        folder = "m1"
+    sha = hashlib.sha1()
+    if anchor != "midnight":
+        sha.update(anchor.encode())
+    with os.scandir(POLYGON_DATA_PATH + f"{location}/{folder}/") as files:
+        for file in sorted(files, key=lambda file: file.name):
+            stat = file.stat()
+            sha.update(f"{file.name}{stat.st_size}{stat.st_mtime_ns}".encode())
+    return sha.hexdigest()[:16]
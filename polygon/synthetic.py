@@ -0,0 +1,160 @@
+"""
+This file creates a synthetic database with the same layout as the real database.
+It is used for the benchmarks and for trying out the backtester without the real data.
+
+The layout is:
+    {path}/polygon/processed/m1/{ID}.parquet
+    {path}/polygon/processed/m5/{ID}.parquet
+    {path}/polygon/processed/d1/{ID}.parquet
+    {path}/market/market_calendar.csv
+    {path}/market/trading_minutes.parquet
+    {path}/tickers_v{v}.csv
+"""
+
+import os
+import numpy as np
+import pandas as pd
+from datetime import date, datetime, time
+from polygon.data import AGGREGATION
+from polygon.times import format_market_calendar, get_calendar_minutes
+
+
+def create_market_calendar(start_date, end_date, early_closes=()):
+    """Creates a market calendar with all weekdays. There are no holidays.
+
+    Args:
+        start_date (date): the start date
+        end_date (date): the end date
+        early_closes (list, optional): the dates that close at 13:00. Defaults to none.
+
+    Returns:
+        DataFrame: the calendar in the format of market_calendar.csv
+    """
+    days = pd.bdate_range(start_date, end_date).date
+    calendar = pd.DataFrame(
+        {
+            "premarket_open": "04:00:00",
+            "regular_open": "09:30:00",
+            "regular_close": "15:59:00",
+            "postmarket_close": "19:59:00",
+        },
+        index=pd.Index(days, name="date"),
+    )
+    for day in early_closes:
+        calendar.loc[day, ["regular_close", "postmarket_close"]] = [
+            "12:59:00",
+            "16:59:00",
+        ]
+    return calendar
+
+
+def create_bars(minutes, rng, start_price=100, volatility=0.0005):
+    """Creates 1-minute bars with a geometric random walk
+
+    Args:
+        minutes (DatetimeIndex): the trading minutes
+        rng (Generator): the random generator
+        start_price (float, optional): the first open. Defaults to 100.
+        volatility (float, optional): the standard deviation of the 1-minute log returns. Defaults to 0.0005.
+
+    Returns:
+        DataFrame: the bars
+    """
+    n = len(minutes)
+    close = start_price * np.exp(np.cumsum(rng.normal(0, volatility, n)))
+    open_ = np.empty(n)
+    open_[0] = start_price
+    open_[1:] = close[:-1]
+
+    # The high and low are a bit outside the open and close
+    wicks = np.abs(rng.normal(0, volatility / 2, (2, n)))
+    high = np.maximum(open_, close) * (1 + wicks[0])
+    low = np.minimum(open_, close) * (1 - wicks[1])
+
+    return pd.DataFrame(
+        {
+            "open": open_,
+            "high": high,
+            "low": low,
+            "close": close,
+            "close_original": close,
+            "volume": rng.integers(0, 10000, n).astype(float),
+            "tradeable": True,
+            "halted": False,
+        },
+        index=minutes,
+    )
+
+
+def create_synthetic_database(
+    path="../data/",
+    n_symbols=50,
+    start_date=date(2020, 1, 1),
+    end_date=date(2020, 12, 31),
+    early_closes=(),
+    timeframes=(1, 5, "daily"),
+    v=5,
+    seed=0,
+):
+    """Creates a synthetic database. The IDs are SYN0-2000-01-01, SYN1-2000-01-01, ... and all of them are listed during the whole period.
+
+    Args:
+        path (str, optional): the data folder. Defaults to '../data/', the folder that the other modules read.
+        n_symbols (int, optional): the amount of symbols. Defaults to 50.
+        start_date (date, optional): the start date. Defaults to 2020-01-01.
+        end_date (date, optional): the end date. Defaults to 2020-12-31.
+        early_closes (list, optional): the dates that close at 13:00. Defaults to none.
+        timeframes (list, optional): the timeframes to write. Defaults to (1, 5, 'daily').
+        v (int, optional): the version of the ticker list. Defaults to 5.
+        seed (int, optional): the random seed. Defaults to 0.
+
+    Returns:
+        list: the IDs
+    """
+    market_path = os.path.join(path, "market")
+    processed_path = os.path.join(path, "polygon", "processed")
+    os.makedirs(market_path, exist_ok=True)
+    for folder in ["m1", "m5", "d1"]:
+        os.makedirs(os.path.join(processed_path, folder), exist_ok=True)
+
+    calendar = create_market_calendar(start_date, end_date, early_closes)
+    calendar.to_csv(os.path.join(market_path, "market_calendar.csv"))
+    minutes = get_calendar_minutes(format_market_calendar(calendar, "datetime"))
+    pd.DataFrame(index=minutes).to_parquet(os.path.join(market_path, "trading_minutes.parquet"))
+
+    # The daily bars only contain the regular hours
+    regular = np.zeros(len(minutes), dtype=bool)
+    for day, row in calendar.iterrows():
+        regular |= (minutes >= datetime.combine(day, time(9, 30))) & (
+            minutes <= datetime.combine(day, time.fromisoformat(row["regular_close"]))
+        )
+
+    rng = np.random.default_rng(seed)
+    IDs = [f"SYN{i}-2000-01-01" for i in range(n_symbols)]
+    for id in IDs:
+        bars = create_bars(minutes, rng, start_price=rng.uniform(10, 200))
+        if 1 in timeframes:
+            bars.to_parquet(os.path.join(processed_path, "m1", f"{id}.parquet"))
+        if 5 in timeframes:
+            bars.groupby(minutes.floor("5min")).agg(AGGREGATION).rename_axis("datetime").to_parquet(
+                os.path.join(processed_path, "m5", f"{id}.parquet")
+            )
+        if "daily" in timeframes:
+            regular_bars = bars[regular]
+            regular_bars.groupby(regular_bars.index.normalize()).agg(AGGREGATION).rename_axis("datetime").to_parquet(
+                os.path.join(processed_path, "d1", f"{id}.parquet")
+            )
+
+    tickers = pd.DataFrame(
+        {
+            "ticker": [id[:-11] for id in IDs],
+            "name": [f"Synthetic {id[:-11]}" for id in IDs],
+            "cik": "",
+            "start_date": start_date,
+            "end_date": "",
+        },
+        index=pd.Index(IDs, name="ID"),
+    )
+    tickers.to_csv(os.path.join(path, f"tickers_v{v}.csv"))
+
+    return IDs
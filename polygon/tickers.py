@@ -63,18 +63,152 @@ def get_id(ticker, timeframe="daily"):
     """Get the most recent ID corresponding to the ticker
 
     Args:
-        timeframe (int or str): 1 for 1-minute, 5 for 5-minute, else daily
+        timeframe (int or str): the timeframe in minutes (derived timeframes use the 1-minute files) or 'daily'
         ticker (str): _description_
 
     Returns:
         string: the ID
     """
-    if timeframe in [1, 5]:
-        all_files = os.listdir(POLYGON_DATA_PATH + f"processed/m{timeframe}/")
+    if timeframe == 5:
+        all_files = os.listdir(POLYGON_DATA_PATH + "processed/m5/")
+    elif isinstance(timeframe, int):
+        all_files = os.listdir(POLYGON_DATA_PATH + "processed/m1/")
 
     else:
-        all_files = os.listdir(POLYGON_DATA_PATH + f"processed/d1/")
+        all_files = os.listdir(POLYGON_DATA_PATH + "processed/d1/")
 
     all_IDs = [file[:-8] for file in all_files]
     IDs = [id for id in all_IDs if id[:-11] == ticker]
     return sorted(IDs)[-1]
+
+
+class ListingIndex:
+    """A point-in-time index over the listings of the ticker list.
+    It answers which IDs were listed on a date in O(log n + k) by using a centered interval tree, where k is the amount of listed IDs.
+    It also gives the IDs that were added or removed between two dates. Delisted IDs are included, so there is no survivorship bias.
+    """
+
+    def __init__(self, tickers):
+        """Builds the index.
+
+        Args:
+            tickers (DataFrame): the ticker list from get_tickers(). The index contains the IDs. A missing end_date means the ID is still listed.
+        """
+        self.ids = tickers.index.to_numpy()
+        self._start = self._to_days(tickers["start_date"], fill=np.iinfo(np.int64).min)
+        self._end = self._to_days(tickers["end_date"], fill=np.iinfo(np.int64).max)
+
+        # Sorted by start and end for the daily additions and removals
+        self._by_start = np.argsort(self._start, kind="stable")
+        self._sorted_start = self._start[self._by_start]
+        self._by_end = np.argsort(self._end, kind="stable")
+        self._sorted_end = self._end[self._by_end]
+
+        # The interval tree for the listed IDs on a date
+        self._tree = self._build_tree(np.arange(len(self.ids)))
+
+    @staticmethod
+    def _to_days(dates, fill):
+        """Converts dates to integer days since epoch. Missing dates are replaced by fill."""
+        days = pd.to_datetime(dates).to_numpy().astype("datetime64[D]")
+        missing = np.isnat(days)
+        days = days.astype(np.int64)
+        days[missing] = fill
+        return days
+
+    def _build_tree(self, indices):
+        """Builds a centered interval tree. Each node contains the intervals that overlap with the center, sorted by start and by end.
+
+        Returns:
+            tuple: (center, starts, by_start, ends, by_end, left node, right node) or None if empty
+        """
+        if len(indices) == 0:
+            return None
+
+        start = self._start[indices]
+        end = self._end[indices]
+        center = np.median(np.concatenate([start, end]))
+
+        left = end < center
+        right = start > center
+        overlap = ~(left | right)
+
+        overlapping = indices[overlap]
+        by_start = overlapping[np.argsort(self._start[overlapping], kind="stable")]
+        by_end = overlapping[np.argsort(self._end[overlapping], kind="stable")]
+
+        return (
+            center,
+            self._start[by_start],
+            by_start,
+            self._end[by_end],
+            by_end,
+            self._build_tree(indices[left]),
+            self._build_tree(indices[right]),
+        )
+
+    def get_listed(self, day):
+        """Gets the IDs that were listed on a date (start_date <= day <= end_date)
+
+        Args:
+            day (date): the date
+
+        Returns:
+            list: list of IDs
+        """
+        day = self._to_day(day)
+        found = []
+        node = self._tree
+        while node is not None:
+            center, starts, by_start, ends, by_end, left, right = node
+            if day < center:
+                # Every interval in this node ends after the day, so only check the start.
+                found.append(by_start[: np.searchsorted(starts, day, side="right")])
+                node = left
+            else:
+                # Every interval in this node starts before the day, so only check the end.
+                found.append(by_end[np.searchsorted(ends, day, side="left") :])
+                node = right
+
+        if len(found) == 0:
+            return []
+        return list(self.ids[np.sort(np.concatenate(found))])
+
+    def get_changes(self, previous_day, day):
+        """Gets the IDs that were listed and delisted after previous_day up to and including day.
+        IDs that were both listed and delisted in between are ignored.
+
+        Args:
+            previous_day (date): the previous (trading) date
+            day (date): the current (trading) date
+
+        Returns:
+            (list, list): the added IDs and the removed IDs
+        """
+        previous_day = self._to_day(previous_day)
+        day = self._to_day(day)
+
+        # Listed after previous_day and still listed on day
+        first = np.searchsorted(self._sorted_start, previous_day, side="right")
+        last = np.searchsorted(self._sorted_start, day, side="right")
+        added = self._by_start[first:last]
+        added = added[self._end[added] >= day]
+
+        # Delisted before day and listed on previous_day
+        first = np.searchsorted(self._sorted_end, previous_day, side="left")
+        last = np.searchsorted(self._sorted_end, day, side="left")
+        removed = self._by_end[first:last]
+        removed = removed[self._start[removed] <= previous_day]
+
+        return list(self.ids[np.sort(added)]), list(self.ids[np.sort(removed)])
+
+    @staticmethod
+    def _to_day(day):
+        return np.datetime64(day, "D").astype(np.int64)
+
+
+def get_listing_index(v=5):
+    """
+    Retrieve the ticker list as a ListingIndex. Default is 5.
+    """
+    return ListingIndex(get_tickers(v, cik_as_float=False))
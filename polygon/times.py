@@ -2,20 +2,24 @@
 This file contains several functions for dealing with dates and times for the market.
 They were all made in the notebook series https://github.com/shinathan/polygon.io-stock-database.
 """
-from datetime import datetime, date, time, timedelta
+from datetime import date, timedelta
 from functools import lru_cache
+import hashlib
+import os
+import numpy as np
 import pandas as pd
 
 POLYGON_DATA_PATH = "../data/polygon/"
 
 
 @lru_cache
-def get_market_calendar(format="time", timeframe=1):
+def get_market_calendar(format="time", timeframe=1, anchor="midnight"):
     """Retrieves the market hours
 
     Args:
         format (string): "time" or "datetime". If datetime, the columns are datetime objects. Else time objects.
         timeframe (int): the timeframe of the bars in minutes. Defaults to 1.
+        anchor (str): where the bars start, see get_bar_labels(). Defaults to 'midnight'.
 
     Returns:
         DataFrame: the index contains Date objects and the columns Time objects.
@@ -23,21 +27,38 @@ def get_market_calendar(format="time", timeframe=1):
     market_hours = pd.read_csv(
         POLYGON_DATA_PATH + "../market/market_calendar.csv", index_col=0
     )
+    return format_market_calendar(market_hours, format, timeframe, anchor)
+
+
+def format_market_calendar(market_hours, format="time", timeframe=1, anchor="midnight"):
+    """Formats a market calendar with the columns of market_calendar.csv. Also used for calendars that are not from the database.
+
+    Args:
+        market_hours (DataFrame): the index contains dates and the columns times (as strings, time or datetime objects)
+        format (string): "time" or "datetime". If datetime, the columns are datetime objects. Else time objects.
+        timeframe (int): the timeframe of the bars in minutes. Defaults to 1.
+        anchor (str): where the bars start, see get_bar_labels(). Defaults to 'midnight'.
+
+    Returns:
+        DataFrame: the index contains Date objects and the columns Time objects.
+    """
+    market_hours = market_hours.copy()
     market_hours.index = pd.to_datetime(market_hours.index).date
 
     # Get datetime objects from the date and time
     for col in market_hours.columns:
-        market_hours[col] = pd.to_datetime(
-            market_hours.index.astype(str) + " " + market_hours[col].astype(str)
-        )
-
-    # # Round down if timeframe is not 1 minute
-    market_hours["regular_close"] = market_hours["regular_close"].dt.floor(
-        f"{timeframe}min"
-    )
-    market_hours["postmarket_close"] = market_hours["postmarket_close"].dt.floor(
-        f"{timeframe}min"
-    )
+        if not pd.api.types.is_datetime64_any_dtype(market_hours[col]):
+            market_hours[col] = pd.to_datetime(
+                market_hours.index.astype(str) + " " + market_hours[col].astype(str)
+            )
+
+    # Round down to the start of the bar if timeframe is not 1 minute
+    closes = {
+        col: get_bar_labels(market_hours[col], timeframe, anchor, market_hours)
+        for col in ["regular_close", "postmarket_close"]
+    }
+    for col, labels in closes.items():
+        market_hours[col] = labels
 
     # Return time only if specified
     if format == "datetime":
@@ -48,6 +69,83 @@ def get_market_calendar(format="time", timeframe=1):
         return market_hours
 
 
+def get_bar_labels(datetimes, timeframe=1, anchor="midnight", market_hours=None):
+    """Get the label (the start) of the bar that contains every minute
+
+    The anchor decides where the bars start:
+        - 'midnight': at multiples of the timeframe since midnight, like .floor(). A 60-minute bar is 9:00-9:59, so it can contain pre-market and regular minutes.
+        - 'session': at the open of every session (the pre-market open, the regular open and the minute after the regular close), so a bar never spans two sessions. A 60-minute bar is 9:30-10:29 and the last bar of a session can be shorter.
+
+    Args:
+        datetimes (DatetimeIndex/Series): the minutes
+        timeframe (int): the length in minutes of the bars. Defaults to 1.
+        anchor (str, optional): 'midnight' or 'session'. Defaults to 'midnight'.
+        market_hours (DataFrame, optional): the calendar in the "datetime" format with a timeframe of 1, only for the 'session' anchor. Defaults to the calendar of the database.
+
+    Returns:
+        DatetimeIndex: the labels
+    """
+    datetimes = pd.DatetimeIndex(datetimes)
+    if anchor == "midnight":
+        return datetimes.floor(f"{timeframe}Min")
+    elif anchor != "session":
+        raise ValueError("The anchor must be 'midnight' or 'session'!")
+
+    if market_hours is None:
+        market_hours = get_market_calendar("datetime")
+    rows = pd.DatetimeIndex(market_hours.index).get_indexer(datetimes.normalize())
+    if (rows == -1).any():
+        raise ValueError("Some minutes are not on a market day of the calendar!")
+
+    # The start of the session of every minute, in nanoseconds
+    def nanoseconds(values):
+        return values.astype("datetime64[ns]").view(np.int64)
+
+    values = nanoseconds(datetimes.values)
+    regular_open = nanoseconds(market_hours["regular_open"].values)[rows]
+    postmarket_open = nanoseconds(market_hours["regular_close"].values)[rows]
+    postmarket_open = postmarket_open + 60 * 10**9
+    starts = nanoseconds(market_hours["premarket_open"].values)[rows]
+    starts = np.where(values >= regular_open, regular_open, starts)
+    starts = np.where(values >= postmarket_open, postmarket_open, starts)
+
+    step = timeframe * 60 * 10**9
+    labels = (starts + (values - starts) // step * step).astype("datetime64[ns]")
+    return pd.DatetimeIndex(labels, name=datetimes.name)
+
+
+def get_calendar_minutes(
+    market_hours, extended_hours=True, timeframe=1, anchor="midnight"
+):
+    """Get a DatetimeIndex of trading minutes from a market calendar instead of trading_minutes.parquet
+
+    Args:
+        market_hours (DataFrame): the calendar in the "datetime" format with a timeframe of 1, see format_market_calendar()
+        extended_hours (bool, optional): whether to include extended hours. Defaults to True.
+        timeframe (int): the length in minutes of the bars. Defaults to 1.
+        anchor (str, optional): where the bars start, see get_bar_labels(). Defaults to 'midnight'.
+
+    Returns:
+        DatetimeIndex: the result
+    """
+    if extended_hours:
+        opens, closes = market_hours["premarket_open"], market_hours["postmarket_close"]
+    else:
+        opens, closes = market_hours["regular_open"], market_hours["regular_close"]
+
+    minute = np.timedelta64(1, "m")
+    trading_datetimes = pd.DatetimeIndex(
+        np.concatenate(
+            [
+                np.arange(open, close + minute, minute)
+                for open, close in zip(opens.values, closes.values)
+            ]
+        ),
+        name="datetime",
+    )
+    return get_bar_labels(trading_datetimes, timeframe, anchor, market_hours).unique()
+
+
 def get_market_dates(start_date, end_date):
     """Get a list of market days from the market calendar
 
@@ -65,17 +163,25 @@ def get_market_dates(start_date, end_date):
     return list(market_hours)
 
 
-@lru_cache
-def get_market_minutes(start_date, end_date, extended_hours=True, timeframe=1):
-    """Get a DatetimeIndex of trading minutes
+def _get_clock_key():
+    """Hashes the sizes and modification times of the files that the clocks are built from."""
+    sha = hashlib.sha1()
+    for file in ["trading_minutes.parquet", "market_calendar.csv"]:
+        stat = os.stat(POLYGON_DATA_PATH + f"../market/{file}")
+        sha.update(f"{file}{stat.st_size}{stat.st_mtime_ns}".encode())
+    return sha.hexdigest()[:16]
+
+
+def build_clock(extended_hours=True, timeframe=1, anchor="midnight"):
+    """Builds the clock of all dates from trading_minutes.parquet
 
     Args:
-        start_date (Date): the start date
-        end_date (Date): the end date
         extended_hours (bool, optional): whether to include extended hours. Defaults to True.
         timeframe (int): the length in minutes of the bars. Defaults to 1.
+        anchor (str, optional): where the bars start, see get_bar_labels(). Defaults to 'midnight'.
+
     Returns:
-        DatetimeIndex: the result
+        ndarray: the datetimes as int64 nanoseconds
     """
     trading_datetimes = pd.read_parquet(
         POLYGON_DATA_PATH + "../market/trading_minutes.parquet"
@@ -83,12 +189,6 @@ def get_market_minutes(start_date, end_date, extended_hours=True, timeframe=1):
     trading_datetimes = pd.to_datetime(trading_datetimes.index)
     trading_datetimes = pd.DataFrame(index=trading_datetimes)
 
-    # Filter for start to end date
-    trading_datetimes = trading_datetimes[
-        (trading_datetimes.index >= datetime.combine(start_date, time(4)))
-        & (trading_datetimes.index <= datetime.combine(end_date, time(19, 59)))
-    ]
-
     # Remove extended hours if necessary
     if not extended_hours:
         from polygon.data import remove_extended_hours  # Avoid circular import
@@ -96,11 +196,72 @@ def get_market_minutes(start_date, end_date, extended_hours=True, timeframe=1):
         trading_datetimes = remove_extended_hours(trading_datetimes)
 
     # Resample if necessary. The reason we do not use .resample() is because it also fills gaps with missing data.
-    return (
-        trading_datetimes.groupby(trading_datetimes.index.floor(f"{timeframe}Min"))
-        .last()
-        .index
-    )
+    labels = get_bar_labels(trading_datetimes.index, timeframe, anchor).unique()
+    return labels.values.astype("datetime64[ns]").view(np.int64)
+
+
+@lru_cache
+def get_clock(extended_hours=True, timeframe=1, anchor="midnight"):
+    """Get the clock of all dates from the clock cache. The clock is built once and saved as an .npy file in market/clocks/, so other processes memory-map the same file instead of building it again.
+    The name of the file contains a hash of trading_minutes.parquet and market_calendar.csv, so the clock is rebuilt when these change.
+
+    Args:
+        extended_hours (bool, optional): whether to include extended hours. Defaults to True.
+        timeframe (int): the length in minutes of the bars. Defaults to 1.
+        anchor (str, optional): where the bars start, see get_bar_labels(). Defaults to 'midnight'.
+
+    Returns:
+        ndarray: a read-only memory map of the datetimes as int64 nanoseconds
+    """
+    name = f"m{timeframe}" + ("" if anchor == "midnight" else f"_{anchor}")
+    name += "" if extended_hours else "_regular"
+    folder = POLYGON_DATA_PATH + "../market/clocks/"
+    path = folder + f"{name}_{_get_clock_key()}.npy"
+
+    if not os.path.exists(path):
+        os.makedirs(folder, exist_ok=True)
+        # Write to a temporary file first, so a concurrent process never maps half a file
+        temporary_path = f"{path}.{os.getpid()}.tmp"
+        with open(temporary_path, "wb") as f:
+            np.save(f, build_clock(extended_hours, timeframe, anchor))
+        os.replace(temporary_path, path)
+
+        # Remove the outdated clocks. Other processes may still write their temporary files, so only finished clocks are removed.
+        for file in os.listdir(folder):
+            stem, extension = os.path.splitext(file)
+            outdated = stem.rsplit("_", 1)[0] == name and folder + file != path
+            if extension == ".npy" and outdated:
+                try:
+                    os.remove(folder + file)
+                except FileNotFoundError:
+                    pass  # Another process removed it first
+
+    return np.load(path, mmap_mode="r")
+
+
+@lru_cache
+def get_market_minutes(
+    start_date, end_date, extended_hours=True, timeframe=1, anchor="midnight"
+):
+    """Get a DatetimeIndex of trading minutes. The range is sliced from the cached clock, see get_clock().
+
+    Args:
+        start_date (Date): the start date
+        end_date (Date): the end date
+        extended_hours (bool, optional): whether to include extended hours. Defaults to True.
+        timeframe (int): the length in minutes of the bars. Defaults to 1.
+        anchor (str, optional): where the bars start, see get_bar_labels(). Defaults to 'midnight'.
+    Returns:
+        DatetimeIndex: the result
+    """
+    clock = get_clock(extended_hours, timeframe, anchor)
+
+    # The bars of a date start and end on that date, so we can slice by date
+    bounds = np.array(
+        [start_date, end_date + timedelta(days=1)], dtype="datetime64[ns]"
+    ).view(np.int64)
+    start, end = np.searchsorted(clock, bounds)
+    return pd.DatetimeIndex(clock[start:end].view("datetime64[ns]"), name="datetime")
 
 
 def first_trading_date_after_equal(dt):